@@ -0,0 +1,175 @@
+import hashlib
+from concurrent.futures import wait
+
+from flask import Blueprint, current_app, jsonify, request, session
+
+import cache
+import db
+import events
+import gate
+import lot_search
+
+# ---------------------- JSON API ----------------------
+#
+# Lightweight availability endpoints for kiosks and the admin floor view.
+# Every lot has a version counter that a trigger bumps on each change to
+# its row (booking, release, edit, slot removal). Responses carry an ETag
+# built from those versions, so an unchanged poll is answered with 304
+# from the parking_lots primary key alone, without reading bookings.
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+MAX_BULK_IDS = 500
+# Each open event stream holds a server thread under WSGI; asgi.py raises
+# the limit, since there a stream only holds a socket and a queue
+MAX_EVENT_SUBSCRIBERS = 200
+# Where lot_events_view leaves the subscriber for asgi.py to stream itself
+SUBSCRIBER_ENVIRON_KEY = 'parking.events_subscriber'
+
+
+def lot_availability(row):
+    capacity = row['maximum_number_of_spots'] or 0
+    available = row['availability'] if row['availability'] is not None else 0
+    return {
+        'id': row['id'],
+        'capacity': capacity,
+        'available': available,
+        'occupied': capacity - available,
+        'version': row['version'],
+    }
+
+
+def _lot_ids_arg():
+    ids = request.args.get('ids')
+    if not ids:
+        return None
+    return sorted({int(i) for i in ids.split(',') if i.strip()})[:MAX_BULK_IDS]
+
+
+def _conditional(etag, build):
+    # 304 if the client already has this version, otherwise build() as JSON
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/lots/<int:lot_id>/availability')
+def lot_availability_view(lot_id):
+    row = db.get_db().execute(
+        'SELECT id, maximum_number_of_spots, availability, version FROM parking_lots WHERE id = ?',
+        (lot_id,),
+    ).fetchone()
+    if row is None:
+        return jsonify({'error': 'lot not found'}), 404
+    return _conditional('lot-%d-v%d' % (row['id'], row['version']), lambda: lot_availability(row))
+
+
+@bp.route('/lots/availability')
+def bulk_availability_view():
+    # ?ids=1,2,3 for specific lots, or every lot when omitted
+    conn = db.get_db()
+    try:
+        lot_ids = _lot_ids_arg()
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma separated list of integers'}), 400
+    if lot_ids:
+        rows = conn.execute(
+            'SELECT id, maximum_number_of_spots, availability, version FROM parking_lots WHERE id IN (%s) ORDER BY id'
+            % ', '.join('?' * len(lot_ids)),
+            lot_ids,
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT id, maximum_number_of_spots, availability, version FROM parking_lots ORDER BY id'
+            '  -- full-scan-ok: every lot requested'
+        ).fetchall()
+    digest = hashlib.sha1(','.join('%d:%d' % (row['id'], row['version']) for row in rows).encode()).hexdigest()
+    return _conditional('lots-' + digest, lambda: {'lots': [lot_availability(row) for row in rows]})
+
+
+@bp.route('/lots/nearest')
+def nearest_lots_view():
+    # ?lat=..&lon=..[&k=5]: the closest lots with a free spot, nearest first
+    near = lot_search.point(request.args.get('lat'), request.args.get('lon'))
+    if near is None:
+        return jsonify({'error': 'lat and lon must be decimal degrees'}), 400
+    try:
+        k = min(max(1, int(request.args.get('k', lot_search.NEAREST_RESULTS))), lot_search.MAX_NEAREST)
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    conn = db.get_db()
+    nearest = lot_search.nearest_lots(conn, near[0], near[1], k=k)
+    lots = {lot['id']: lot for lot in cache.get_lots(conn, [lot_id for lot_id, _ in nearest])}
+    return jsonify({'lots': [
+        dict(lot_availability(lots[lot_id]), name=lots[lot_id]['prime_location_name'],
+             latitude=lots[lot_id]['latitude'], longitude=lots[lot_id]['longitude'], distance_km=round(km, 3))
+        for lot_id, km in nearest if lot_id in lots
+    ]})
+
+
+@bp.route('/lots/events')
+def lot_events_view():
+    # Server-sent events with occupancy deltas, optionally for ?ids=1,2,3.
+    # Clients fetch /lots/availability once, then apply the deltas. Open to
+    # an admin session (the dashboard) or "Authorization: Bearer
+    # <EVENTS_TOKEN>", since every stream holds one of the subscriber slots.
+    token = current_app.config.get('EVENTS_TOKEN')
+    if 'admin_id' not in session and not (token and request.headers.get('Authorization') == 'Bearer ' + token):
+        return jsonify({'error': 'admin session or events token required'}), 401
+    try:
+        lot_ids = _lot_ids_arg()
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma separated list of integers'}), 400
+    limit = current_app.config.get('EVENTS_MAX_SUBSCRIBERS', MAX_EVENT_SUBSCRIBERS)
+    if events.broker.subscriber_count() >= limit:
+        response = jsonify({'error': 'too many event subscribers'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    subscriber = events.broker.subscribe(lot_ids)
+    request.environ[SUBSCRIBER_ENVIRON_KEY] = subscriber
+    response = current_app.response_class(events.broker.stream(subscriber), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+
+@bp.route('/gate/events', methods=['POST'])
+def gate_events_view():
+    # One event, {"type": "entry"|"exit", "lot_id": 3, "vehicle_no": "TN01AB1234"
+    # [, "user_id": 7]}, or {"events": [...]} from a gate that buffered a few.
+    # Results come back in the same order once their batch has committed.
+    token = current_app.config['GATE_TOKEN']
+    if not token or request.headers.get('Authorization') != 'Bearer ' + token:
+        return jsonify({'error': 'gate token required'}), 401
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and 'events' in body:
+        raw_events = body['events']
+    else:
+        raw_events = [body]
+    if not isinstance(raw_events, list) or not raw_events:
+        return jsonify({'error': 'send an event object or {"events": [...]}'}), 400
+    if len(raw_events) > gate.MAX_EVENTS_PER_REQUEST:
+        return jsonify({'error': 'at most %d events per request' % gate.MAX_EVENTS_PER_REQUEST}), 400
+    try:
+        futures = gate.submit(current_app, raw_events)
+    except gate.Busy:
+        response = jsonify({'error': 'gate queue is full, retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    wait(futures, timeout=current_app.config['GATE_RESULT_TIMEOUT'])
+    results = []
+    for future in futures:
+        if not future.done():
+            # Still queued; it may yet be written, so the gate should not resend it blindly
+            results.append({'ok': False, 'error': 'timed out waiting for the write', 'pending': True})
+        elif future.exception() is not None:
+            results.append({'ok': False, 'error': str(future.exception())})
+        else:
+            results.append(dict(future.result(), ok=True))
+    return jsonify({'results': results})
@@ -1,16 +1,58 @@
-from flask import Flask, render_template, request, redirect, session
+from flask import Flask, render_template, request, redirect, session, flash, url_for, jsonify, stream_with_context
 import sqlite3
 import os
 from datetime import datetime
-import math
+
+import api
+import booking_engine
+import bulk
+import cache
+import changes
+import charts
+import db
+import events
+import fragments
+import gate
+import lot_search
+import occupancy
+import overstay
+import pagination
+import passwords
+import profiling
+import tariffs
 
 app = Flask(__name__)
-app.secret_key = 'super-secret-key'
+# Set both in the environment for deployment (see prefork.py)
+app.secret_key = os.environ.get('PARKING_SECRET_KEY', 'super-secret-key')
+app.config['DATABASE'] = os.environ.get('PARKING_DATABASE', os.path.join(app.root_path, 'database', 'users.db'))
+app.config['ARCHIVE_DATABASE'] = os.environ.get('PARKING_ARCHIVE_DATABASE')
+app.config['GATE_TOKEN'] = os.environ.get('PARKING_GATE_TOKEN')
+app.config['GATE_USER_ID'] = os.environ.get('PARKING_GATE_USER_ID')
+app.config['EVENTS_TOKEN'] = os.environ.get('PARKING_EVENTS_TOKEN')
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('PARKING_TEMPLATE_CACHE_DIR')
+db.init_app(app)
+changes.init_app(app)
+charts.init_app(app)
+fragments.init_app(app)
+gate.init_app(app)
+overstay.init_app(app)
+passwords.init_app(app)
+profiling.init_app(app)
+app.register_blueprint(api.bp)
 
 def get_db_connection():
-    conn = sqlite3.connect('database/users.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    # Pooled connection for this app context; it goes back to the pool
+    # on teardown, so routes don't close it themselves.
+    return db.get_db()
+
+def page_links(page):
+    # Next/previous URLs for a pagination.Page, keeping the other query args
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    next_url = url_for(request.endpoint, **dict(args, after=page.next_cursor)) if page.next_cursor else None
+    prev_url = url_for(request.endpoint, **dict(args, before=page.prev_cursor)) if page.prev_cursor else None
+    return next_url, prev_url
 
 # ---------------------- User Routes ----------------------
 
@@ -27,6 +69,10 @@ def user_register():
         address = request.form['address']
         email = request.form['email']
         conn = get_db_connection()
+        try:
+            password = passwords.make_hash(password)
+        except passwords.Busy:
+            return render_template('user/user_register.html', error="Too many sign-ins right now, please try again."), 503
         try:
             conn.execute(
                 'INSERT INTO users (full_name, password, address, pincode, email) VALUES (?, ?, ?, ?, ?)',
@@ -36,8 +82,6 @@ def user_register():
             return redirect(url_for('user_login'))  # redirect to login after success
         except sqlite3.IntegrityError:
             return render_template('user/user_register.html', error="Username or email already exists.")
-        finally:
-            conn.close()
     return render_template('user/user_register.html')
 
 
@@ -49,8 +93,11 @@ def user_login():
     username = request.form['username']
     password = request.form['password']
     conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE full_name=? AND password=?', (username, password)).fetchone()
-    conn.close()
+    candidates = conn.execute('SELECT id, password FROM users WHERE full_name=?', (username,)).fetchall()
+    try:
+        user = passwords.authenticate(conn, candidates, password, 'UPDATE users SET password = ? WHERE id = ?')
+    except passwords.Busy:
+        return render_template('user/user_login.html', error="Too many sign-ins right now, please try again."), 503
     if user:
         session['user_id'] = user['id']
         return redirect(url_for('user_dashboard'))
@@ -67,22 +114,21 @@ def user_dashboard():
 
     user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
 
-    parking_history = conn.execute('''
-    SELECT b.id, p.prime_location_name AS location, b.vehicle_no, b.timestamp, b.active, p.price
-    FROM bookings b
-    JOIN parking_lots p ON b.parking_lot_id = p.id
-    WHERE b.user_id = ?
-    ORDER BY b.timestamp DESC
-''', (user['id'],)).fetchall()
-
-
-
-    conn.close()
+    # One page of the user's parking history, newest first
+    history = pagination.booking_history(
+        conn, user['id'],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        size=pagination.page_size(request.args.get('size')),
+    )
+    history_next, history_prev = page_links(history)
 
     return render_template(
     'user/user_dashboard.html',
     user=dict(user),
-    parking_history=[dict(row) for row in parking_history]
+    parking_history=history.rows,
+    history_next=history_next,
+    history_prev=history_prev
 )
 
 
@@ -101,31 +147,50 @@ def user_summary():
         (user_id,)
     ).fetchone()
 
-    # Fetch booking count per parking lot
-    rows = cursor.execute(
+    lot_labels, lot_counts = user_booking_counts(conn, user_id)
+
+    return render_template(
+        "user/user_summary.html",
+        lot_labels=lot_labels,
+        lot_counts=lot_counts,
+        server_charts=app.config['SERVER_CHARTS'],
+        user=user  # ✅ Pass user to the template
+    )
+
+
+def user_booking_counts(conn, user_id):
+    # Booking count per parking lot, from the precomputed rollup
+    rows = conn.execute(
         """
         SELECT parking_lots.prime_location_name AS lot_name,
-               COUNT(bookings.id) AS booking_count
-        FROM bookings
-        JOIN parking_lots ON bookings.parking_lot_id = parking_lots.id
-        WHERE bookings.user_id = ?
-        GROUP BY bookings.parking_lot_id
+               user_lot_stats.bookings AS booking_count
+        FROM user_lot_stats
+        JOIN parking_lots ON user_lot_stats.parking_lot_id = parking_lots.id
+        WHERE user_lot_stats.user_id = ?
         ORDER BY booking_count DESC
         """,
         (user_id,)
     ).fetchall()
+    return [row["lot_name"] for row in rows], [row["booking_count"] for row in rows]
 
-    conn.close()
 
-    lot_labels = [row["lot_name"] for row in rows]
-    lot_counts = [row["booking_count"] for row in rows]
+def chart_response(kind, *series):
+    # PNG from charts.py; its data version is the ETag
+    version, png = charts.render(kind, *series)
+    if version in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(png, mimetype='image/png')
+    response.set_etag(version)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-    return render_template(
-        "user/user_summary.html",
-        lot_labels=lot_labels,
-        lot_counts=lot_counts,
-        user=user  # ✅ Pass user to the template
-    )
+
+@app.route("/user/summary/bookings.png")
+def user_summary_chart():
+    if "user_id" not in session:
+        return redirect("/")
+    return chart_response('bookings', *user_booking_counts(get_db_connection(), session["user_id"]))
 
 
 
@@ -136,58 +201,48 @@ def search_parking():
         return redirect('/')
 
     search_query = request.args.get('query', '').strip()
+    near = lot_search.point(request.args.get('lat'), request.args.get('lon'))
     conn = get_db_connection()
 
-    try:
-        int_val = int(search_query)
-        raw_results = conn.execute('''
-            SELECT id, prime_location_name, price, address, availability 
-            FROM parking_lots
-            WHERE id = ? OR pin_code = ?
-        ''', (int_val, int_val)).fetchall()
-    except ValueError:
-        raw_results = conn.execute('''
-            SELECT id, prime_location_name, price, address, availability 
-            FROM parking_lots
-            WHERE pin_code = ? OR lower(prime_location_name) LIKE ?
-        ''', (search_query, '%' + search_query.lower() + '%')).fetchall()
+    if near:
+        # The closest lots with a free spot, nearest first
+        distances = dict(lot_search.nearest_lots(conn, near[0], near[1]))
+        raw_results = cache.get_lots(conn, list(distances))
+    else:
+        # Matching ids from the search index, lot records from the cache
+        distances = {}
+        raw_results = cache.get_lots(conn, lot_search.search_lot_ids(conn, search_query))
 
-    # Add next_spot_id to each parking lot
+    # Free spot count and the first few free spots for each lot
+    occupancy.allocators.load(conn, raw_results)
     results = []
     for row in raw_results:
         lot = dict(row)
-        # Fetch capacity and booked spots
-        lot_data = conn.execute("SELECT maximum_number_of_spots FROM parking_lots WHERE id = ?", (lot['id'],)).fetchone()
-        capacity = lot_data['maximum_number_of_spots']
-
-        booked_spots = conn.execute("SELECT spot_id FROM bookings WHERE parking_lot_id = ? AND active = 1", (lot['id'],)).fetchall()
-        booked_ids = {row['spot_id'] for row in booked_spots}
-
-# Get list of available spot IDs
-        lot['available_spots'] = [i for i in range(1, capacity + 1) if i not in booked_ids]
-
+        lot['free_count'], lot['available_spots'] = occupancy.allocators.sample(lot['id'])
+        lot['distance_km'] = distances.get(lot['id'])
         results.append(lot)
 
     # Fetch logged-in user info
     user = conn.execute("SELECT * FROM users WHERE id = ?", (session['user_id'],)).fetchone()
 
-    # Fetch user's parking history
-    parking_history = conn.execute('''
-        SELECT b.id, p.prime_location_name AS location, b.vehicle_no, b.timestamp, b.active
-        FROM bookings b
-        JOIN parking_lots p ON b.parking_lot_id = p.id
-        WHERE b.user_id = ?
-        ORDER BY b.timestamp DESC
-    ''', (user['id'],)).fetchall()
-
-    conn.close()
+    # Fetch one page of the user's parking history
+    history = pagination.booking_history(
+        conn, user['id'],
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        size=pagination.page_size(request.args.get('size')),
+    )
+    history_next, history_prev = page_links(history)
 
     return render_template(
         'user/user_dashboard.html',
         user=dict(user),
-        parking_history=[dict(row) for row in parking_history],
+        parking_history=history.rows,
+        history_next=history_next,
+        history_prev=history_prev,
         search_results=results,
-        query=search_query
+        query=search_query,
+        near=near
     )
 
 
@@ -208,17 +263,20 @@ def user_edit_profile():
         password = request.form['password']
         address = request.form['address']
         pincode = request.form['pincode']
+        try:
+            # A blank password field keeps the current one
+            password = passwords.make_hash(password) if password else None
+        except passwords.Busy:
+            return render_template('user/user_edit_profile.html', user=user, error="Server is busy, please try again."), 503
 
         conn.execute("""
             UPDATE users
-            SET full_name = ?, email = ?, password = ?, address = ?, pincode = ?
+            SET full_name = ?, email = ?, password = IFNULL(?, password), address = ?, pincode = ?
             WHERE id = ?
         """, (full_name, email, password, address, pincode, user_id))
         conn.commit()
-        conn.close()
         return redirect(url_for('user_dashboard'))
 
-    conn.close()
     return render_template('user/user_edit_profile.html', user=user)
 
 @app.route('/book_lot/<int:lot_id>', methods=['POST'])
@@ -227,24 +285,15 @@ def book_lot(lot_id):
         return redirect('/')
     conn = get_db_connection()
     vehicle_no = request.form['vehicle_no']
-    user_id = session['user_id']
-    cur = conn.cursor()
-    cur.execute("SELECT availability FROM parking_lots WHERE id = ?", (lot_id,))
-    lot = cur.fetchone()
-    if lot and lot['availability'] > 0:
-        spot_id = request.form['spot_id']
-        cur.execute("SELECT price FROM parking_lots WHERE id = ?", (lot_id,))
-        price = cur.fetchone()['price']
-        cur.execute("""
-            INSERT INTO bookings (spot_id, parking_lot_id, user_id, vehicle_no, timestamp, active, estimated_cost)
-            VALUES (?, ?, ?, ?, datetime('now'), 1, 0)
-        """, (spot_id, lot_id, user_id, vehicle_no))
-        cur.execute("UPDATE parking_lots SET availability = availability - 1 WHERE id = ?", (lot_id,))
-        conn.commit()
+    spot_id = request.form.get('spot_id', type=int)
+    try:
+        booking_id, spot_id = booking_engine.reserve_spot(conn, lot_id, session['user_id'], vehicle_no, spot_id)
+        changes.apply_spot(lot_id, spot_id, True)
         flash("Booking successful!", "success")
-    else:
-        flash("No availability for this parking lot.", "error")
-    conn.close()
+    except booking_engine.BookingError as e:
+        # Our view of the lot may be stale; rebuild it on the next search
+        occupancy.allocators.discard(lot_id)
+        flash(str(e), "error")
     return redirect(url_for('user_dashboard'))
 
 @app.route("/release_booking/<int:booking_id>", methods=["POST"])
@@ -252,38 +301,10 @@ def release_booking(booking_id):
     if "user_id" not in session:
         return redirect("/")
     conn = get_db_connection()
-    booking = conn.execute(
-        """
-        SELECT b.parking_lot_id, b.timestamp, p.price
-        FROM bookings b
-        JOIN parking_lots p ON b.parking_lot_id = p.id
-        WHERE b.id = ? AND b.user_id = ?
-        """,
-        (booking_id, session["user_id"]),
-    ).fetchone()
-    if booking:
-        start_time = datetime.fromisoformat(booking["timestamp"])
-        now = datetime.now()
-        duration_hours = max(1, math.ceil((now - start_time).total_seconds() / 3600))
-        estimated_cost = round(duration_hours * booking["price"], 2)
-        conn.execute(
-            """
-            UPDATE bookings
-            SET active = 0, estimated_cost = ?
-            WHERE id = ? AND user_id = ?
-            """,
-            (estimated_cost, booking_id, session["user_id"]),
-        )
-        conn.execute(
-            """
-            UPDATE parking_lots
-            SET availability = availability + 1
-            WHERE id = ?
-            """,
-            (booking["parking_lot_id"],),
-        )
-        conn.commit()
-    conn.close()
+    released = booking_engine.release_spot(conn, booking_id, session["user_id"])
+    if released:
+        lot_id, spot_id, _ = released
+        changes.apply_spot(lot_id, spot_id, False)
     return redirect(url_for("user_dashboard"))
 
 
@@ -296,15 +317,17 @@ def admin_login():
         username = request.form['username']
         password = request.form['password']
         conn = get_db_connection()
-        admin = conn.execute('SELECT * FROM admin WHERE username=? AND password=?', (username, password)).fetchone()
-        conn.close()
+        candidates = conn.execute('SELECT id, password FROM admin WHERE username=?', (username,)).fetchall()
+        try:
+            admin = passwords.authenticate(conn, candidates, password, 'UPDATE admin SET password = ? WHERE id = ?')
+        except passwords.Busy:
+            return "Too many sign-ins right now, please try again.", 503
         if admin:
             session['admin_id'] = admin['id']
             return redirect('/admin_dashboard')
         return "Invalid admin credentials."
     return render_template('admin/admin_login.html')
 
-from flask import render_template, request, redirect, session, flash, url_for
 
 @app.route('/admin/edit_profile', methods=['GET', 'POST'])
 def edit_profile():
@@ -319,21 +342,29 @@ def edit_profile():
         username = request.form['username']
         email = request.form['email']
         password = request.form['password']
+        try:
+            # A blank password field keeps the current one
+            password = passwords.make_hash(password) if password else None
+        except passwords.Busy:
+            flash('Server is busy, please try again.', 'error')
+            return redirect(url_for('admin_dashboard'))
 
         conn.execute("""
             UPDATE admin
-            SET username = ?, email = ?, password = ?
+            SET username = ?, email = ?, password = IFNULL(?, password)
             WHERE id = ?
         """, (username, email, password, admin_id))
         conn.commit()
         flash('Profile updated successfully!', 'success')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
 
     # Do not render edit_profile.html anymore
     return redirect(url_for('admin_dashboard'))
 
 
+LOT_CARD = 'admin/lot_card.html'
+
+
 @app.route('/admin_dashboard')
 def admin_dashboard():
     if 'admin_id' not in session:
@@ -347,52 +378,23 @@ def admin_dashboard():
 
     search_query = request.args.get('search_query')
 
-    if search_query:
-        try:
-            int_val = int(search_query)
-            lots = conn.execute('''
-                SELECT * FROM parking_lots
-                WHERE id = ? OR pin_code = ?
-            ''', (int_val, int_val)).fetchall()
-        except ValueError:
-            lots = conn.execute('''
-                SELECT * FROM parking_lots
-                WHERE prime_location_name LIKE ?
-            ''', ('%' + search_query + '%',)).fetchall()
+    lots = lot_search.search_lots(conn, search_query)
+
+    # Cards of lots unchanged since they were last rendered come from the
+    # fragment cache; bookings are only read for the rest
+    lot_cards = fragments.cached_lots(LOT_CARD, lots)
+    stale = [lot for lot in lots if lot['id'] not in lot_cards]
+    if search_query or len(stale) < len(lots):
+        active_bookings = occupancy.active_bookings_by_lot(conn, [lot['id'] for lot in stale])
     else:
-        lots = conn.execute('SELECT * FROM parking_lots').fetchall()
+        active_bookings = occupancy.active_bookings_by_lot(conn)
 
-    enriched_lots = []
-    for lot in lots:
+    for lot in stale:
         capacity = lot['maximum_number_of_spots'] if lot['maximum_number_of_spots'] is not None else 0
         availability = lot['availability'] if lot['availability'] is not None else 0
         occupied = capacity - availability
 
-        bookings = conn.execute('SELECT * FROM bookings WHERE parking_lot_id=?', (lot['id'],)).fetchall()
-
-        slots = []
-        for booking in bookings:
-            if booking['active'] == 1:
-                slots.append({
-            'id': booking['id'],  # Booking ID
-            'slot_id': booking['spot_id'],  # Actual slot ID
-            'occupied': True,
-            'user_id': booking['user_id'],
-            'vehicle_no': booking['vehicle_no'],
-            'timestamp': booking['timestamp'],
-            'cost': booking['estimated_cost'] if booking['estimated_cost'] is not None else lot['price']
-        })
-
-
-
-
-        for _ in range(capacity - len(slots)):
-            slots.append({
-                'id': None,
-                'occupied': False
-            })
-
-        enriched_lots.append({
+        lot_summary = {
             'id': lot['id'],
             'prime_location_name': lot['prime_location_name'],
             'address': lot['address'],
@@ -400,16 +402,18 @@ def admin_dashboard():
             'price': lot['price'],
             'capacity': capacity,
             'occupied': occupied,
-            'slots': slots
-        })
-
-    users = conn.execute('SELECT * FROM users').fetchall()
-    conn.close()
+            'latitude': lot['latitude'],
+            'longitude': lot['longitude'],
+        }
+        # Occupied slots individually, free spots as ranges
+        lot_summary.update(occupancy.slot_summary(capacity, active_bookings.get(lot['id'], []), lot['price']))
+        lot_cards[lot['id']] = fragments.render_lot(LOT_CARD, lot['id'], lot['version'], lot=lot_summary)
 
     return render_template(
     'admin/admin_dashboard.html',
-    parking_lots=enriched_lots,
-    users=users,
+    lot_cards=[lot_cards[lot['id']] for lot in lots],
+    overstays=overstay.list_overstays(conn, app.config['OVERSTAY_HOURS'], limit=20),
+    overstay_hours=app.config['OVERSTAY_HOURS'],
     admin=admin,
     current_time=datetime.now()  # ✅ Include current timestamp
 )
@@ -417,6 +421,70 @@ def admin_dashboard():
 
 
 
+@app.route('/admin/lot/<int:lot_id>/slots')
+def lot_slots(lot_id):
+    if 'admin_id' not in session:
+        return redirect('/')
+
+    conn = get_db_connection()
+    lot = cache.get_lot(conn, lot_id)
+    if lot is None:
+        return redirect(url_for('admin_dashboard'))
+
+    capacity = lot['maximum_number_of_spots'] or 0
+    pages = occupancy.page_count(capacity)
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    first = (page - 1) * occupancy.SLOT_PAGE_SIZE + 1
+    last = page * occupancy.SLOT_PAGE_SIZE
+
+    # Only the active bookings on this page of spots
+    bookings = conn.execute('''
+        SELECT id, parking_lot_id, spot_id, user_id, vehicle_no, timestamp, estimated_cost
+        FROM bookings
+        WHERE parking_lot_id = ? AND active = 1 AND spot_id BETWEEN ? AND ?
+    ''', (lot_id, first, last)).fetchall()
+
+    return render_template(
+        'admin/lot_slots.html',
+        lot=lot,
+        slots=occupancy.slot_page(capacity, bookings, lot['price'], page),
+        page=page,
+        pages=pages,
+        tariff=conn.execute('SELECT * FROM lot_tariffs WHERE parking_lot_id = ?', (lot_id,)).fetchone(),
+    )
+
+
+def _minute_of_day(value):
+    # 'HH:MM' from a time input
+    if not value:
+        return 0
+    hours, minutes = value.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+@app.route('/admin/lot/<int:lot_id>/tariff', methods=['POST'])
+def save_lot_tariff(lot_id):
+    if 'admin_id' not in session:
+        return redirect('/')
+    form = request.form
+    try:
+        tariffs.save(
+            get_db_connection(), lot_id,
+            peak_rate=float(form['peak_rate']) if form.get('peak_rate') else None,
+            peak_start=_minute_of_day(form.get('peak_start')),
+            peak_end=_minute_of_day(form.get('peak_end')),
+            daily_cap=float(form['daily_cap']) if form.get('daily_cap') else None,
+            grace_minutes=int(form.get('grace_minutes') or 0),
+            unit_minutes=int(form.get('unit_minutes') or 60),
+        )
+    except ValueError as e:
+        flash("Tariff not saved: %s" % e, "error")
+    else:
+        get_db_connection().commit()
+        flash("Tariff saved.", "success")
+    return redirect(url_for('lot_slots', lot_id=lot_id))
+
+
 @app.route('/delete_available_slot', methods=['POST'])
 def delete_available_slot():
     if 'admin_id' not in session:
@@ -438,9 +506,11 @@ def delete_available_slot():
                 maximum_number_of_spots = maximum_number_of_spots - 1
             WHERE id = ? AND availability > 0
         ''', (lot_id,))
+        fields = {'capacity': lot['maximum_number_of_spots'] - 1, 'available': lot['availability'] - 1}
+        changes.record_lot(conn, lot_id, **fields)
         conn.commit()
+        changes.apply_lot(lot_id, **fields)
 
-    conn.close()
     return redirect(url_for('admin_dashboard'))
 
 
@@ -450,13 +520,16 @@ def create_parking_lot():
         return redirect('/')
     data = request.form
     spots = int(data['spots'])
+    # Optional; a lot without coordinates is left out of nearest-lot search
+    latitude, longitude = lot_search.point(data.get('latitude'), data.get('longitude')) or (None, None)
     conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots, availability)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (data['location'], data['price'], data['address'], data['pin_code'], spots, spots))
+    cur = conn.execute('''
+        INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots, availability,
+                                  latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (data['location'], data['price'], data['address'], data['pin_code'], spots, spots, latitude, longitude))
     conn.commit()
-    conn.close()
+    cache.invalidate_lot(cur.lastrowid)
     return redirect('/admin_dashboard')
 
 
@@ -471,15 +544,50 @@ def edit_lot():
     pin_code = request.form['pin_code']
     price = request.form['price']
     spots = request.form['spots']
+    latitude, longitude = lot_search.point(request.form.get('latitude'), request.form.get('longitude')) or (None, None)
+
+    try:
+        lot_id, spots = int(lot_id), int(spots)
+        if spots < 0:
+            raise ValueError
+    except ValueError:
+        flash('Lot not updated: spots must be a whole number, 0 or more.', 'error')
+        return redirect('/admin_dashboard')
 
     conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    # Availability moves with the capacity. A lot can't shrink below its
+    # occupied spots, or drop a spot that is booked right now; the write
+    # lock keeps both checks true until the commit.
+    lot = conn.execute(
+        'SELECT maximum_number_of_spots, availability FROM parking_lots WHERE id = ?', (lot_id,)
+    ).fetchone()
+    error = None
+    if lot is None:
+        error = 'Lot #%d does not exist.' % lot_id
+    else:
+        occupied = lot['maximum_number_of_spots'] - lot['availability']
+        highest = conn.execute(
+            'SELECT MAX(spot_id) FROM bookings WHERE parking_lot_id = ? AND active = 1', (lot_id,)
+        ).fetchone()[0]
+        if spots < occupied:
+            error = 'Lot #%d has %d occupied spots; it cannot shrink to %d.' % (lot_id, occupied, spots)
+        elif highest is not None and highest > spots:
+            error = 'Spot %d of lot #%d is booked; it cannot shrink to %d.' % (highest, lot_id, spots)
+    if error:
+        conn.rollback()
+        flash('Lot not updated: ' + error, 'error')
+        return redirect('/admin_dashboard')
     conn.execute('''
         UPDATE parking_lots
-        SET prime_location_name=?, address=?, pin_code=?, price=?, maximum_number_of_spots=?
+        SET prime_location_name=?, address=?, pin_code=?, price=?, maximum_number_of_spots=?, latitude=?, longitude=?,
+            availability = availability + (? - maximum_number_of_spots)
         WHERE id=?
-    ''', (location, address, pin_code, price, spots, lot_id))
+    ''', (location, address, pin_code, price, spots, latitude, longitude, spots, lot_id))
+    available = conn.execute('SELECT availability FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()[0]
+    changes.record_lot(conn, lot_id, capacity=spots, available=available)
     conn.commit()
-    conn.close()
+    changes.apply_lot(lot_id, capacity=spots, available=available)
     return redirect('/admin_dashboard')
 
 @app.route('/view_users')
@@ -487,9 +595,14 @@ def view_users():
     if 'admin_id' not in session:
         return redirect('/')
     conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    conn.close()
-    return render_template('admin/view_users.html', users=users)
+    users = pagination.users(
+        conn,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        size=pagination.page_size(request.args.get('size')),
+    )
+    next_url, prev_url = page_links(users)
+    return render_template('admin/view_users.html', users=users.rows, next_url=next_url, prev_url=prev_url)
 
 @app.route('/admin/search', methods=['GET','POST'])
 def search_parking_lots():
@@ -499,41 +612,20 @@ def search_parking_lots():
     search_query = request.form.get('search_query', '').strip()
     conn = get_db_connection()
 
-    try:
-        # If the query is numeric, search ID and pin_code
-        int_val = int(search_query)
-        results = conn.execute('''
-            SELECT * FROM parking_lots
-            WHERE id = ? OR pin_code = ?
-        ''', (int_val, int_val)).fetchall()
-    except ValueError:
-        # Otherwise, search by location
-        results = conn.execute('''
-            SELECT * FROM parking_lots
-            WHERE lower(prime_location_name) LIKE ?
-        ''', ('%' + search_query.lower() + '%',)).fetchall()
+    # ID or pin code if numeric, otherwise name/address/pin code prefixes
+    results = lot_search.search_lots(conn, search_query)
 
-    conn.close()
     return render_template('admin/search.html', parking_lots=results)
 
-import matplotlib.pyplot as plt
-import io
-import base64
-from flask import render_template
-
-@app.route("/admin/summary")
-def summary_page():
-    if "admin_id" not in session:
-        return redirect("/")
-
-    conn = get_db_connection()
-
+def admin_summary_data(conn):
+    # Lifetime revenue per lot, maintained by the booking engine
     revenues = conn.execute("""
-        SELECT p.prime_location_name, 
-               IFNULL(SUM(b.estimated_cost), 0) as revenue
+        SELECT p.prime_location_name,
+               IFNULL(s.revenue, 0) as revenue
         FROM parking_lots p
-        LEFT JOIN bookings b ON p.id = b.parking_lot_id
-        GROUP BY p.id
+        LEFT JOIN lot_stats s ON s.parking_lot_id = p.id
+        ORDER BY p.id
+        -- full-scan-ok: one row per lot
     """).fetchall()
 
     occupancy = conn.execute("""
@@ -542,31 +634,136 @@ def summary_page():
                availability,
                (maximum_number_of_spots - availability) AS occupied
         FROM parking_lots
+        -- full-scan-ok: one row per lot
     """).fetchall()
 
+    return {
+        'revenue_labels': [row["prime_location_name"] for row in revenues],
+        'revenue_values': [row["revenue"] for row in revenues],
+        'occupancy_labels': [row["prime_location_name"] for row in occupancy],
+        'available_values': [row["availability"] for row in occupancy],
+        'occupied_values': [row["occupied"] for row in occupancy],
+    }
+
+
+@app.route("/admin/summary")
+def summary_page():
+    if "admin_id" not in session:
+        return redirect("/")
+
+    conn = get_db_connection()
     admin = conn.execute(
         "SELECT * FROM admin WHERE id = ?", (session["admin_id"],)
     ).fetchone()
-    conn.close()
-
-    revenue_labels = [row["prime_location_name"] for row in revenues]
-    revenue_values = [row["revenue"] for row in revenues]
-
-    occupancy_labels = [row["prime_location_name"] for row in occupancy]
-    available_values = [row["availability"] for row in occupancy]
-    occupied_values = [row["occupied"] for row in occupancy]
 
     return render_template(
         "admin/summary.html",
-        revenue_labels=revenue_labels,
-        revenue_values=revenue_values,
-        occupancy_labels=occupancy_labels,
-        available_values=available_values,
-        occupied_values=occupied_values,
         admin=admin,
+        server_charts=app.config['SERVER_CHARTS'],
+        **admin_summary_data(conn)
     )
 
 
+@app.route("/admin/summary/<kind>.png")
+def summary_chart(kind):
+    if "admin_id" not in session:
+        return redirect("/")
+    data = admin_summary_data(get_db_connection())
+    if kind == 'revenue':
+        return chart_response('revenue', data['revenue_labels'], data['revenue_values'])
+    if kind == 'occupancy':
+        return chart_response(
+            'occupancy', data['occupancy_labels'], data['available_values'], data['occupied_values'])
+    return jsonify({'error': 'unknown chart'}), 404
+
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    if 'admin_id' not in session:
+        return redirect('/')
+    return jsonify({'lots': cache.lot_cache.stats()})
+
+
+@app.route('/admin/metrics')
+def metrics():
+    # Prometheus text format. Scrapers without an admin session can send
+    # "Authorization: Bearer <METRICS_TOKEN>" when that is configured.
+    token = app.config.get('METRICS_TOKEN')
+    if 'admin_id' not in session and not (token and request.headers.get('Authorization') == 'Bearer ' + token):
+        return redirect('/')
+    lines = profiling.prometheus_lines(app.extensions['request_stats'])
+    lot_cache = cache.lot_cache.stats()
+    for name in ('hits', 'misses', 'evictions', 'expirations'):
+        lines += profiling.metric('parking_lot_cache_%s_total' % name, 'Lot cache %s' % name, lot_cache[name])
+    lines += profiling.metric('parking_lot_cache_entries', 'Lots in the cache', lot_cache['size'], 'gauge')
+    overstays = overstay.metrics.stats()
+    for name in ('runs', 'failures', 'skipped', 'found', 'flagged', 'closed'):
+        lines += profiling.metric('parking_overstay_%s_total' % name, 'Overstay job %s' % name, overstays[name])
+    lines += profiling.metric('parking_overstay_seconds_total', 'Time spent in overstay runs', overstays['seconds_total'])
+    lines += profiling.metric('parking_event_subscribers', 'Open event streams', events.broker.subscriber_count(), 'gauge')
+    lines += profiling.metric('parking_events_published_total', 'Events published', events.broker.published)
+    lines += profiling.metric('parking_event_subscribers_dropped_total', 'Slow event streams dropped', events.broker.dropped)
+    gate_stats = gate.stats()
+    lines += profiling.metric('parking_gate_events_total', 'Gate events written', gate_stats['events'])
+    lines += profiling.metric('parking_gate_batches_total', 'Gate event batches committed', gate_stats['batches'])
+    lines += profiling.metric('parking_gate_failed_total', 'Gate events lost to a failed batch', gate_stats['failed'])
+    lines += profiling.metric('parking_gate_rejected_total', 'Gate events turned away, queue full', gate_stats['rejected'])
+    lines += profiling.metric('parking_gate_pending', 'Gate events waiting to be written', gate_stats['pending'], 'gauge')
+    return app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/overstays')
+def overstays():
+    if 'admin_id' not in session:
+        return redirect('/')
+    hours = app.config['OVERSTAY_HOURS']
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    return jsonify({
+        'hours': hours,
+        'action': app.config['OVERSTAY_ACTION'],
+        'overstays': [dict(row) for row in overstay.list_overstays(get_db_connection(), hours, limit)],
+        'scheduler': overstay.metrics.stats(),
+    })
+
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+    # Multipart upload of a CSV or NDJSON file of lots or closed bookings
+    if 'admin_id' not in session:
+        return redirect('/')
+    if kind not in bulk.IMPORTERS:
+        return jsonify({'error': 'can only import %s' % ', '.join(sorted(bulk.IMPORTERS))}), 404
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'no file uploaded'}), 400
+    fmt = request.form.get('format') or bulk.format_for(upload.filename)
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    records = bulk.read_records(bulk.text_stream(upload.stream), fmt)
+    report = bulk.import_records(get_db_connection(), kind, records)
+    return jsonify(report.as_dict())
+
+
+@app.route('/admin/export/bookings')
+def bulk_export_bookings():
+    # ?start=2024-01-01&end=2024-01-31[&format=ndjson], streamed
+    if 'admin_id' not in session:
+        return redirect('/')
+    fmt = request.args.get('format', 'csv')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        start, end = bulk.date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # stream_with_context keeps the pooled connection until the body is done
+    body = stream_with_context(bulk.export_bookings(get_db_connection(), start, end, fmt))
+    response = app.response_class(body, mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=bookings-%s-%s.%s' % (
+        request.args['start'], request.args['end'], fmt)
+    return response
+
+
 @app.route('/delete_user/<int:user_id>')
 def delete_user(user_id):
     if 'admin_id' not in session:
@@ -574,7 +771,6 @@ def delete_user(user_id):
     conn = get_db_connection()
     conn.execute('DELETE FROM users WHERE id=?', (user_id,))
     conn.commit()
-    conn.close()
     return redirect('/admin_dashboard')
 
 @app.route('/delete_lot/<int:lot_id>')
@@ -583,8 +779,10 @@ def delete_lot(lot_id):
         return redirect('/')
     conn = get_db_connection()
     conn.execute('DELETE FROM parking_lots WHERE id=?', (lot_id,))
+    conn.execute('DELETE FROM lot_tariffs WHERE parking_lot_id=?', (lot_id,))
+    changes.record_lot(conn, lot_id, deleted=True)
     conn.commit()
-    conn.close()
+    changes.apply_lot(lot_id, deleted=True)
     return redirect('/admin_dashboard')
 
 # ---------------------- Logout ----------------------
@@ -597,7 +795,7 @@ def logout():
 # ---------------------- Main ----------------------
 
 if __name__ == '__main__':
-    if not os.path.exists('database/users.db'):
+    if not os.path.exists(app.config['DATABASE']):
         print("Please run database_setup.py first to initialize the database.")
     else:
         app.run(debug=True)
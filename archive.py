@@ -0,0 +1,241 @@
+import argparse
+import os
+import sqlite3
+import time
+
+# ---------------------- Booking archive ----------------------
+#
+#   python archive.py [--db database/users.db] [--archive PATH] [--days 180] [--batch 2000] [--compact]
+#
+# Closed bookings that ended more than --days ago are moved out of the hot
+# bookings table into a separate SQLite file (users-archive.db next to the
+# database unless ARCHIVE_DATABASE / --archive says otherwise), so the
+# table that booking, search and the dashboards work against holds little
+# more than active bookings and recent history. Run it from cron.
+#
+# Every entry point resolves the archive file the same way, through
+# default_path(): ARCHIVE_DATABASE / --archive when given, otherwise
+# $PARKING_ARCHIVE_DATABASE, otherwise users-archive.db next to the
+# database. A tool that guessed differently would see only the hot half of
+# the history.
+#
+# Every connection attaches the archive as `archive` and gets a TEMP view,
+# all_bookings, over both tables. History pages, exports, rollup backfill
+# and re-pricing read the view and see one table; SQLite merges the two
+# halves in index order, so keyset pages stay index-only. Code that only
+# deals with active bookings keeps using `bookings`.
+#
+# Each batch copies rows to the archive and deletes them from the hot
+# table in one short transaction. Under WAL that commit is atomic per
+# file, not across both, so a crash in between can leave a batch in both
+# places: the view hides the archive copy while the hot row exists, and
+# the next run finds the rows still eligible, replaces the copies and
+# deletes them. A run can be stopped anywhere and simply started again.
+#
+# compact() then hands the freed pages back to the filesystem a few at a
+# time with incremental vacuum, so it can run while the app is serving.
+
+DEFAULT_AFTER_DAYS = 180
+BATCH_SIZE = 2000
+BATCH_PAUSE = 0.05  # seconds between batches, so request traffic gets the write lock
+COMPACT_STEP = 1000  # pages freed per compaction step
+
+# The archive table, the copy in archive_batch() and the view keep in step
+# with the bookings migrations. The view leaves out overstay_flagged_at: no
+# history reader needs it, and the rollup backfill in migration 4 reads the
+# view before that column exists.
+VIEW_COLUMNS = ', '.join((
+    'id', 'user_id', 'parking_lot_id', 'vehicle_no', 'timestamp', 'active', 'spot_id',
+    'estimated_cost', 'released_at',
+))
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.bookings (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        parking_lot_id INTEGER NOT NULL,
+        vehicle_no TEXT NOT NULL,
+        timestamp DATETIME,
+        active INTEGER,
+        spot_id INTEGER,
+        estimated_cost REAL,
+        released_at DATETIME,
+        overstay_flagged_at DATETIME
+    )
+    ''',
+    # The same shapes as the hot table's history and by-start indexes
+    '''
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_user_history
+    ON bookings (user_id, timestamp, id, parking_lot_id, active, vehicle_no)
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_timestamp ON bookings (timestamp, id)',
+    '''
+    CREATE TEMP VIEW IF NOT EXISTS all_bookings AS
+    SELECT %s FROM main.bookings
+    UNION ALL
+    SELECT %s FROM archive.bookings a
+    WHERE NOT EXISTS (SELECT 1 FROM main.bookings h WHERE h.id = a.id)
+    ''' % (VIEW_COLUMNS, VIEW_COLUMNS),
+]
+
+
+ENV_VAR = 'PARKING_ARCHIVE_DATABASE'
+
+
+def default_path(path):
+    # $PARKING_ARCHIVE_DATABASE, else users.db -> users-archive.db; an
+    # in-memory database gets an in-memory archive
+    if not path or path == ':memory:':
+        return ':memory:'
+    if os.environ.get(ENV_VAR):
+        return os.environ[ENV_VAR]
+    root, ext = os.path.splitext(path)
+    return root + '-archive' + (ext or '.db')
+
+
+def attach(conn, path=None):
+    # Attach the archive (created if missing) and the all_bookings view.
+    # Must run outside a transaction; a second call only re-checks the schema.
+    databases = {row[1]: row[2] for row in conn.execute('PRAGMA database_list')}
+    if 'archive' not in databases:
+        path = path or default_path(databases.get('main'))
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        if path != ':memory:':
+            conn.execute('PRAGMA archive.journal_mode=WAL')
+            conn.execute('PRAGMA archive.synchronous=NORMAL')
+        # Only takes effect while the file is still empty; see compact()
+        conn.execute('PRAGMA archive.auto_vacuum=INCREMENTAL')
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+# ---------------------- Archiving ----------------------
+
+def cutoff(conn, days):
+    # Same clock and format as bookings.released_at
+    return conn.execute("SELECT datetime('now', ?)", ('-%d days' % days,)).fetchone()[0]
+
+
+def archive_batch(conn, before, after=('', 0), batch_size=BATCH_SIZE):
+    # Move up to batch_size bookings closed before `before`, in (timestamp, id)
+    # order from the keyset position `after`. Returns how many moved and
+    # where the batch ended. The newest booking is never moved, so a table
+    # created without AUTOINCREMENT can't hand its id out a second time.
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        keys = conn.execute('''
+            SELECT timestamp, id FROM main.bookings
+            WHERE (timestamp, id) > (?, ?) AND timestamp < ?
+              AND active = 0 AND IFNULL(released_at, timestamp) < ?
+              AND id < (SELECT MAX(id) FROM main.bookings)
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''', (after[0], after[1], before, before, batch_size)).fetchall()
+        if not keys:
+            conn.rollback()
+            return 0, after
+        last = tuple(keys[-1])
+        window = (after[0], after[1], last[0], last[1], before, before)
+        moved = conn.execute('''
+            INSERT OR REPLACE INTO archive.bookings (
+                id, user_id, parking_lot_id, vehicle_no, timestamp, active, spot_id,
+                estimated_cost, released_at, overstay_flagged_at
+            )
+            SELECT id, user_id, parking_lot_id, vehicle_no, timestamp, active, spot_id,
+                   estimated_cost, released_at, overstay_flagged_at
+            FROM main.bookings
+            WHERE (timestamp, id) > (?, ?) AND (timestamp, id) <= (?, ?) AND timestamp < ?
+              AND active = 0 AND IFNULL(released_at, timestamp) < ?
+              AND id < (SELECT MAX(id) FROM main.bookings)
+        ''', window).rowcount
+        deleted = conn.execute('''
+            DELETE FROM main.bookings
+            WHERE (timestamp, id) > (?, ?) AND (timestamp, id) <= (?, ?) AND timestamp < ?
+              AND active = 0 AND IFNULL(released_at, timestamp) < ?
+              AND id < (SELECT MAX(id) FROM main.bookings)
+        ''', window).rowcount
+        if moved != len(keys) or deleted != len(keys):
+            raise sqlite3.DatabaseError('batch of %d bookings: %d archived, %d deleted' % (len(keys), moved, deleted))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return moved, last
+
+
+def run(conn, days=DEFAULT_AFTER_DAYS, batch_size=BATCH_SIZE, pause=BATCH_PAUSE):
+    # Archive everything eligible now; returns the run's counters
+    started = time.perf_counter()
+    report = {'moved': 0, 'batches': 0}
+    before = cutoff(conn, days)
+    after = ('', 0)
+    while True:
+        moved, after = archive_batch(conn, before, after, batch_size)
+        if moved:
+            report['moved'] += moved
+            report['batches'] += 1
+        if moved < batch_size:
+            break
+        time.sleep(pause)
+    report['seconds'] = time.perf_counter() - started
+    return report
+
+
+# ---------------------- Compaction ----------------------
+
+def compact(conn, schema='main', step=COMPACT_STEP, pause=BATCH_PAUSE):
+    # Give free pages back to the filesystem `step` pages at a time, each
+    # step its own short write, then truncate the WAL. A database created
+    # without auto_vacuum=INCREMENTAL is converted by one full VACUUM the
+    # first time, which does hold the write lock for its duration.
+    # Returns the number of pages released.
+    if conn.execute('PRAGMA %s.auto_vacuum' % schema).fetchone()[0] != 2:
+        conn.execute('PRAGMA %s.auto_vacuum=INCREMENTAL' % schema)
+        before = conn.execute('PRAGMA %s.page_count' % schema).fetchone()[0]
+        conn.execute('VACUUM %s' % schema)
+        released = before - conn.execute('PRAGMA %s.page_count' % schema).fetchone()[0]
+    else:
+        released = 0
+        while True:
+            free = conn.execute('PRAGMA %s.freelist_count' % schema).fetchone()[0]
+            if not free:
+                break
+            # executescript steps the pragma to completion; execute() frees one page
+            conn.executescript('PRAGMA %s.incremental_vacuum(%d)' % (schema, min(free, step)))
+            released += min(free, step)
+            time.sleep(pause)
+    conn.execute('PRAGMA %s.wal_checkpoint(TRUNCATE)' % schema)
+    conn.execute('PRAGMA %s.optimize' % schema)
+    return released
+
+
+# ---------------------- CLI ----------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old closed bookings to the archive database.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, else next to --db with an -archive suffix)')
+    parser.add_argument('--days', type=int, default=DEFAULT_AFTER_DAYS,
+                        help='archive bookings closed more than this many days ago')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--compact', action='store_true', help='release the freed space afterwards')
+    args = parser.parse_args()
+
+    import db
+    conn = db.connect(args.db, archive_path=args.archive)
+    report = run(conn, args.days, args.batch)
+    hot, archived = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM main.bookings), (SELECT COUNT(*) FROM archive.bookings)
+        -- full-scan-ok: CLI report
+    ''').fetchone()
+    print('%d bookings archived in %d batches (%.1fs); %d hot, %d in the archive'
+          % (report['moved'], report['batches'], report['seconds'], hot, archived))
+    if args.compact:
+        pages = compact(conn, 'main') + compact(conn, 'archive')
+        print('compacted: %d pages released' % pages)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import api
+import events
+from app import app
+
+# ---------------------- ASGI entry point ----------------------
+#
+#   uvicorn asgi:application [--host 0.0.0.0] [--port 8000] [--timeout-graceful-shutdown 5]
+#
+# Serves the same Flask app (routes, templates and cookie sessions) from an
+# event loop. The loop owns every connection: request bodies are read and
+# responses written without a thread, and only the Flask work itself (the
+# SQLite round trip and the template render) runs on a bounded executor of
+# ASGI_THREADS threads. A slow client therefore holds a socket, not a
+# worker thread.
+#
+# Event streams (/api/lots/events) never hold a thread: api.py hands the
+# subscriber over in the WSGI environ and it is streamed from the loop
+# with events.Broker.astream(). A stream is only handed over once that view
+# has accepted it, so the same admin session / EVENTS_TOKEN check and
+# subscriber limit apply here. Gate scanners keeping a stream open cost a
+# socket and a queue each, so ASGI_MAX_EVENT_SUBSCRIBERS is much higher
+# than the threaded limit.
+
+DEFAULTS = {
+    'ASGI_THREADS': 16,
+    'ASGI_MAX_EVENT_SUBSCRIBERS': 5000,
+}
+# Request bodies larger than this are spooled to a temp file (bulk imports)
+BODY_SPOOL_BYTES = 1024 * 1024
+
+for key, value in DEFAULTS.items():
+    app.config.setdefault(key, value)
+app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', app.config['ASGI_MAX_EVENT_SUBSCRIBERS'])
+
+_executor = None
+
+
+def _get_executor():
+    # Created on first use, in the serving process (uvicorn may fork)
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+    return _executor
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+async def _read_body(receive):
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            body.seek(0)
+            return body
+
+
+def _call_app(environ):
+    # Runs on the executor. A response with a Content-Length is read in
+    # full here; anything else is a stream, pulled chunk by chunk later.
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+        return lambda data: None
+
+    body = app.wsgi_app(environ, start_response)
+    status, headers = started
+    if api.SUBSCRIBER_ENVIRON_KEY in environ:
+        body.close()  # the thread-blocking stream never started
+        return status, headers, None, False
+    if any(name.lower() == 'content-length' for name, _ in headers):
+        try:
+            return status, headers, b''.join(body), False
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    return status, headers, iter(body), True
+
+
+def _next_chunk(body):
+    try:
+        return next(body)
+    except StopIteration:
+        if hasattr(body, 'close'):
+            body.close()
+        return None
+
+
+async def _start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+
+
+async def _send_events(subscriber, send, receive):
+    async def pump():
+        async for text in events.broker.astream(subscriber):
+            await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _http(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    environ = _environ(scope, body)
+    try:
+        status, headers, content, streaming = await loop.run_in_executor(executor, _call_app, environ)
+    finally:
+        body.close()
+
+    subscriber = environ.get(api.SUBSCRIBER_ENVIRON_KEY)
+    if subscriber is not None:
+        try:
+            await _start(send, status, headers)
+            await _send_events(subscriber, send, receive)
+        finally:
+            events.broker.unsubscribe(subscriber)
+        return
+
+    await _start(send, status, headers)
+    if not streaming:
+        await send({'type': 'http.response.body', 'body': content})
+    else:
+        # e.g. /admin/export/bookings: a thread per chunk, not per download.
+        # Chunks may be pulled on different threads, so they share one
+        # context for the request context stream_with_context pushes.
+        context = contextvars.Context()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, context.run, _next_chunk, content)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        except BaseException:
+            if hasattr(content, 'close'):
+                await loop.run_in_executor(executor, context.run, content.close)
+            raise
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            _get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await _http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    else:
+        raise ValueError('unsupported ASGI scope: %s' % scope['type'])
+
+
+if __name__ == '__main__':
+    import uvicorn
+    # Open event streams never finish by themselves, so don't wait on them
+    uvicorn.run(application, host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 8000)),
+                timeout_graceful_shutdown=5)
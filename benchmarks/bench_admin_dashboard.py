@@ -0,0 +1,25 @@
+# Admin dashboard latency as the number of lots grows.
+#
+#   python benchmarks/bench_admin_dashboard.py [lot counts...]
+
+import sys
+
+from common import make_client, make_database, summarize, time_requests
+
+
+def main(lot_counts):
+    print('%8s %8s %12s %10s' % ('lots', 'spots', 'median_ms', 'p95_ms'))
+    for lots in lot_counts:
+        path = make_database(lots=lots, spots=20, history_per_lot=200)
+        client = make_client(path)
+
+        def hit():
+            response = client.get('/admin_dashboard')
+            assert response.status_code == 200, response.status_code
+
+        stats = summarize(time_requests(hit, repeat=10))
+        print('%8d %8d %12.2f %10.2f' % (lots, 20, stats['median_ms'], stats['p95_ms']))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10, 50, 100, 250, 500])
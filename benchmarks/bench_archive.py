@@ -0,0 +1,151 @@
+# Hot-path latency before and after archiving old bookings. Generates a
+# database with `years` of closed history (datagen.py), times the pages
+# that run on every visit, moves bookings closed more than `days` ago to
+# the archive, compacts, and times them again. Also checks that history,
+# exports and the rollups read the same rows through the archive.
+#
+#   python benchmarks/bench_archive.py [--lots 200] [--years 2] [--per-lot-day 6]
+#                                      [--days 30] [--repeat 50]
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from common import summarize, time_requests
+from datagen import generate
+
+import archive
+import bulk
+import db
+import pagination
+import rollups
+
+
+def file_mb(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix)) / 2 ** 20
+
+
+def make_clients(app, path, user):
+    app.config.update(DATABASE=path, TESTING=True)
+    admin = app.test_client()
+    admin.post('/admin_login', data={'username': 'admin', 'password': 'admin123'})
+    client = app.test_client()
+    client.post('/user_login', data={'username': user, 'password': 'pw'})
+    return admin, client
+
+
+def measure(app, path, user_id, user, deep_cursor, repeat):
+    admin, client = make_clients(app, path, user)
+    side = sqlite3.connect(path)
+
+    def get(test_client, url):
+        def hit():
+            response = test_client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return hit
+
+    def book_and_release():
+        response = client.post('/book_lot/1', data={'vehicle_no': 'TN01BX0001'})
+        assert response.status_code == 302, response.status_code
+        booking_id = side.execute(
+            'SELECT id FROM bookings WHERE user_id = ? AND active = 1 ORDER BY id DESC LIMIT 1', (user_id,),
+        ).fetchone()[0]
+        client.post('/release_booking/%d' % booking_id)
+
+    timings = {
+        'search_parking': get(client, '/search_parking?query=Nagar'),
+        'admin_dashboard': get(admin, '/admin_dashboard'),
+        'user_dashboard': get(client, '/user_dashboard'),
+        'history, a year back': get(client, '/user_dashboard?after=' + deep_cursor),
+        'book + release': book_and_release,
+    }
+    results = {name: summarize(time_requests(hit, repeat)) for name, hit in timings.items()}
+    side.close()
+    return results
+
+
+def fingerprint(path, user_id):
+    # What readers of the whole history see; must not change when archiving
+    conn = db.connect(path)
+    history = []
+    after = None
+    while True:
+        page = pagination.booking_history(conn, user_id, after=after, size=500)
+        history += [row['id'] for row in page.rows]
+        after = page.next_cursor
+        if after is None:
+            break
+    export = ''.join(bulk.export_bookings(conn, '0000', '9999'))
+    # A rollup rebuild from the view, rolled back
+    conn.execute('BEGIN IMMEDIATE')
+    rollups.backfill(conn)
+    stats = conn.execute('''
+        SELECT parking_lot_id, bookings, ROUND(revenue, 2) FROM lot_stats ORDER BY parking_lot_id
+    ''').fetchall()
+    conn.rollback()
+    conn.close()
+    return hash(tuple(history)), hash(export), tuple(map(tuple, stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot-path latency before and after archiving old bookings.')
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--per-lot-day', type=float, default=6)
+    parser.add_argument('--days', type=int, default=30, help='archive bookings closed more than this many days ago')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='parking-archive-'), 'users.db')
+    print('generating %s ...' % path, flush=True)
+    generate(path, lots=args.lots, users=args.users, years=args.years, per_lot_day=args.per_lot_day, quiet=True)
+
+    side = sqlite3.connect(path)
+    user_id, booked = side.execute('''
+        SELECT user_id, COUNT(*) FROM bookings GROUP BY user_id ORDER BY 2 DESC LIMIT 1
+        -- full-scan-ok: benchmark setup
+    ''').fetchone()
+    user = side.execute('SELECT full_name FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+    deep = side.execute('''
+        SELECT timestamp, id FROM bookings WHERE user_id = ? AND timestamp < datetime('now', '-365 days')
+        ORDER BY timestamp DESC, id DESC LIMIT 1
+    ''', (user_id,)).fetchone()
+    side.close()
+    deep_cursor = pagination.encode_cursor(deep or ('0', 0))
+
+    from app import app
+    before = measure(app, path, user_id, user, deep_cursor, args.repeat)
+    expected = fingerprint(path, user_id)
+    size_before = file_mb(path)
+
+    conn = db.connect(path)
+    report = archive.run(conn, args.days)
+    started = time.perf_counter()
+    pages = archive.compact(conn, 'main') + archive.compact(conn, 'archive')
+    compact_seconds = time.perf_counter() - started
+    hot, archived = conn.execute('''
+        SELECT (SELECT COUNT(*) FROM main.bookings), (SELECT COUNT(*) FROM archive.bookings)
+        -- full-scan-ok: benchmark report
+    ''').fetchone()
+    conn.close()
+
+    assert fingerprint(path, user_id) == expected, 'history changed by archiving'
+    after = measure(app, path, user_id, user, deep_cursor, args.repeat)
+
+    print('user %s: %d bookings; %d archived in %d batches (%.1fs), compaction freed %d pages (%.1fs)' % (
+        user, booked, report['moved'], report['batches'], report['seconds'], pages, compact_seconds))
+    print('hot bookings %d, archived %d; database %.1f MB -> %.1f MB, archive %.1f MB' % (
+        hot, archived, size_before, file_mb(path), file_mb(archive.default_path(path))))
+    print()
+    print('%-22s %12s %12s %12s %12s' % ('request', 'before p50', 'after p50', 'before p95', 'after p95'))
+    for name in before:
+        print('%-22s %9.2f ms %9.2f ms %9.2f ms %9.2f ms' % (
+            name, before[name]['median_ms'], after[name]['median_ms'], before[name]['p95_ms'], after[name]['p95_ms']))
+    print('\nhistory, exports and rollups read the same rows after archiving')
+
+
+if __name__ == '__main__':
+    main()
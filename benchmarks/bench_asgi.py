@@ -0,0 +1,193 @@
+# Threaded WSGI versus the ASGI entry point, one process each. A server is
+# started in a subprocess, `streams` long-lived event streams are opened
+# against it (standing in for gate scanners), and then `clients`
+# concurrent clients search and book for `seconds`. Reports how many
+# streams were accepted, request throughput and latency, and the server's
+# thread count and RSS.
+#
+#   python benchmarks/bench_asgi.py [--modes wsgi asgi] [--streams 500]
+#                                   [--clients 32] [--seconds 10]
+#
+# The asgi mode needs uvicorn (pip install uvicorn).
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.parse
+
+from common import ROOT, make_database, percentiles
+
+PORT = 8731
+
+
+def serve(mode, path, port, events_cap):
+    sys.path.insert(0, ROOT)
+    from app import app
+    app.config.update(DATABASE=path, TESTING=True, EVENTS_MAX_SUBSCRIBERS=events_cap, EVENTS_TOKEN='bench')
+    if mode == 'wsgi':
+        # What app.run() does, without the debugger, reloader or access log
+        import logging
+        from werkzeug.serving import run_simple
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.application, host='127.0.0.1', port=port, log_level='warning', backlog=4096,
+                    timeout_graceful_shutdown=5)
+
+
+def proc_status(pid):
+    fields = {}
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            fields[name] = value.strip()
+    return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+
+
+async def fetch(port, method, path, cookie=None, form=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = ['%s %s HTTP/1.1' % (method, path), 'Host: 127.0.0.1', 'Connection: close']
+    if cookie:
+        lines.append('Cookie: ' + cookie)
+    body = b''
+    if form is not None:
+        body = urllib.parse.urlencode(form).encode('ascii')
+        lines += ['Content-Type: application/x-www-form-urlencoded', 'Content-Length: %d' % len(body)]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii') + body)
+    response = await reader.read()
+    writer.close()
+    head = response.split(b'\r\n\r\n', 1)[0].decode('latin-1').split('\r\n')
+    headers = [line.split(':', 1) for line in head[1:]]
+    return int(head[0].split(' ', 2)[1]), {name.strip().lower(): value.strip() for name, value in headers}
+
+
+async def open_stream(port, lot_id):
+    # Returns (reader, writer) for an accepted stream, or None
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('GET /api/lots/events?ids=%d HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                      'Authorization: Bearer bench\r\n\r\n' % lot_id).encode('ascii'))
+        status = await asyncio.wait_for(reader.readline(), 10)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    if b' 200 ' not in status:
+        writer.close()
+        return None
+    return reader, writer
+
+
+async def drain(reader):
+    try:
+        while await reader.read(4096):
+            pass
+    except (OSError, asyncio.CancelledError):
+        pass
+
+
+async def load(port, path, clients, seconds, lots):
+    status, headers = await fetch(port, 'POST', '/user_login', form={'username': 'bench', 'password': 'bench'})
+    cookie = headers['set-cookie'].split(';', 1)[0]
+    side = sqlite3.connect(path)
+    samples, errors = [], [0]
+    stop = time.perf_counter() + seconds
+
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            status, _ = await fetch(port, *args, cookie=cookie, **kwargs)
+        except OSError:
+            status = None
+        if status not in (200, 302):
+            errors[0] += 1
+        samples.append((time.perf_counter() - started) * 1000)
+
+    async def client(rng):
+        while time.perf_counter() < stop:
+            if rng.random() < 0.7:
+                await timed('GET', '/search_parking?query=' + rng.choice(['Nagar', 'Adyar', 'Street', 'Guindy']))
+            else:
+                await timed('POST', '/book_lot/%d' % rng.randint(1, lots), form={'vehicle_no': 'TN01BX0001'})
+                row = side.execute(
+                    'SELECT id FROM bookings WHERE user_id = 1 AND active = 1 ORDER BY id DESC LIMIT 1').fetchone()
+                if row is not None:
+                    await timed('POST', '/release_booking/%d' % row[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(random.Random(n)) for n in range(clients)])
+    elapsed = time.perf_counter() - started
+    side.close()
+    return samples, errors[0], elapsed
+
+
+async def run_mode(mode, args):
+    path = make_database(lots=args.lots, spots=200, history_per_lot=200, active_ratio=0.3)
+    server = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), '--serve', mode, '--db', path, '--port', str(PORT),
+        '--events-cap', str(args.streams),
+    ])
+    try:
+        for _ in range(100):
+            try:
+                await fetch(PORT, 'GET', '/api/lots/availability?ids=1')
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        streams = []
+        for start in range(0, args.streams, 50):
+            batch = await asyncio.gather(*[open_stream(PORT, 1 + n % args.lots)
+                                           for n in range(start, min(args.streams, start + 50))])
+            streams += [stream for stream in batch if stream is not None]
+        drains = [asyncio.ensure_future(drain(reader)) for reader, _ in streams]
+        threads_idle, rss_idle = proc_status(server.pid)
+
+        samples, errors, elapsed = await load(PORT, path, args.clients, args.seconds, args.lots)
+        threads, rss = proc_status(server.pid)
+        for task in drains:
+            task.cancel()
+        for _, writer in streams:
+            writer.close()
+        await asyncio.gather(*[writer.wait_closed() for _, writer in streams], return_exceptions=True)
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+    stats = percentiles(samples)
+    print('%-5s streams %4d/%-4d  %7.1f req/s  p50 %7.1f ms  p99 %7.1f ms  errors %4d  threads %4d (%4d)  rss %6.1f MB (%6.1f)' % (
+        mode, len(streams), args.streams, len(samples) / elapsed, stats['p50_ms'], stats['p99_ms'], errors,
+        threads, threads_idle, rss, rss_idle))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Threaded WSGI versus ASGI under long-lived event streams.')
+    parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+    parser.add_argument('--streams', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--lots', type=int, default=20)
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=PORT, help=argparse.SUPPRESS)
+    parser.add_argument('--events-cap', type=int, default=500, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.db, args.port, args.events_cap)
+        return
+    print('(threads and rss after the run; in brackets, with only the streams open)')
+    for mode in args.modes:
+        asyncio.run(run_mode(mode, args))
+
+
+if __name__ == '__main__':
+    main()
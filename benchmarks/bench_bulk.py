@@ -0,0 +1,78 @@
+# Bulk import and export throughput. Generates NDJSON for `lots` lots and
+# `bookings` closed bookings on the fly, imports them through bulk.py, then
+# streams the whole range back out. Peak RSS shows memory stays flat as the
+# row count grows.
+#
+#   python benchmarks/bench_bulk.py [lots] [bookings]
+
+import io
+import json
+import random
+import resource
+import sys
+import time
+
+from common import make_database
+
+import bulk
+import db
+
+
+def lot_lines(count):
+    for n in range(count):
+        yield json.dumps({'location': 'Lot %d' % n, 'price': 20, 'address': 'Street %d' % n,
+                          'pin_code': str(600000 + n % 100), 'spots': 100}) + '\n'
+
+
+def booking_lines(count, lots, seed=1):
+    # Time ordered, the way an export from another system usually is
+    rng = random.Random(seed)
+    step = 365 * 86400 // max(1, count)
+    for n in range(count):
+        start = 1700000000 + n * step + rng.randint(0, step)
+        hours = rng.randint(1, 12)
+        yield json.dumps({
+            'parking_lot_id': rng.randint(1, lots), 'user_id': 1, 'vehicle_no': 'TN%05d' % (n % 100000),
+            'spot_id': rng.randint(1, 100),
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)),
+            'released_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + hours * 3600)),
+            'estimated_cost': hours * 20,
+        }) + '\n'
+
+
+class LineStream(io.TextIOBase):
+    # Iterating yields generated lines without materialising the file
+    def __init__(self, lines):
+        self._lines = lines
+
+    def __iter__(self):
+        return self._lines
+
+
+def main(lots=500, bookings=200000):
+    path = make_database(lots=0, spots=0, history_per_lot=0)
+    conn = db.connect(path)
+
+    started = time.perf_counter()
+    report = bulk.import_records(conn, 'lots', bulk.read_records(LineStream(lot_lines(lots)), 'ndjson'))
+    print('lots: %d imported, %d rejected in %.2fs' % (report.imported, report.rejected, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    report = bulk.import_records(conn, 'bookings', bulk.read_records(LineStream(booking_lines(bookings, lots)), 'ndjson'))
+    elapsed = time.perf_counter() - started
+    print('bookings: %d imported, %d rejected in %.2fs (%.0f rows/s)'
+          % (report.imported, report.rejected, elapsed, report.imported / elapsed))
+
+    started = time.perf_counter()
+    size = rows = 0
+    for text in bulk.export_bookings(conn, '2000-01-01 00:00:00', '2100-01-01 00:00:00', 'csv'):
+        size += len(text)
+        rows += text.count('\n')
+    elapsed = time.perf_counter() - started
+    print('export: %d rows, %.1f MB in %.2fs (%.0f rows/s)' % (rows - 1, size / 1e6, elapsed, (rows - 1) / elapsed))
+    print('peak RSS: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,92 @@
+# Admin dashboard render time with the per-lot fragment cache, against
+# rendering every card, as a few lots change between requests. Each
+# changed lot gets a version bump, as a booking would, before every
+# request. Also times a new worker loading every template with and without
+# the Jinja bytecode cache, in fresh interpreters.
+#
+#   python benchmarks/bench_fragments.py [--lots 500] [--spots 40] [--changed 0 1 10 50] [--repeat 20]
+
+import argparse
+import json
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, make_client, make_database, summarize, time_requests
+
+import fragments
+
+PROBE = '''
+import json, os, time
+cache_dir = %r
+os.environ['PARKING_TEMPLATE_CACHE_DIR'] = cache_dir or ''
+from app import app
+if not cache_dir:
+    app.jinja_env.bytecode_cache = None
+started = time.perf_counter()
+for name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(name)
+print(json.dumps({'ms': (time.perf_counter() - started) * 1000}))
+'''
+
+
+def load_templates(cache_dir):
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE % cache_dir], cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])['ms']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Admin dashboard with and without cached lot fragments.')
+    parser.add_argument('--lots', type=int, default=500)
+    parser.add_argument('--spots', type=int, default=40)
+    parser.add_argument('--changed', type=int, nargs='+', default=[0, 1, 10, 50], help='lots changed per request')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per template load timing')
+    args = parser.parse_args()
+
+    path = make_database(lots=args.lots, spots=args.spots, history_per_lot=20)
+    client = make_client(path)
+    side = sqlite3.connect(path)
+    rng = random.Random(1)
+
+    def dashboard(changed):
+        def hit():
+            lot_ids = rng.sample(range(1, args.lots + 1), changed)
+            if lot_ids:
+                # Any write to a lot row bumps its version, like a booking does
+                side.executemany('UPDATE parking_lots SET availability = availability WHERE id = ?',
+                                 [(lot_id,) for lot_id in lot_ids])
+                side.commit()
+            response = client.get('/admin_dashboard')
+            assert response.status_code == 200, response.status_code
+        return hit
+
+    app = client.application
+    app.config['FRAGMENT_CACHE'] = False
+    expected = client.get('/admin_dashboard').data
+    full = summarize(time_requests(dashboard(0), args.repeat))
+    app.config['FRAGMENT_CACHE'] = True
+    fragments.fragment_cache.clear()
+    assert client.get('/admin_dashboard').data == expected, 'cached cards differ from a full render'
+
+    print('%d lots of %d spots' % (args.lots, args.spots))
+    print('%-26s %12s %10s' % ('render', 'median_ms', 'p95_ms'))
+    print('%-26s %12.2f %10.2f' % ('every card', full['median_ms'], full['p95_ms']))
+    for changed in args.changed:
+        stats = summarize(time_requests(dashboard(changed), args.repeat))
+        print('%-26s %12.2f %10.2f' % ('cached, %d changed' % changed, stats['median_ms'], stats['p95_ms']))
+    side.close()
+
+    cache_dir = tempfile.mkdtemp(prefix='parking-jinja-')
+    load_templates(cache_dir)  # fills the bytecode cache
+    compiled = sorted(load_templates(None) for _ in range(args.runs))[args.runs // 2]
+    cached = sorted(load_templates(cache_dir) for _ in range(args.runs))[args.runs // 2]
+    print('\nnew worker loading every template: compiled %.1f ms, from bytecode %.1f ms' % (compiled, cached))
+
+
+if __name__ == '__main__':
+    main()
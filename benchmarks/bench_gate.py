@@ -0,0 +1,143 @@
+# Gate event throughput: the group-commit writer in gate.py against the
+# per-request path, where every entry and exit is its own BEGIN IMMEDIATE
+# transaction on the calling thread's connection. Each thread plays a gate
+# lane: a car enters, gets its booking back, leaves, repeat. Both runs
+# must end with every lot empty and the same number of bookings.
+#
+# With the default synchronous=NORMAL a WAL commit doesn't fsync, so the
+# saving is mostly lock hand-offs; --synchronous FULL adds the fsync that
+# batching shares out.
+#
+#   python benchmarks/bench_gate.py [--threads 32] [--cycles 100] [--lots 4]
+#                                   [--max-batch 256] [--max-wait 0.005] [--synchronous NORMAL]
+
+import argparse
+import sqlite3
+import threading
+import time
+
+from common import make_database, percentiles
+
+import booking_engine
+import changes
+import db
+import gate
+import tariffs
+
+
+def open_connection(path, synchronous):
+    conn = db.connect(path)
+    conn.execute('PRAGMA synchronous=%s' % synchronous)
+    return conn
+
+
+def per_request(path, synchronous):
+    # What a request thread does without the queue: one transaction per event
+    local = threading.local()
+
+    def handle(event):
+        if not hasattr(local, 'conn'):
+            local.conn = open_connection(path, synchronous)
+        if event.kind == 'entry':
+            booking_id, spot_id = booking_engine.reserve_spot(local.conn, event.lot_id, event.user_id, event.vehicle_no)
+            changes.apply_spot(event.lot_id, spot_id, True)
+            return booking_id
+
+        def work(conn):
+            return booking_engine.release_vehicle(conn, event.lot_id, event.vehicle_no, tariffs.utcnow().replace(microsecond=0))
+        booking_id, spot_id, _ = booking_engine.with_retries(local.conn, work, booking_engine.MAX_RETRIES)
+        changes.apply_spot(event.lot_id, spot_id, False)
+        return booking_id
+
+    return handle, lambda: None
+
+
+def group_commit(path, synchronous, max_batch, max_wait):
+    class Writer(gate.GateWriter):
+        def connect(self):
+            return open_connection(self.path, synchronous)
+
+    writer = Writer(path, max_batch=max_batch, max_wait=max_wait)
+    writer.start()
+
+    def handle(event):
+        return writer.submit([event])[0].result()['booking_id']
+
+    def finish():
+        writer.stop()
+        writer.join()
+        return writer.batches
+
+    return handle, finish
+
+
+def run(handle, threads, cycles, lots):
+    latencies = [[] for _ in range(threads)]
+    start_barrier = threading.Barrier(threads + 1)
+
+    def lane(n):
+        lot_id = n % lots + 1
+        start_barrier.wait()
+        for i in range(cycles):
+            vehicle_no = 'GT%02d%05d' % (n, i)
+            for kind in ('entry', 'exit'):
+                started = time.perf_counter()
+                handle(gate.GateEvent(kind, lot_id, vehicle_no, 1))
+                latencies[n].append((time.perf_counter() - started) * 1000)
+
+    pool = [threading.Thread(target=lane, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - started, percentiles([ms for lane in latencies for ms in lane])
+
+
+def check(path, spots, lots):
+    conn = sqlite3.connect(path)
+    active = conn.execute('SELECT COUNT(*) FROM bookings WHERE active = 1').fetchone()[0]
+    free = conn.execute('SELECT SUM(availability) FROM parking_lots').fetchone()[0]
+    booked = conn.execute("SELECT COUNT(*) FROM bookings WHERE vehicle_no LIKE 'GT%'").fetchone()[0]
+    conn.close()
+    assert active == 0, '%d bookings left active' % active
+    assert free == spots * lots, 'availability drifted: %d free of %d' % (free, spots * lots)
+    return booked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gate events per second: group commit against one commit per event.')
+    parser.add_argument('--threads', type=int, default=32, help='gate lanes sending events at once')
+    parser.add_argument('--cycles', type=int, default=100, help='entry + exit pairs per lane')
+    parser.add_argument('--lots', type=int, default=4)
+    parser.add_argument('--max-batch', type=int, default=gate.DEFAULTS['GATE_MAX_BATCH'])
+    parser.add_argument('--max-wait', type=float, default=gate.DEFAULTS['GATE_MAX_WAIT'])
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    spots = args.threads  # every lane can always find a spot
+    events = args.threads * args.cycles * 2
+    print('%d lanes x %d cycles = %d events over %d lots, synchronous=%s' % (
+        args.threads, args.cycles, events, args.lots, args.synchronous))
+    print('%-14s %10s %9s %9s %9s %9s' % ('path', 'events/s', 'p50_ms', 'p99_ms', 'max_ms', 'batches'))
+
+    counts = []
+    for name in ('per-request', 'group-commit'):
+        path = make_database(lots=args.lots, spots=spots, history_per_lot=0, active_ratio=0)
+        if name == 'per-request':
+            handle, finish = per_request(path, args.synchronous)
+        else:
+            handle, finish = group_commit(path, args.synchronous, args.max_batch, args.max_wait)
+        elapsed, stats = run(handle, args.threads, args.cycles, args.lots)
+        batches = finish() or events
+        counts.append(check(path, spots, args.lots))
+        print('%-14s %10.0f %9.2f %9.2f %9.2f %9d' % (
+            name, events / elapsed, stats['p50_ms'], stats['p99_ms'], stats['max_ms'], batches))
+
+    assert counts[0] == counts[1] == events // 2, counts
+    print('both paths booked and released all %d cars' % counts[0])
+
+
+if __name__ == '__main__':
+    main()
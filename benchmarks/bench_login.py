@@ -0,0 +1,104 @@
+# Login throughput per scrypt work factor. For each factor the bench user's
+# password is rehashed with it, `threads` clients log in as fast as they
+# can for `seconds`, and one more client books and releases a spot the
+# whole time. Reports logins/s, how many were turned away as busy, login
+# latency and the book/release latency next to it, so the cost parameters
+# can be sized against both the login rate and booking headroom.
+#
+#   python benchmarks/bench_login.py [--log-n 12 13 14 15] [--threads 16]
+#                                    [--seconds 5] [--workers 2] [--max-pending 32]
+
+import argparse
+import sqlite3
+import threading
+import time
+
+from common import make_database, percentiles
+
+import passwords
+
+
+def storm(app, path, threads, seconds):
+    stop = time.perf_counter() + seconds
+    logins, busy, booking = [], [], []
+    lock = threading.Lock()
+
+    def login():
+        client = app.test_client()
+        samples, rejected = [], 0
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            response = client.post('/user_login', data={'username': 'bench', 'password': 'bench'})
+            if response.status_code == 503:
+                rejected += 1
+                time.sleep(0.005)
+                continue
+            assert response.status_code == 302, 'login failed'
+            samples.append((time.perf_counter() - started) * 1000)
+        with lock:
+            logins.extend(samples)
+            busy.append(rejected)
+
+    def book_release():
+        client = app.test_client()
+        client.post('/user_login', data={'username': 'bench', 'password': 'bench'})
+        side = sqlite3.connect(path, check_same_thread=False)
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            client.post('/book_lot/1', data={'vehicle_no': 'TN01BX0001'})
+            row = side.execute('SELECT id FROM bookings WHERE user_id = 1 AND active = 1 ORDER BY id DESC LIMIT 1').fetchone()
+            if row is not None:
+                client.post('/release_booking/%d' % row[0])
+            booking.append((time.perf_counter() - started) * 1000)
+        side.close()
+
+    workers = [threading.Thread(target=login) for _ in range(threads)]
+    workers.append(threading.Thread(target=book_release))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return logins, sum(busy), booking
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput per scrypt work factor.')
+    parser.add_argument('--log-n', type=int, nargs='+', default=[12, 13, 14, 15])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=passwords.DEFAULTS['PASSWORD_WORKERS'])
+    parser.add_argument('--max-pending', type=int, default=passwords.DEFAULTS['PASSWORD_MAX_PENDING'])
+    args = parser.parse_args()
+
+    from app import app
+    path = make_database(lots=5, spots=50, history_per_lot=0, active_ratio=0)
+    app.config.update(DATABASE=path, TESTING=True, PASSWORD_WORKERS=args.workers, PASSWORD_MAX_PENDING=args.max_pending)
+    app.extensions.pop('password_pool', None)
+
+    r, p = passwords.DEFAULTS['PASSWORD_SCRYPT'][1:]
+    _, _, booking = storm(app, path, 0, 2)
+    print('no logins          book+release p50 %(p50_ms)7.1f ms  p99 %(p99_ms)7.1f ms' % percentiles(booking))
+    print('%-10s %9s %9s %8s %10s %10s %14s %14s' % (
+        'factor', 'hash ms', 'logins/s', 'busy', 'login p50', 'login p99', 'book p50', 'book p99'))
+    for log_n in args.log_n:
+        params = (2 ** log_n, r, p)
+        app.config['PASSWORD_SCRYPT'] = params
+        stored = passwords.hash_password('bench', params)
+        started = time.perf_counter()
+        passwords.verify_password('bench', stored)
+        hash_ms = (time.perf_counter() - started) * 1000
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE users SET password = ? WHERE full_name = 'bench'", (stored,))
+        conn.commit()
+        conn.close()
+
+        logins, busy, booking = storm(app, path, args.threads, args.seconds)
+        login_stats = percentiles(logins)
+        book_stats = percentiles(booking)
+        print('n=2^%-6d %9.1f %9.1f %8d %10.1f %10.1f %14.1f %14.1f' % (
+            log_n, hash_ms, len(logins) / args.seconds, busy, login_stats['p50_ms'], login_stats['p99_ms'],
+            book_stats['p50_ms'], book_stats['p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
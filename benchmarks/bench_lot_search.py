@@ -0,0 +1,41 @@
+# Lot search: FTS5 prefix search against the old LIKE '%term%' scan.
+#
+#   python benchmarks/bench_lot_search.py [lots]
+
+import sqlite3
+import sys
+
+from common import make_database, summarize, time_requests
+
+import lot_search
+
+TERMS = ['anna', 'nag', 'velach', 'guindy 4', 'tamb', 'street 99']
+
+LIKE_SQL = '''
+    SELECT * FROM parking_lots
+    WHERE pin_code = ? OR lower(prime_location_name) LIKE ?
+'''
+
+
+def main(lots=100000):
+    path = make_database(lots=lots, spots=10, history_per_lot=0, active_ratio=0)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    print('%d lots' % lots)
+    print('%-12s %8s %12s %8s %12s' % ('term', 'like_n', 'like_ms', 'fts_n', 'fts_ms'))
+    for term in TERMS:
+        like = lambda: conn.execute(LIKE_SQL, (term, '%' + term.lower() + '%')).fetchall()
+        fts = lambda: lot_search.search_lots(conn, term)
+        like_stats = summarize(time_requests(like, repeat=10))
+        fts_stats = summarize(time_requests(fts, repeat=10))
+        print('%-12s %8d %12.2f %8d %12.2f' % (
+            term, len(like()), like_stats['median_ms'], len(fts()), fts_stats['median_ms']))
+
+        # Keystroke-style: only the first page of results is rendered
+        first_page = lambda: lot_search.search_lots(conn, term, limit=20)
+        print('%-12s %8s %12s %8s %12.2f  (LIMIT 20)' % (
+            '', '', '', '', summarize(time_requests(first_page, repeat=10))['median_ms']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,121 @@
+# Nearest open lots: the R*Tree search in lot_search.nearest_lots() against
+# reading every lot and ranking them all by distance. Lots are clustered
+# around a few cities with a share of them full; queries come from inside
+# the cities and from the sparse country in between, where the search box
+# has to grow. Both methods must return the same lots.
+#
+#   python benchmarks/bench_nearest.py [--lots 100000] [--queries 500] [--k 10] [--full 0.3]
+
+import argparse
+import heapq
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import percentiles
+
+import lot_search
+import migrations
+
+# (lat, lon) of the cities the lots cluster around
+CITIES = [
+    (13.08, 80.27), (12.97, 77.59), (19.08, 72.88), (28.61, 77.21), (22.57, 88.36),
+    (17.39, 78.49), (18.52, 73.86), (23.02, 72.57), (26.91, 75.79), (11.02, 76.96),
+]
+
+
+def build(lots, full, seed):
+    rng = random.Random(seed)
+    path = os.path.join(tempfile.mkdtemp(prefix='parking-nearest-'), 'users.db')
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    rows = []
+    for lot_id in range(1, lots + 1):
+        if rng.random() < 0.9:
+            lat, lon = rng.choice(CITIES)
+            lat, lon = rng.gauss(lat, 0.08), rng.gauss(lon, 0.08)  # ~9 km spread
+        else:
+            lat, lon = rng.uniform(8, 30), rng.uniform(70, 90)
+        capacity = rng.randint(10, 80)
+        available = 0 if rng.random() < full else rng.randint(1, capacity)
+        rows.append(('Lot %d' % lot_id, 20, 'Street %d' % lot_id, '600001', capacity, available, lat, lon))
+    started = time.perf_counter()
+    conn.executemany('''
+        INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots,
+                                  availability, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    return conn, time.perf_counter() - started
+
+
+def scan_nearest(conn, lat, lon, k, max_km=lot_search.NEAREST_MAX_KM):
+    # The baseline: every open lot, ranked by distance
+    ranked = []
+    for lot_id, lot_lat, lot_lon in conn.execute('''
+        SELECT id, latitude, longitude FROM parking_lots
+        WHERE availability > 0 AND latitude IS NOT NULL
+        -- full-scan-ok: the baseline being measured
+    '''):
+        km = lot_search.distance_km(lat, lon, lot_lat, lot_lon)
+        if km <= max_km:
+            ranked.append((km, lot_id))
+    return [(lot_id, km) for km, lot_id in heapq.nsmallest(k, ranked)]
+
+
+def timed(fn, points, k):
+    samples, results = [], []
+    for lat, lon in points:
+        started = time.perf_counter()
+        results.append(fn(lat, lon, k))
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nearest open lots: R*Tree search against a full scan.')
+    parser.add_argument('--lots', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--scan-queries', type=int, default=50, help='the full scan is slow; time fewer of them')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--full', type=float, default=0.3, help='share of lots with no free spot')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    conn, build_seconds = build(args.lots, args.full, args.seed)
+    print('%d lots inserted and indexed in %.2fs' % (args.lots, build_seconds))
+
+    rng = random.Random(args.seed + 1)
+    points = []
+    for n in range(args.queries):
+        if n % 5:
+            lat, lon = rng.choice(CITIES)
+            points.append((rng.gauss(lat, 0.05), rng.gauss(lon, 0.05)))
+        else:
+            points.append((rng.uniform(8, 30), rng.uniform(70, 90)))
+
+    def rtree(lat, lon, k):
+        return lot_search.nearest_lots(conn, lat, lon, k)
+
+    def scan(lat, lon, k):
+        return scan_nearest(conn, lat, lon, k)
+
+    rtree(*points[0], args.k)
+    stats, found = timed(rtree, points, args.k)
+    scan_stats, expected = timed(scan, points[:args.scan_queries], args.k)
+    for got, want in zip(found, expected):
+        assert [lot_id for lot_id, _ in got] == [lot_id for lot_id, _ in want], (got, want)
+
+    short = sum(1 for result in found if len(result) < args.k)
+    print('k=%d, %d queries (%d with fewer than k open lots within %.0f km)' % (
+        args.k, len(points), short, lot_search.NEAREST_MAX_KM))
+    print('%-8s %10s %10s %10s' % ('method', 'p50_ms', 'p99_ms', 'max_ms'))
+    for name, result in (('rtree', stats), ('scan', scan_stats)):
+        print('%-8s %10.3f %10.3f %10.3f' % (name, result['p50_ms'], result['p99_ms'], result['max_ms']))
+    print('results match the full scan on %d queries' % min(len(points), args.scan_queries))
+
+
+if __name__ == '__main__':
+    main()
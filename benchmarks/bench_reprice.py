@@ -0,0 +1,57 @@
+# Month-end re-pricing over a large bookings table. Fills one month with
+# `bookings` closed bookings spread over `lots` lots, gives half the lots a
+# peak/cap/grace tariff, then times tariffs.reprice() against pricing each
+# booking with Tariff.cost() one at a time.
+#
+#   python benchmarks/bench_reprice.py [lots] [bookings]
+
+import sys
+import time
+from datetime import datetime
+
+from common import make_database
+
+import db
+import tariffs
+
+
+def main(lots=500, bookings=1000000):
+    path = make_database(lots=lots, spots=100, history_per_lot=0, active_ratio=0)
+    conn = db.connect(path)
+    for lot_id in range(1, lots + 1, 2):
+        tariffs.save(conn, lot_id, peak_rate=60, peak_start=8 * 60, peak_end=20 * 60, daily_cap=500,
+                     grace_minutes=10, unit_minutes=30)
+    # Starts spread over March 2024, stays of 5 minutes to 2 days
+    conn.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        INSERT INTO bookings (user_id, parking_lot_id, vehicle_no, timestamp, released_at, active, spot_id, estimated_cost)
+        SELECT 1, 1 + i % ?, 'TN00', datetime(start, 'unixepoch'), datetime(start + stay, 'unixepoch'), 0, 1 + i % 100, 0
+        FROM (SELECT i, 1709251200 + (i * 2654435761) % 2678400 AS start, 300 + (i * 40503) % 172800 AS stay FROM n)
+    ''', (bookings, lots))
+    conn.commit()
+
+    started = time.perf_counter()
+    count = 0
+    total = 0.0
+    for ids, billed, repriced in tariffs.reprice(conn, '2024-03-01 00:00:00', '2024-04-01 00:00:00'):
+        count += len(ids)
+        total += repriced.sum()
+    elapsed = time.perf_counter() - started
+    print('batch:  %d bookings in %.2fs (%.0f rows/s), total %.2f' % (count, elapsed, count / elapsed, total))
+
+    sample = conn.execute('''
+        SELECT b.timestamp, b.released_at, p.price, t.*
+        FROM bookings b JOIN parking_lots p ON p.id = b.parking_lot_id
+        LEFT JOIN lot_tariffs t ON t.parking_lot_id = p.id
+        WHERE b.id <= 100000
+    ''').fetchall()
+    started = time.perf_counter()
+    for row in sample:
+        tariffs.for_lot(row).cost(datetime.fromisoformat(row['timestamp']), datetime.fromisoformat(row['released_at']))
+    elapsed = time.perf_counter() - started
+    print('scalar: %d bookings in %.2fs (%.0f rows/s)' % (len(sample), elapsed, len(sample) / elapsed))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,106 @@
+# Fan-out load test for /api/lots/events. Starts the app on a local threaded
+# server, opens N event streams, publishes events at a fixed rate and
+# reports delivery latency for each subscriber count. A last run adds
+# clients that never read, to check they get dropped rather than slowing
+# down everyone else.
+#
+#   python benchmarks/bench_sse.py [subscriber counts, e.g. 10 50 200]
+
+import http.client
+import json
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from common import make_database, summarize
+
+import events
+
+AUTH = {'Authorization': 'Bearer bench'}
+
+
+def read_stream(port, latencies, expected, ready, done):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/api/lots/events', headers=AUTH)
+    response = conn.getresponse()
+    ready.release()
+    seen = 0
+    while seen < expected:
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'data: '):
+            event = json.loads(line[6:])
+            if 'sent' in event:
+                latencies.append((time.perf_counter() - event['sent']) * 1000)
+                seen += 1
+    conn.close()
+    done.release()
+
+
+def stalled_stream(port, stop):
+    # Subscribes and then never reads; the server side has to give up on it.
+    # A small receive buffer stands in for a client on a slow link.
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    conn.sock.connect(('127.0.0.1', port))
+    conn.request('GET', '/api/lots/events', headers=AUTH)
+    response = conn.getresponse()  # keep a reference or the socket is closed
+    stop.wait()
+    response.close()
+
+
+def run(port, subscribers, count, rate, stalled=0, padding=200):
+    latencies = []
+    ready = threading.Semaphore(0)
+    done = threading.Semaphore(0)
+    stop = threading.Event()
+    dropped_before = events.broker.dropped
+    for _ in range(stalled):
+        threading.Thread(target=stalled_stream, args=(port, stop), daemon=True).start()
+    for _ in range(subscribers):
+        threading.Thread(target=read_stream, args=(port, latencies, count, ready, done), daemon=True).start()
+    for _ in range(subscribers):
+        ready.acquire()
+    while events.broker.subscriber_count() < subscribers + stalled:
+        time.sleep(0.01)
+
+    started = time.perf_counter()
+    for i in range(count):
+        events.broker.publish({'type': 'spot', 'lot_id': 1, 'spot_id': i % 20 + 1, 'occupied': bool(i % 2),
+                               'padding': 'x' * padding, 'sent': time.perf_counter()})
+        time.sleep(max(0, started + (i + 1) / rate - time.perf_counter()))
+    for _ in range(subscribers):
+        done.acquire(timeout=30)
+    stop.set()
+
+    result = {'subscribers': subscribers, 'stalled': stalled, 'events': count,
+              'delivered': len(latencies), 'dropped': events.broker.dropped - dropped_before}
+    if latencies:
+        result.update(summarize(latencies))
+    return result
+
+
+def main(counts=(10, 50, 200), events_per_run=500, rate=200):
+    from app import app
+    app.config['DATABASE'] = make_database(lots=1, spots=20, history_per_lot=0)
+    app.config['EVENTS_MAX_SUBSCRIBERS'] = 10000
+    app.config['EVENTS_TOKEN'] = 'bench'
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    for subscribers in counts:
+        print(json.dumps(run(port, subscribers, events_per_run, rate)))
+    # Large events fill the stalled clients' socket buffers, then their
+    # queues, and they are dropped while the readers keep up.
+    print(json.dumps(run(port, counts[0], events_per_run * 4, rate * 4, stalled=5, padding=16000)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(tuple(int(arg) for arg in sys.argv[1:]) or (10, 50, 200))
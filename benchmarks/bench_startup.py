@@ -0,0 +1,78 @@
+# Worker start cost: time to import app.py and the resulting RSS, measured
+# in fresh interpreters, plus what the first server-side chart adds once
+# matplotlib is pulled in. Exits non-zero when a module that should load
+# lazily (matplotlib, numpy) is imported at startup, or when a budget is
+# given and exceeded, so it can guard CI.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--max-import-ms 400] [--max-rss-mb 80]
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from common import ROOT
+
+LAZY_MODULES = ['matplotlib', 'numpy', 'PIL']
+
+PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+result = {
+    'import_ms': imported * 1000,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'loaded': [name for name in %r if name in sys.modules],
+}
+if %r:
+    import charts
+    started = time.perf_counter()
+    charts.render('occupancy', ['A', 'B', 'C'], [3, 5, 1], [2, 0, 4])
+    result['chart_ms'] = (time.perf_counter() - started) * 1000
+    result['chart_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+'''
+
+
+def probe(with_chart):
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE % (LAZY_MODULES, with_chart)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and RSS of app.py in a fresh interpreter.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    args = parser.parse_args()
+
+    probe(False)  # warm the OS file cache and __pycache__
+    runs = [probe(False) for _ in range(args.runs)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    rss_mb = statistics.median(run['rss_mb'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    chart = probe(True)
+
+    print('import app:        %7.1f ms  rss %6.1f MB  (median of %d)' % (import_ms, rss_mb, args.runs))
+    print('+ first chart:     %7.1f ms  rss %6.1f MB' % (chart['chart_ms'], chart['chart_rss_mb']))
+    print('loaded at import:  %s' % (', '.join(loaded) or 'none of ' + ', '.join(LAZY_MODULES)))
+
+    failures = []
+    if loaded:
+        failures.append('%s imported at startup' % ', '.join(loaded))
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        failures.append('import took %.1f ms (budget %.1f)' % (import_ms, args.max_import_ms))
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        failures.append('rss %.1f MB (budget %.1f)' % (rss_mb, args.max_rss_mb))
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations  # noqa: E402
+
+SEED = '''
+INSERT INTO admin (username, password) VALUES ('admin', 'admin123');
+INSERT INTO users (full_name, address, pincode, email, password) VALUES ('bench', 'addr', '600001', 'bench@example.com', 'bench');
+'''
+
+LOCATIONS = ['Anna Nagar', 'T Nagar', 'Adyar', 'Velachery', 'Guindy', 'Tambaram', 'Porur', 'Mylapore']
+
+
+def make_database(lots=10, spots=20, history_per_lot=50, active_ratio=0.5, seed=1):
+    # Fresh database in a temp dir: `lots` lots of `spots` spots each, with
+    # closed booking history and roughly `active_ratio` of spots occupied.
+    rng = random.Random(seed)
+    path = os.path.join(tempfile.mkdtemp(prefix='parking-bench-'), 'users.db')
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.executescript(SEED)
+    for lot_id in range(1, lots + 1):
+        occupied = [s for s in range(1, spots + 1) if rng.random() < active_ratio]
+        conn.execute(
+            'INSERT INTO parking_lots (id, prime_location_name, price, address, pin_code, maximum_number_of_spots, availability) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (lot_id, '%s %d' % (rng.choice(LOCATIONS), lot_id), rng.choice([20, 30, 50]),
+             'Street %d' % lot_id, str(600000 + lot_id % 100), spots, spots - len(occupied)),
+        )
+        conn.executemany(
+            'INSERT INTO bookings (user_id, parking_lot_id, vehicle_no, timestamp, active, spot_id, estimated_cost) '
+            "VALUES (1, ?, 'TN00', datetime('now', ?), 0, ?, ?)",
+            [(lot_id, '-%d hours' % rng.randint(2, 20000), rng.randint(1, spots), 40.0) for _ in range(history_per_lot)],
+        )
+        conn.executemany(
+            'INSERT INTO bookings (user_id, parking_lot_id, vehicle_no, timestamp, active, spot_id, estimated_cost) '
+            "VALUES (1, ?, 'TN01', datetime('now', '-1 hours'), 1, ?, 0)",
+            [(lot_id, spot) for spot in occupied],
+        )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def make_client(path, role='admin'):
+    from app import app
+    app.config['DATABASE'] = path
+    app.config['TESTING'] = True
+    client = app.test_client()
+    if role == 'admin':
+        client.post('/admin_login', data={'username': 'admin', 'password': 'admin123'})
+    else:
+        client.post('/user_login', data={'username': 'bench', 'password': 'bench'})
+    return client
+
+
+def time_requests(fn, repeat=20):
+    # Latencies in milliseconds; the first call warms caches and is discarded.
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def percentiles(samples):
+    # Latency distribution in milliseconds for harness results
+    samples = sorted(samples)
+    if not samples:
+        return {'p50_ms': 0.0, 'p90_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'mean_ms': 0.0}
+
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))], 3)
+
+    return {
+        'p50_ms': at(0.5),
+        'p90_ms': at(0.9),
+        'p99_ms': at(0.99),
+        'max_ms': round(samples[-1], 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+
+def environment():
+    # What a result was measured on, saved next to it
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ''
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
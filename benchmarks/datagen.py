@@ -0,0 +1,174 @@
+# Synthetic parking data of configurable size. Lot popularity and user
+# activity follow Zipf-like skews, arrivals peak in the morning and evening
+# and dip at weekends, and stays are log-normal around two hours. Closed
+# bookings cover `years` of history; each lot also gets `occupancy` of its
+# spots taken by active bookings. The rollup tables are rebuilt at the end.
+#
+#   python benchmarks/datagen.py out.db [--lots 200] [--spots 50] [--users 2000]
+#                                       [--years 1] [--per-lot-day 6] [--seed 1]
+#
+# Every user is "user<N>" with password "pw"; the admin is admin/admin123.
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import timedelta
+
+from common import LOCATIONS
+
+import archive
+import migrations
+import passwords
+import rollups
+import tariffs
+
+# Relative arrivals per hour of day (local time)
+HOURLY_PROFILE = [1, 1, 1, 1, 1, 2, 4, 8, 12, 11, 8, 7, 7, 7, 6, 6, 7, 9, 11, 9, 6, 4, 2, 1]
+CHUNK = 50000
+
+
+def zipf_weights(n, s, rng):
+    # Popularity by rank, shuffled so popular rows aren't all the low ids
+    weights = [1 / (rank ** s) for rank in range(1, n + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def cumulative(weights):
+    total = 0.0
+    out = []
+    for weight in weights:
+        total += weight
+        out.append(total)
+    return out
+
+
+def generate(path, lots=200, spots=50, users=2000, years=1.0, per_lot_day=6.0, occupancy=0.4, seed=1, quiet=False,
+             archive_path=None):
+    # The database and its archive are both started afresh
+    rng = random.Random(seed)
+    archive_path = archive_path or archive.default_path(path)
+    for stale in (path, archive_path):
+        if os.path.exists(stale):
+            os.remove(stale)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn, archive_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    started = time.perf_counter()
+
+    conn.execute("INSERT INTO admin (username, password) VALUES ('admin', ?)", (passwords.hash_password('admin123'),))
+    # One hash shared by every user: hashing each one would dominate the
+    # run, and logins only need a valid hash with the default work factor
+    pw = passwords.hash_password('pw')
+    conn.executemany(
+        "INSERT INTO users (full_name, address, pincode, email, password) VALUES (?, ?, ?, ?, ?)",
+        [('user%d' % n, '%d Main Road' % n, str(600001 + n % 120), 'user%d@example.com' % n, pw)
+         for n in range(1, users + 1)],
+    )
+
+    prices = {}
+    capacities = {}
+    # Coordinates around Chennai, from their own generator so the rest of
+    # the data is the same as before lots had them
+    geo = random.Random(seed + 1)
+    for lot_id in range(1, lots + 1):
+        capacity = rng.randint(max(1, spots // 2), max(1, spots * 3 // 2))
+        price = rng.choice([10, 20, 20, 30, 40, 50])
+        conn.execute(
+            'INSERT INTO parking_lots (id, prime_location_name, price, address, pin_code, maximum_number_of_spots, availability, '
+            'latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (lot_id, '%s %d' % (rng.choice(LOCATIONS), lot_id), price, '%d Lake View Street' % lot_id,
+             str(600001 + rng.randrange(120)), capacity, capacity, geo.gauss(13.05, 0.06), geo.gauss(80.23, 0.05)),
+        )
+        prices[lot_id] = price
+        capacities[lot_id] = capacity
+
+    lot_cum = cumulative(zipf_weights(lots, 1.1, rng))
+    user_cum = cumulative(zipf_weights(users, 0.8, rng))
+    hour_cum = cumulative(HOURLY_PROFILE)
+    lot_ids = list(range(1, lots + 1))
+    user_ids = list(range(1, users + 1))
+    flat = {lot_id: tariffs.Tariff(price) for lot_id, price in prices.items()}
+    now = tariffs.utcnow().replace(microsecond=0)
+    days = max(1, int(years * 365))
+    # Local (IST) midnight of the first day, as naive UTC
+    first_day = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0) - timedelta(minutes=330)
+
+    insert = '''
+        INSERT INTO bookings (user_id, parking_lot_id, vehicle_no, timestamp, released_at, active, spot_id, estimated_cost)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    rows = []
+    total = 0
+    for day in range(days):
+        midnight = first_day + timedelta(days=day)
+        weekend = midnight.weekday() >= 5
+        count = int(rng.gauss(1, 0.1) * lots * per_lot_day * (0.7 if weekend else 1.0))
+        for lot_id, user_id, hour in zip(
+            rng.choices(lot_ids, cum_weights=lot_cum, k=count),
+            rng.choices(user_ids, cum_weights=user_cum, k=count),
+            rng.choices(range(24), cum_weights=hour_cum, k=count),
+        ):
+            start = midnight + timedelta(hours=hour, seconds=rng.randrange(3600))
+            stay = timedelta(minutes=min(72 * 60, max(5, rng.lognormvariate(math.log(120), 0.8))))
+            end = start + stay
+            if end >= now:
+                continue
+            rows.append((
+                user_id, lot_id, 'TN%02d%s%04d' % (user_id % 100, chr(65 + user_id % 26), user_id % 10000),
+                start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'), 0,
+                rng.randint(1, capacities[lot_id]), flat[lot_id].cost(start, end),
+            ))
+        if len(rows) >= CHUNK:
+            conn.executemany(insert, rows)
+            total += len(rows)
+            rows = []
+    conn.executemany(insert, rows)
+    total += len(rows)
+
+    active = 0
+    for lot_id, capacity in capacities.items():
+        taken = rng.sample(range(1, capacity + 1), int(capacity * occupancy))
+        conn.executemany(insert, [
+            (rng.choices(user_ids, cum_weights=user_cum)[0], lot_id, 'TN09Z%04d' % spot,
+             (now - timedelta(minutes=rng.randint(5, 12 * 60))).strftime('%Y-%m-%d %H:%M:%S'), None, 1, spot, 0)
+            for spot in taken
+        ])
+        conn.execute('UPDATE parking_lots SET availability = ? WHERE id = ?', (capacity - len(taken), lot_id))
+        active += len(taken)
+
+    rollups.backfill(conn)
+    conn.commit()
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    if not quiet:
+        print('%s: %d lots, %d users, %d closed and %d active bookings in %.1fs'
+              % (path, lots, users, total, active, time.perf_counter() - started), file=sys.stderr)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic parking database.')
+    parser.add_argument('path')
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--spots', type=int, default=50, help='average spots per lot')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--per-lot-day', type=float, default=6.0, help='average bookings per lot per day')
+    parser.add_argument('--occupancy', type=float, default=0.4, help='share of spots currently taken')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--archive', help='archive file, replaced along with the database '
+                        '(default: $PARKING_ARCHIVE_DATABASE, else next to path with an -archive suffix)')
+    args = parser.parse_args()
+    generate(args.path, args.lots, args.spots, args.users, args.years, args.per_lot_day, args.occupancy, args.seed,
+             archive_path=args.archive)
+
+
+if __name__ == '__main__':
+    main()
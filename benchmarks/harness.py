@@ -0,0 +1,234 @@
+# Benchmark harness: drives the real Flask routes through the test client,
+# single threaded and from concurrent threads (one logged-in client each),
+# and reports throughput and latency percentiles per scenario. Results are
+# saved as JSON so two runs can be compared.
+#
+#   python benchmarks/harness.py [--db existing.db | datagen options] [--threads 1 4 8]
+#                                [--requests 200] [--scenarios ...] [--out results.json]
+#   python benchmarks/harness.py --compare baseline.json candidate.json
+#
+# Without --db a database is generated with datagen.py into a temp dir.
+# The database is copied before the run, since booking scenarios write to it.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from common import ROOT, environment, percentiles
+
+import datagen
+
+
+class Worker:
+    # One client with its own session, plus a side connection for looking
+    # up the ids the routes redirect away from
+    def __init__(self, app, path, role, user_no, rng):
+        self.client = app.test_client()
+        self.rng = rng
+        self.side = sqlite3.connect(path, check_same_thread=False)
+        if role == 'admin':
+            self.login('/admin_login', 'admin', 'admin123')
+        else:
+            self.login('/user_login', 'user%d' % user_no, 'pw')
+            self.user_id = self.side.execute('SELECT id FROM users WHERE full_name = ?', ('user%d' % user_no,)).fetchone()[0]
+
+    def login(self, url, username, password):
+        response = self.client.post(url, data={'username': username, 'password': password})
+        assert response.status_code == 302, 'login failed for %s' % username
+
+    def close(self):
+        self.side.close()
+
+
+def search_parking(worker, context, timed):
+    term = worker.rng.choice(context['terms'])
+    timed('search_parking', lambda: worker.client.get('/search_parking', query_string={'query': term}))
+
+
+def book_release(worker, context, timed):
+    lot_id = worker.rng.randint(1, context['lots'])
+    timed('book_lot', lambda: worker.client.post('/book_lot/%d' % lot_id, data={'vehicle_no': 'TN01BX0001'}))
+    row = worker.side.execute(
+        'SELECT id FROM bookings WHERE user_id = ? AND active = 1 ORDER BY id DESC LIMIT 1', (worker.user_id,)
+    ).fetchone()
+    if row is not None:
+        timed('release_booking', lambda: worker.client.post('/release_booking/%d' % row[0]))
+
+
+def admin_dashboard(worker, context, timed):
+    timed('admin_dashboard', lambda: worker.client.get('/admin_dashboard'))
+
+
+def admin_summary(worker, context, timed):
+    timed('admin_summary', lambda: worker.client.get('/admin/summary'))
+
+
+# name -> (role, one operation)
+SCENARIOS = {
+    'search_parking': ('user', search_parking),
+    'book_release': ('user', book_release),
+    'admin_dashboard': ('admin', admin_dashboard),
+    'admin_summary': ('admin', admin_summary),
+}
+
+
+def run_scenario(app, path, name, threads, operations, context, seed):
+    role, operation = SCENARIOS[name]
+    workers = [Worker(app, path, role, n + 1, random.Random(seed + n)) for n in range(threads)]
+    for worker in workers:  # warm caches and pools outside the measurement
+        operation(worker, context, lambda route, call: call())
+    samples = {}
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def drive(worker, count):
+        local = {}
+
+        def timed(route, call):
+            started = time.perf_counter()
+            try:
+                response = call()
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            local.setdefault(route, []).append((time.perf_counter() - started) * 1000)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+
+        barrier.wait()
+        for _ in range(count):
+            operation(worker, context, timed)
+        with lock:
+            for route, values in local.items():
+                samples.setdefault(route, []).extend(values)
+
+    per_thread = max(1, operations // threads)
+    pool = [threading.Thread(target=drive, args=(worker, per_thread)) for worker in workers]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.close()
+
+    every = [value for values in samples.values() for value in values]
+    result = {
+        'scenario': name,
+        'threads': threads,
+        'operations': per_thread * threads,
+        'requests': len(every),
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(every) / elapsed, 1),
+    }
+    result.update(percentiles(every))
+    result['routes'] = {route: dict(percentiles(values), requests=len(values)) for route, values in samples.items()}
+    return result
+
+
+def run(args):
+    if args.db:
+        source = args.db
+    else:
+        source = os.path.join(tempfile.mkdtemp(prefix='parking-harness-'), 'source.db')
+        datagen.generate(source, args.lots, args.spots, args.users, args.years, args.per_lot_day, seed=args.seed)
+    path = os.path.join(tempfile.mkdtemp(prefix='parking-harness-'), 'users.db')
+    shutil.copy(source, path)
+
+    sys.path.insert(0, ROOT)
+    from app import app
+    app.config['DATABASE'] = path
+    app.config['TESTING'] = True
+
+    conn = sqlite3.connect(path)
+    lots = conn.execute('SELECT MAX(id) FROM parking_lots').fetchone()[0]
+    names = [row[0] for row in conn.execute('SELECT prime_location_name FROM parking_lots LIMIT 50')]
+    conn.close()
+    context = {
+        'lots': lots,
+        # Whole words and typed-so-far prefixes of real lot names
+        'terms': sorted({word.lower()[:n] for name in names for word in name.split() if not word.isdigit()
+                         for n in (3, len(word))}),
+    }
+
+    results = []
+    for name in args.scenarios:
+        for threads in args.threads:
+            result = run_scenario(app, path, name, threads, args.requests, context, args.seed)
+            results.append(result)
+            print('%-16s threads=%-3d %8.1f req/s  p50 %7.2fms  p90 %7.2fms  p99 %7.2fms  errors %d' % (
+                name, threads, result['throughput_rps'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+                result['errors']))
+
+    report = {
+        'environment': environment(),
+        'dataset': {'source': args.db or 'datagen', 'lots': args.lots, 'spots': args.spots, 'users': args.users,
+                    'years': args.years, 'per_lot_day': args.per_lot_day, 'seed': args.seed}
+        if not args.db else {'source': args.db},
+        'requests_per_scenario': args.requests,
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('saved %s' % args.out)
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    before = {(r['scenario'], r['threads']): r for r in baseline['results']}
+    print('%-16s %7s %22s %22s %22s' % ('scenario', 'threads', 'req/s', 'p50 ms', 'p99 ms'))
+
+    def cell(old, new):
+        change = (new - old) / old * 100 if old else 0.0
+        return '%8.1f -> %-8.1f%+5.0f%%' % (old, new, change)
+
+    for result in candidate['results']:
+        old = before.get((result['scenario'], result['threads']))
+        if old is None:
+            continue
+        print('%-16s %7d %s %s %s' % (
+            result['scenario'], result['threads'],
+            cell(old['throughput_rps'], result['throughput_rps']),
+            cell(old['p50_ms'], result['p50_ms']),
+            cell(old['p99_ms'], result['p99_ms']),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parking app routes.')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'))
+    parser.add_argument('--db', help='benchmark a copy of this database instead of generating one')
+    parser.add_argument('--lots', type=int, default=200)
+    parser.add_argument('--spots', type=int, default=50)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--per-lot-day', type=float, default=6.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=200, help='operations per scenario and thread count')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--out', help='write results as JSON')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
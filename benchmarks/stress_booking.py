@@ -0,0 +1,66 @@
+# Many threads booking spots in one lot at once. Fails if the lot is ever
+# overbooked or a spot ends up with two active bookings; prints throughput.
+#
+#   python benchmarks/stress_booking.py [threads] [spots] [attempts_per_thread]
+
+import sqlite3
+import sys
+import threading
+import time
+
+from common import make_database
+
+import booking_engine
+import db
+
+
+def main(threads=16, spots=50, attempts=20):
+    path = make_database(lots=1, spots=spots, history_per_lot=0, active_ratio=0)
+    outcomes = {'booked': 0, 'rejected': 0, 'released': 0}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(threads)
+
+    def worker(n):
+        conn = db.connect(path)
+        start_barrier.wait()
+        for i in range(attempts):
+            # Half the threads fight over a few hot spots, the rest take any free one
+            spot = (n + i) % 5 + 1 if n % 2 else None
+            try:
+                booking_id, _ = booking_engine.reserve_spot(conn, 1, 1, 'TN%02d' % n, spot)
+                result = 'booked'
+                if i % 3 == 0:
+                    booking_engine.release_spot(conn, booking_id, 1)
+                    result = 'released'
+            except booking_engine.BookingError:
+                result = 'rejected'
+            with lock:
+                outcomes[result] += 1
+        conn.close()
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(path)
+    active = conn.execute('SELECT COUNT(*) FROM bookings WHERE active = 1').fetchone()[0]
+    distinct = conn.execute('SELECT COUNT(DISTINCT spot_id) FROM bookings WHERE active = 1').fetchone()[0]
+    availability = conn.execute('SELECT availability FROM parking_lots WHERE id = 1').fetchone()[0]
+    conn.close()
+
+    total = threads * attempts
+    print('threads=%d spots=%d attempts=%d' % (threads, spots, total))
+    print('booked=%(booked)d released=%(released)d rejected=%(rejected)d' % outcomes)
+    print('active=%d availability=%d elapsed=%.2fs throughput=%.0f ops/s' % (active, availability, elapsed, total / elapsed))
+    assert active <= spots, 'overbooked: %d active bookings for %d spots' % (active, spots)
+    assert distinct == active, 'a spot has more than one active booking'
+    assert active + availability == spots, 'availability counter drifted'
+    print('OK: no overbooking')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,207 @@
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+import changes
+import rollups
+import tariffs
+
+# ---------------------- Booking engine ----------------------
+#
+# Bookings and releases run in a BEGIN IMMEDIATE transaction, so the write
+# lock is taken up front. The availability counter only moves through
+# conditional UPDATEs. The unique partial index on active
+# (parking_lot_id, spot_id) rejects a second active booking for the same
+# spot, even if two requests pick it at once.
+
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.01  # seconds, doubled per attempt
+
+
+class BookingError(Exception):
+    pass
+
+
+def _is_busy(exc):
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def with_retries(conn, work, retries):
+    # Run work(conn) in its own immediate transaction, retrying when another
+    # writer holds the lock longer than the connection's busy_timeout.
+    for attempt in range(retries):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as exc:
+            conn.rollback()
+            if not _is_busy(exc):
+                raise
+            if attempt < retries - 1:
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random()))
+        except BaseException:
+            conn.rollback()
+            raise
+    raise BookingError("The parking lot is busy, please try again.")
+
+
+def _first_free_spot(conn, lot_id, capacity):
+    expected = 1
+    for row in conn.execute(
+        'SELECT spot_id FROM bookings WHERE parking_lot_id = ? AND active = 1 AND spot_id IS NOT NULL ORDER BY spot_id',
+        (lot_id,),
+    ):
+        if row['spot_id'] > expected:
+            break
+        expected = row['spot_id'] + 1
+    return expected if expected <= capacity else None
+
+
+def reserve(conn, lot_id, user_id, vehicle_no, spot_id=None):
+    # Book `spot_id` (or the lowest free spot when None) inside the caller's
+    # transaction and return (booking_id, spot_id). Raises BookingError when
+    # the lot is full, the spot is invalid or another booking got there
+    # first; the caller rolls back what was written.
+    lot = conn.execute(
+        'SELECT maximum_number_of_spots FROM parking_lots WHERE id = ?', (lot_id,)
+    ).fetchone()
+    if lot is None:
+        raise BookingError("No availability for this parking lot.")
+    spot = spot_id if spot_id is not None else _first_free_spot(conn, lot_id, lot['maximum_number_of_spots'])
+    if spot is None or not 1 <= spot <= lot['maximum_number_of_spots']:
+        raise BookingError("No availability for this parking lot.")
+
+    updated = conn.execute(
+        'UPDATE parking_lots SET availability = availability - 1 WHERE id = ? AND availability > 0',
+        (lot_id,),
+    ).rowcount
+    if not updated:
+        raise BookingError("No availability for this parking lot.")
+    try:
+        cur = conn.execute("""
+            INSERT INTO bookings (spot_id, parking_lot_id, user_id, vehicle_no, timestamp, active, estimated_cost)
+            VALUES (?, ?, ?, ?, datetime('now'), 1, 0)
+        """, (spot, lot_id, user_id, vehicle_no))
+    except sqlite3.IntegrityError:
+        raise BookingError("Spot %d was just taken, please pick another." % spot)
+    rollups.record_booking(conn, lot_id, user_id, time.strftime('%Y-%m-%d', time.gmtime()))
+    changes.record_spot(conn, lot_id, spot, True)
+    return cur.lastrowid, spot
+
+
+def reserve_spot(conn, lot_id, user_id, vehicle_no, spot_id=None, retries=MAX_RETRIES):
+    # reserve() in a transaction of its own
+    return with_retries(conn, lambda conn: reserve(conn, lot_id, user_id, vehicle_no, spot_id), retries)
+
+
+# Columns _close_booking needs: the booking plus its lot's price and tariff
+RELEASE_COLUMNS = 'b.id, b.user_id, b.parking_lot_id, b.spot_id, b.timestamp, p.price, ' + ', '.join(
+    't.' + name for name in tariffs.TARIFF_COLUMNS.split(', '))
+
+
+def _close_booking(conn, booking, now):
+    # Price and close one active booking row (RELEASE_COLUMNS) at `now`,
+    # inside the caller's transaction. Returns the cost, or None if the
+    # booking was closed meanwhile.
+    # bookings.timestamp is UTC (datetime('now')), so compare with UTC
+    start_time = datetime.fromisoformat(booking["timestamp"])
+    hours_parked = (now - start_time).total_seconds() / 3600
+    estimated_cost = tariffs.for_lot(booking).cost(start_time, now)
+    released_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    closed = conn.execute(
+        "UPDATE bookings SET active = 0, estimated_cost = ?, released_at = ? WHERE id = ? AND active = 1",
+        (estimated_cost, released_at, booking["id"]),
+    ).rowcount
+    if not closed:
+        return None
+    conn.execute(
+        "UPDATE parking_lots SET availability = availability + 1 WHERE id = ?",
+        (booking["parking_lot_id"],),
+    )
+    rollups.record_release(
+        conn, booking["parking_lot_id"], booking["user_id"], now.strftime('%Y-%m-%d'),
+        estimated_cost, max(0, hours_parked),
+    )
+    changes.record_spot(conn, booking["parking_lot_id"], booking["spot_id"], False)
+    return estimated_cost
+
+
+def release_spot(conn, booking_id, user_id, retries=MAX_RETRIES):
+    # Close an active booking and return its (parking_lot_id, spot_id, cost),
+    # or None when it does not exist or was already released.
+    def work(conn):
+        booking = conn.execute(
+            """
+            SELECT %s
+            FROM bookings b
+            JOIN parking_lots p ON b.parking_lot_id = p.id
+            LEFT JOIN lot_tariffs t ON t.parking_lot_id = p.id
+            WHERE b.id = ? AND b.user_id = ? AND b.active = 1
+            """ % RELEASE_COLUMNS,
+            (booking_id, user_id),
+        ).fetchone()
+        if booking is None:
+            return None
+        estimated_cost = _close_booking(conn, booking, tariffs.utcnow().replace(microsecond=0))
+        return booking["parking_lot_id"], booking["spot_id"], estimated_cost
+
+    return with_retries(conn, work, retries)
+
+
+def active_booking(conn, lot_id, vehicle_no):
+    # The vehicle's active booking in the lot, with RELEASE_COLUMNS, or None
+    return conn.execute(
+        """
+        SELECT %s
+        FROM bookings b
+        JOIN parking_lots p ON b.parking_lot_id = p.id
+        LEFT JOIN lot_tariffs t ON t.parking_lot_id = p.id
+        WHERE b.parking_lot_id = ? AND b.vehicle_no = ? AND b.active = 1
+        """ % RELEASE_COLUMNS,
+        (lot_id, vehicle_no),
+    ).fetchone()
+
+
+def release_vehicle(conn, lot_id, vehicle_no, now):
+    # Close the vehicle's active booking in the lot at `now`, inside the
+    # caller's transaction. Returns (booking_id, spot_id, cost), or None
+    # when the vehicle has no active booking there.
+    booking = active_booking(conn, lot_id, vehicle_no)
+    if booking is None:
+        return None
+    cost = _close_booking(conn, booking, now)
+    return (booking["id"], booking["spot_id"], cost) if cost is not None else None
+
+
+def expire_bookings(conn, booking_ids, retries=MAX_RETRIES):
+    # Close overstayed bookings in one transaction, marking them as expired.
+    # Returns (booking_id, parking_lot_id, spot_id, cost) for those that were
+    # still active.
+    def work(conn):
+        now = tariffs.utcnow().replace(microsecond=0)
+        rows = conn.execute(
+            """
+            SELECT %s
+            FROM bookings b
+            JOIN parking_lots p ON b.parking_lot_id = p.id
+            LEFT JOIN lot_tariffs t ON t.parking_lot_id = p.id
+            WHERE b.id IN (%s) AND b.active = 1
+            """ % (RELEASE_COLUMNS, ', '.join('?' * len(booking_ids))),
+            booking_ids,
+        ).fetchall()
+        closed = []
+        for booking in rows:
+            cost = _close_booking(conn, booking, now)
+            if cost is not None:
+                conn.execute(
+                    "UPDATE bookings SET overstay_flagged_at = IFNULL(overstay_flagged_at, released_at) WHERE id = ?",
+                    (booking["id"],),
+                )
+                closed.append((booking["id"], booking["parking_lot_id"], booking["spot_id"], cost))
+        return closed
+
+    return with_retries(conn, work, retries) if booking_ids else []
@@ -0,0 +1,350 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+import db
+import lot_search
+import migrations
+import occupancy
+import rollups
+
+# ---------------------- Bulk import and export ----------------------
+#
+# Lots and closed (historical) bookings are read one record at a time from
+# CSV or NDJSON and written in chunks. Each chunk is validated and then
+# inserted with executemany in its own BEGIN IMMEDIATE transaction, so a
+# big import never holds the write lock for long and memory stays flat.
+# A bad row is reported with its line number and skipped; the rest of its
+# chunk still goes in. Active bookings are not imported: they have to go
+# through booking_engine so the spot and availability stay consistent.
+#
+# The bookings export pages through a date range by (timestamp, id) and
+# yields text as it goes, so the result is never held in memory.
+
+# Rows per transaction; bigger chunks rewrite fewer index pages per row but
+# hold the write lock longer (~0.2s for 5000 bookings).
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'ndjson')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+EXPORT_COLUMNS = (
+    'id', 'parking_lot_id', 'spot_id', 'user_id', 'vehicle_no',
+    'timestamp', 'released_at', 'active', 'estimated_cost',
+)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        # Reference errors are found per chunk, after the parse errors
+        errors = sorted(self.errors, key=lambda e: e['line'])
+        return {'imported': self.imported, 'rejected': self.rejected, 'errors': errors}
+
+
+def format_for(filename, default='csv'):
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def text_stream(binary):
+    # Decoded view of an uploaded or piped file; a UTF-8 BOM is dropped
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def read_records(stream, fmt):
+    # (line number, record, error) for each record of a text stream
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_no, None, 'invalid JSON: %s' % exc
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'expected a JSON object'
+            continue
+        yield line_no, record, None
+
+
+# ---------------------- Validation ----------------------
+
+def _field(record, *names, required=True):
+    # First non-empty value among `names` (CSV gives '' for empty cells)
+    for name in names:
+        value = record.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        if value is not None and value != '':
+            return value
+    if required:
+        raise ValueError('missing %s' % names[0])
+    return None
+
+
+def _number(value, name, cast=float, minimum=0):
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError('%s is not a number: %r' % (name, value))
+    if number < minimum:
+        raise ValueError('%s must be at least %s' % (name, minimum))
+    return number
+
+
+def _datetime(value, name):
+    # Naive UTC; aware values are converted
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('%s is not an ISO date/time: %r' % (name, value))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _timestamp(value, name):
+    # Stored the way SQLite's datetime('now') writes them
+    return _datetime(value, name).strftime(TIMESTAMP_FORMAT)
+
+
+def _lot_row(record):
+    spots = _number(_field(record, 'maximum_number_of_spots', 'spots'), 'maximum_number_of_spots', int, 1)
+    latitude = _field(record, 'latitude', 'lat', required=False)
+    longitude = _field(record, 'longitude', 'lon', required=False)
+    location = (None, None)
+    if latitude is not None or longitude is not None:
+        location = lot_search.point(latitude, longitude)
+        if location is None:
+            raise ValueError('latitude/longitude are not valid coordinates: %r, %r' % (latitude, longitude))
+    return (
+        str(_field(record, 'prime_location_name', 'location')),
+        _number(_field(record, 'price'), 'price'),
+        str(_field(record, 'address')),
+        str(_field(record, 'pin_code')),
+        spots,
+        spots,
+    ) + location
+
+
+def _booking_row(record):
+    active = _field(record, 'active', required=False)
+    if active is not None and str(active).lower() not in ('0', 'false'):
+        raise ValueError('only closed bookings can be imported')
+    started = _datetime(_field(record, 'timestamp', 'started_at'), 'timestamp')
+    released = _field(record, 'released_at', required=False)
+    hours = None
+    if released is not None:
+        released = _datetime(released, 'released_at')
+        if released < started:
+            raise ValueError('released_at is before timestamp')
+        hours = (released - started).total_seconds() / 3600
+        released = released.strftime(TIMESTAMP_FORMAT)
+    spot = _field(record, 'spot_id', required=False)
+    return {
+        'lot_id': _number(_field(record, 'parking_lot_id', 'lot_id'), 'parking_lot_id', int, 1),
+        'user_id': _number(_field(record, 'user_id'), 'user_id', int, 1),
+        'spot_id': _number(spot, 'spot_id', int, 1) if spot is not None else None,
+        'vehicle_no': str(_field(record, 'vehicle_no')),
+        'timestamp': started.strftime(TIMESTAMP_FORMAT),
+        'released_at': released,
+        'hours': hours,
+        'cost': _number(_field(record, 'estimated_cost', 'cost', required=False) or 0, 'estimated_cost'),
+    }
+
+
+def _id_chunks(ids):
+    # (ids, placeholders) pairs that stay under SQLite's bound parameter limit
+    ids = list(ids)
+    for start in range(0, len(ids), occupancy.MAX_IN_PARAMS):
+        chunk = ids[start:start + occupancy.MAX_IN_PARAMS]
+        yield chunk, ', '.join('?' * len(chunk))
+
+
+# ---------------------- Import ----------------------
+
+def _write_lots(conn, chunk, report):
+    conn.executemany('''
+        INSERT INTO parking_lots (prime_location_name, price, address, pin_code, maximum_number_of_spots, availability,
+                                  latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [row for _, row in chunk])
+    return len(chunk)
+
+
+def _write_bookings(conn, chunk, report):
+    # References are checked inside the write transaction, so a lot or user
+    # deleted meanwhile can't slip through
+    lots = {}
+    for ids, marks in _id_chunks({b['lot_id'] for _, b in chunk}):
+        for row in conn.execute('SELECT id, maximum_number_of_spots, price FROM parking_lots WHERE id IN (%s)' % marks, ids):
+            lots[row['id']] = row
+    users = set()
+    for ids, marks in _id_chunks({b['user_id'] for _, b in chunk}):
+        users.update(row['id'] for row in conn.execute('SELECT id FROM users WHERE id IN (%s)' % marks, ids))
+    rows = []
+    history = []
+    for line, b in chunk:
+        lot = lots.get(b['lot_id'])
+        if lot is None:
+            report.reject(line, 'no parking lot with id %d' % b['lot_id'])
+            continue
+        if b['user_id'] not in users:
+            report.reject(line, 'no user with id %d' % b['user_id'])
+            continue
+        if b['spot_id'] is not None and b['spot_id'] > (lot['maximum_number_of_spots'] or 0):
+            report.reject(line, 'spot_id %d is outside lot %d' % (b['spot_id'], b['lot_id']))
+            continue
+        hours = b['hours']
+        if hours is None:
+            # Same estimate as rollups.backfill for bookings without released_at
+            hours = b['cost'] / lot['price'] if lot['price'] else 0
+        rows.append((b['spot_id'], b['lot_id'], b['user_id'], b['vehicle_no'], b['timestamp'], b['cost'], b['released_at']))
+        history.append((b['lot_id'], b['user_id'], b['timestamp'], b['released_at'], b['cost'], hours))
+    conn.executemany('''
+        INSERT INTO bookings (spot_id, parking_lot_id, user_id, vehicle_no, timestamp, active, estimated_cost, released_at)
+        VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+    ''', rows)
+    rollups.record_history(conn, history)
+    return len(rows)
+
+
+# kind -> (record parser, chunk writer)
+IMPORTERS = {
+    'lots': (_lot_row, _write_lots),
+    'bookings': (_booking_row, _write_bookings),
+}
+
+
+def _flush(conn, write, chunk, report):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        report.imported += write(conn, chunk, report)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def import_records(conn, kind, records, chunk_size=CHUNK_SIZE):
+    # `records` as yielded by read_records(); returns an ImportReport
+    parse, write = IMPORTERS[kind]
+    report = ImportReport()
+    chunk = []
+    for line, record, error in records:
+        if error is None:
+            try:
+                chunk.append((line, parse(record)))
+            except ValueError as exc:
+                error = str(exc)
+        if error is not None:
+            report.reject(line, error)
+        if len(chunk) >= chunk_size:
+            _flush(conn, write, chunk, report)
+            chunk = []
+    if chunk:
+        _flush(conn, write, chunk, report)
+    return report
+
+
+# ---------------------- Export ----------------------
+
+def date_range(start, end):
+    # [start, end) as stored timestamps; a bare end date includes that day
+    if not start or not end:
+        raise ValueError('start and end are required')
+    lower = _timestamp(start, 'start')
+    upper = _timestamp(end, 'end')
+    if len(end.strip()) == 10:
+        upper = (datetime.strptime(upper, TIMESTAMP_FORMAT) + timedelta(days=1)).strftime(TIMESTAMP_FORMAT)
+    return lower, upper
+
+
+def export_bookings(conn, start, end, fmt='csv', batch_size=CHUNK_SIZE):
+    # Bookings that started in [start, end), oldest first, as text chunks
+    if fmt == 'csv':
+        out = io.StringIO()
+        csv.writer(out).writerow(EXPORT_COLUMNS)
+        yield out.getvalue()
+    after = (start, 0)
+    while True:
+        rows = conn.execute('''
+            SELECT %s FROM all_bookings
+            WHERE (timestamp, id) > (?, ?) AND timestamp < ?
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''' % ', '.join(EXPORT_COLUMNS), (after[0], after[1], end, batch_size)).fetchall()
+        if not rows:
+            return
+        out = io.StringIO()
+        if fmt == 'csv':
+            csv.writer(out).writerows(tuple(row) for row in rows)
+        else:
+            for row in rows:
+                out.write(json.dumps(dict(row)) + '\n')
+        yield out.getvalue()
+        after = (rows[-1]['timestamp'], rows[-1]['id'])
+
+
+# ---------------------- CLI ----------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import lots or closed bookings, or export bookings.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, '
+                        'else next to --db with an -archive suffix)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('import', help='import a CSV or NDJSON file ("-" for stdin)')
+    load.add_argument('kind', choices=sorted(IMPORTERS))
+    load.add_argument('file')
+    load.add_argument('--format', choices=FORMATS)
+    load.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    dump = commands.add_parser('export', help='write bookings that started in a date range to stdout')
+    dump.add_argument('--start', required=True)
+    dump.add_argument('--end', required=True)
+    dump.add_argument('--format', choices=FORMATS, default='csv')
+    args = parser.parse_args()
+
+    conn = db.connect(args.db, archive_path=args.archive)
+    migrations.migrate(conn)
+    if args.command == 'import':
+        fmt = args.format or format_for(args.file)
+        if args.file == '-':
+            stream = text_stream(sys.stdin.buffer)
+        else:
+            stream = text_stream(open(args.file, 'rb'))
+        with stream:
+            report = import_records(conn, args.kind, read_records(stream, fmt), args.chunk_size)
+        for error in report.errors:
+            print('line %(line)d: %(error)s' % error, file=sys.stderr)
+        print('%d imported, %d rejected' % (report.imported, report.rejected))
+    else:
+        start, end = date_range(args.start, args.end)
+        for text in export_bookings(conn, start, end, args.format):
+            sys.stdout.write(text)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
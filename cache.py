@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+import occupancy
+
+# ---------------------- In-process cache ----------------------
+
+
+class TTLCache:
+    # Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    # Writers invalidate keys explicitly; the TTL only bounds how stale an
+    # entry can get if an invalidation is missed (e.g. another process).
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# ---------------------- Lot records ----------------------
+
+# Lot name, price, capacity and availability, keyed by lot id.
+lot_cache = TTLCache(maxsize=4096, ttl=30)
+
+
+def get_lots(conn, lot_ids):
+    # Read-through: lot dicts for `lot_ids`, in order, skipping lots that
+    # don't exist. Misses are loaded with one query.
+    found = {}
+    missing = []
+    for lot_id in lot_ids:
+        lot = lot_cache.get(lot_id)
+        if lot is None:
+            missing.append(lot_id)
+        else:
+            found[lot_id] = lot
+    for start in range(0, len(missing), occupancy.MAX_IN_PARAMS):
+        chunk = missing[start:start + occupancy.MAX_IN_PARAMS]
+        rows = conn.execute(
+            'SELECT * FROM parking_lots WHERE id IN (%s)' % ', '.join('?' * len(chunk)), chunk
+        )
+        for row in rows:
+            lot = dict(row)
+            lot_cache.set(lot['id'], lot)
+            found[lot['id']] = lot
+    return [found[lot_id] for lot_id in lot_ids if lot_id in found]
+
+
+def get_lot(conn, lot_id):
+    lots = get_lots(conn, [lot_id])
+    return lots[0] if lots else None
+
+
+def invalidate_lot(lot_id):
+    lot_cache.invalidate(lot_id)
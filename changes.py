@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import uuid
+
+import cache
+import db
+import events
+import occupancy
+
+# ---------------------- Cross-process changes ----------------------
+#
+# Every worker process keeps its own lot cache, spot allocators and event
+# broker. A writer applies its change to its own process with
+# apply_spot()/apply_lot() after committing, and also appends the change
+# to lot_changes inside its transaction with record_spot()/record_lot(),
+# tagged with the process's origin. Each process follows the table from a
+# background thread and applies the changes of every other origin the
+# same way, so a booking made in one worker reaches the search results
+# and event streams of all of them within CHANGES_POLL_INTERVAL.
+#
+# The table keeps the last KEEP_ROWS changes. A process that falls
+# further behind than that drops its caches and reloads them.
+
+DEFAULTS = {
+    'CHANGES_FOLLOW': True,
+    'CHANGES_POLL_INTERVAL': 0.2,  # seconds
+}
+KEEP_ROWS = 10000
+PRUNE_EVERY = 1000
+
+_origin = {'pid': None, 'id': None}
+
+
+def origin():
+    # Per process, and new after a fork (pids are reused)
+    if _origin['pid'] != os.getpid():
+        _origin['pid'] = os.getpid()
+        _origin['id'] = '%d-%s' % (os.getpid(), uuid.uuid4().hex[:12])
+    return _origin['id']
+
+
+# ---------------------- Writing ----------------------
+
+def _record(conn, lot_id, spot_id, occupied, fields):
+    seq = conn.execute(
+        'INSERT INTO lot_changes (origin, lot_id, spot_id, occupied, fields) VALUES (?, ?, ?, ?, ?)',
+        (origin(), lot_id, spot_id, occupied, fields),
+    ).lastrowid
+    if seq % PRUNE_EVERY == 0:
+        conn.execute('DELETE FROM lot_changes WHERE seq <= ?', (seq - KEEP_ROWS,))
+
+
+def record_spot(conn, lot_id, spot_id, occupied):
+    _record(conn, lot_id, spot_id, 1 if occupied else 0, None)
+
+
+def record_lot(conn, lot_id, **fields):
+    _record(conn, lot_id, None, None, json.dumps(fields))
+
+
+def apply_spot(lot_id, spot_id, occupied):
+    if occupied:
+        occupancy.allocators.occupy(lot_id, spot_id)
+    else:
+        occupancy.allocators.release(lot_id, spot_id)
+    cache.invalidate_lot(lot_id)
+    events.spot_changed(lot_id, spot_id, occupied)
+
+
+def apply_lot(lot_id, **fields):
+    # Capacity or details changed, or the lot was deleted
+    occupancy.allocators.discard(lot_id)
+    cache.invalidate_lot(lot_id)
+    events.lot_changed(lot_id, **fields)
+
+
+# ---------------------- Following ----------------------
+
+_lock = threading.Lock()
+_position = {'seq': None}
+
+
+def latest(conn):
+    return conn.execute('SELECT MAX(seq) FROM lot_changes').fetchone()[0] or 0
+
+
+def reset(conn):
+    # Follow from the current end of the log, e.g. after a warm-up
+    with _lock:
+        _position['seq'] = latest(conn)
+
+
+def poll(conn):
+    # Apply other processes' changes since the last poll; returns how many
+    with _lock:
+        if _position['seq'] is None:
+            _position['seq'] = latest(conn)
+            return 0
+        rows = conn.execute(
+            'SELECT seq, origin, lot_id, spot_id, occupied, fields FROM lot_changes WHERE seq > ? ORDER BY seq',
+            (_position['seq'],),
+        ).fetchall()
+        if not rows:
+            return 0
+        if rows[0][0] != _position['seq'] + 1:
+            # Pruned past us: what we missed is unknown, so start over
+            occupancy.allocators.clear()
+            cache.lot_cache.clear()
+        me = origin()
+        applied = 0
+        for seq, row_origin, lot_id, spot_id, occupied, fields in rows:
+            if row_origin == me:
+                continue
+            if spot_id is not None:
+                apply_spot(lot_id, spot_id, bool(occupied))
+            else:
+                apply_lot(lot_id, **json.loads(fields or '{}'))
+            applied += 1
+        _position['seq'] = rows[-1][0]
+        return applied
+
+
+class ChangeFollower(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='change-follower', daemon=True)
+        self.app = app
+        self.pid = os.getpid()
+        self.stopping = threading.Event()
+        self.failures = 0
+
+    def run(self):
+        config = self.app.config
+        conn = db.connect(config['DATABASE'], archive_path=config['ARCHIVE_DATABASE'])
+        try:
+            while not self.stopping.is_set():
+                try:
+                    poll(conn)
+                except Exception:
+                    self.failures += 1
+                    self.app.logger.exception('following lot changes failed')
+                self.stopping.wait(config['CHANGES_POLL_INTERVAL'])
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopping.set()
+
+
+_follower = None
+_follower_lock = threading.Lock()
+
+
+def start(app):
+    # One follower per process; a forked child starts its own
+    global _follower
+    with _follower_lock:
+        if _follower is None or _follower.pid != os.getpid():
+            _follower = ChangeFollower(app)
+            _follower.start()
+    return _follower
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.before_request
+    def _start_follower():
+        if app.config['CHANGES_FOLLOW'] and not app.testing:
+            if _follower is None or _follower.pid != os.getpid():
+                start(app)
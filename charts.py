@@ -0,0 +1,93 @@
+import hashlib
+import io
+
+import cache
+
+# ---------------------- Server-side charts ----------------------
+#
+# Optional PNG versions of the summary charts, which the pages otherwise
+# draw in the browser with Chart.js (SERVER_CHARTS = True switches them to
+# these images). matplotlib is imported on the first render, never at
+# startup: it costs every worker hundreds of milliseconds and tens of MB
+# whether or not a chart is ever drawn.
+#
+# Each PNG is cached under a digest of the data it draws, which is also
+# its ETag, so a chart is redrawn only when its numbers change.
+
+DEFAULTS = {
+    'SERVER_CHARTS': False,
+}
+COLORS = ['#4bc0c0', '#36a2eb', '#9966ff', '#ff9f40', '#ff6384', '#66cc66']
+
+png_cache = cache.TTLCache(maxsize=256, ttl=3600)
+
+
+def data_version(kind, *series):
+    return hashlib.sha1(repr((kind,) + series).encode('utf-8')).hexdigest()[:20]
+
+
+def _figure(width=8, height=4.5):
+    # The object API rather than pyplot: no global figure state to share
+    # between request threads
+    from matplotlib.figure import Figure
+    return Figure(figsize=(width, height), dpi=100)
+
+
+def _png(fig):
+    out = io.BytesIO()
+    fig.savefig(out, format='png', bbox_inches='tight')
+    return out.getvalue()
+
+
+def revenue(labels, values):
+    fig = _figure(6, 6)
+    ax = fig.subplots()
+    if any(values):
+        ax.pie(values, labels=labels, colors=COLORS, wedgeprops={'width': 0.45, 'edgecolor': 'white'})
+    else:
+        ax.text(0.5, 0.5, 'No revenue yet', ha='center', va='center')
+        ax.axis('off')
+    ax.set_title('Revenue Distribution')
+    return _png(fig)
+
+
+def occupancy(labels, available, occupied):
+    fig = _figure()
+    ax = fig.subplots()
+    ax.bar(labels, available, color='#28a745', label='Available')
+    ax.bar(labels, occupied, bottom=available, color='#dc3545', label='Occupied')
+    ax.set_title('Occupancy Status per Lot')
+    ax.legend(loc='upper right')
+    ax.tick_params(axis='x', labelrotation=45)
+    return _png(fig)
+
+
+def bookings(labels, counts):
+    fig = _figure()
+    ax = fig.subplots()
+    ax.bar(labels, counts, color='#ff0000')
+    ax.set_title('Bookings')
+    ax.tick_params(axis='x', labelrotation=45)
+    return _png(fig)
+
+
+RENDERERS = {
+    'revenue': revenue,
+    'occupancy': occupancy,
+    'bookings': bookings,
+}
+
+
+def render(kind, *series):
+    # (version, png bytes) for one chart
+    version = data_version(kind, *series)
+    png = png_cache.get(version)
+    if png is None:
+        png = RENDERERS[kind](*series)
+        png_cache.set(version, png)
+    return version, png
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
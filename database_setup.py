@@ -1,67 +1,23 @@
+import os
 import sqlite3
 
-# Connect to the database (will create it if it doesn't exist)
-conn = sqlite3.connect('database/users.db')
-cursor = conn.cursor()
+import migrations
+import passwords
 
-# Users Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
-)
-''')
+# Same location as app.py: $PARKING_DATABASE, or database/users.db next to this file
+path = os.environ.get('PARKING_DATABASE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'users.db'))
+
+# Connect to the database (will create it if it doesn't exist)
+conn = sqlite3.connect(path)
 
-# Admin Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS admin (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT NOT NULL,
-    password TEXT NOT NULL
-)
-''')
+# Create or upgrade every table and index the app uses
+migrations.migrate(conn)
 
 # Insert default admin if not exists
+cursor = conn.cursor()
 cursor.execute("SELECT * FROM admin WHERE username = 'admin'")
 if not cursor.fetchone():
-    cursor.execute("INSERT INTO admin (username, password) VALUES (?, ?)", ('admin', 'admin123'))
-
-# Parking Lots Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS parking_lots (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    prime_location_name TEXT NOT NULL,
-    price REAL NOT NULL,
-    address TEXT,
-    pin_code TEXT,
-    maximum_number_of_spots INTEGER NOT NULL
-)
-''')
-
-# Parking Spots Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS parking_spots (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    lot_id INTEGER,
-    status TEXT CHECK(status IN ('A', 'O')) DEFAULT 'A',
-    FOREIGN KEY (lot_id) REFERENCES parking_lots(id)
-)
-''')
-
-# Reservations Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS reservations (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    spot_id INTEGER,
-    user_id INTEGER,
-    parking_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-    leaving_timestamp DATETIME,
-    parking_cost REAL,
-    FOREIGN KEY (spot_id) REFERENCES parking_spots(id),
-    FOREIGN KEY (user_id) REFERENCES users(id)
-)
-''')
+    cursor.execute("INSERT INTO admin (username, password) VALUES (?, ?)", ('admin', passwords.hash_password('admin123')))
 
 conn.commit()
 conn.close()
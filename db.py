@@ -0,0 +1,135 @@
+import os
+import queue
+import sqlite3
+
+from flask import current_app, g
+
+import archive
+import migrations
+
+# ---------------------- Connection setup ----------------------
+
+# Applied once when a connection is opened, not on every request.
+#   WAL lets dashboard reads run while book_lot/release_booking write.
+#   synchronous=NORMAL is safe under WAL and avoids an fsync per commit.
+#   busy_timeout makes writers wait for the lock instead of failing at once.
+# The booking archive is attached as `archive` (see archive.py).
+DEFAULT_OPTIONS = {
+    'busy_timeout_ms': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cached_statements': 256,
+}
+
+
+def connect(path, busy_timeout_ms=5000, mmap_size=256 * 1024 * 1024, cached_statements=256, archive_path=None):
+    conn = sqlite3.connect(
+        path,
+        timeout=busy_timeout_ms / 1000,
+        cached_statements=cached_statements,
+        check_same_thread=False,  # pooled connections move between worker threads
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=%d' % int(busy_timeout_ms))
+    conn.execute('PRAGMA mmap_size=%d' % int(mmap_size))
+    archive.attach(conn, archive_path)
+    return conn
+
+
+class ConnectionPool:
+    # LIFO so the most recently used (warm) connection is handed out first.
+    # The pool belongs to one process; after a fork the child starts empty.
+
+    def __init__(self, path, size=8, **options):
+        self.path = path
+        self.size = size
+        self.options = dict(DEFAULT_OPTIONS, **options)
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def acquire(self):
+        self._check_pid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, **self.options)
+
+    def release(self, conn):
+        self._check_pid()
+        if conn.in_transaction:
+            conn.rollback()  # never hand out a connection holding a lock
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# ---------------------- Flask integration ----------------------
+
+def _get_pool(app):
+    pool = app.extensions.get('db_pool')
+    if pool is None or (pool.path, pool.options['archive_path']) != (app.config['DATABASE'], app.config['ARCHIVE_DATABASE']):
+        if pool is not None:
+            pool.close_all()
+        pool = ConnectionPool(app.config['DATABASE'], size=app.config['DB_POOL_SIZE'],
+                              archive_path=app.config['ARCHIVE_DATABASE'])
+        if app.config['DB_AUTO_MIGRATE']:
+            conn = pool.acquire()
+            migrations.migrate(conn)
+            pool.release(conn)
+        app.extensions['db_pool'] = pool
+    return pool
+
+
+def get_db():
+    # One connection per app context, returned to the pool on teardown.
+    # An extension may wrap it (profiling.py traces statements).
+    if 'db' not in g:
+        conn = _get_pool(current_app).acquire()
+        tracer = current_app.extensions.get('db_tracer')
+        g.db = tracer(conn) if tracer is not None else conn
+    return g.db
+
+
+def _release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        _get_pool(current_app).release(getattr(conn, 'wrapped', conn))
+
+
+def warm(app):
+    # Open the pool's connections before the first requests need them
+    pool = _get_pool(app)
+    conns = [pool.acquire() for _ in range(pool.size)]
+    for conn in conns:
+        pool.release(conn)
+
+
+def close_pool(app):
+    # Before forking: a child must not inherit open SQLite connections
+    pool = app.extensions.pop('db_pool', None)
+    if pool is not None:
+        pool.close_all()
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', 'database/users.db')
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    # None: $PARKING_ARCHIVE_DATABASE, else users-archive.db next to DATABASE (archive.default_path)
+    app.config.setdefault('ARCHIVE_DATABASE', None)
+    # Apply pending schema migrations when the first connection is opened
+    app.config.setdefault('DB_AUTO_MIGRATE', True)
+    app.teardown_appcontext(_release_db)
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+# ---------------------- Occupancy events ----------------------
+#
+# In-process pub/sub behind the SSE endpoint. Routes publish a small delta
+# after they commit. Every subscriber has a bounded queue; publish() never
+# blocks. A subscriber whose queue is full is dropped and its stream ends,
+# so one slow client can't hold back the rest.
+#
+# stream() blocks a thread on the queue (WSGI); astream() waits on the
+# event loop instead (asgi.py), woken by publish() through the
+# subscriber's waker.
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 15
+
+
+DROPPED = 'event: dropped\ndata: {}\n\n'
+
+
+def format_event(event):
+    return 'event: %s\ndata: %s\n\n' % (event['type'], json.dumps(event))
+
+
+class Subscriber:
+    def __init__(self, lot_ids=None, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.lot_ids = set(lot_ids) if lot_ids else None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = False
+        self.waker = None
+
+    def wake(self):
+        waker = self.waker
+        if waker is not None:
+            waker()
+
+    def wants(self, event):
+        return self.lot_ids is None or event.get('lot_id') in self.lot_ids
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, lot_ids=None, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        subscriber = Subscriber(lot_ids, maxsize)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscriber in subscribers:
+            if not subscriber.wants(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                subscriber.wake()
+            except queue.Full:
+                subscriber.dropped = True
+                with self._lock:
+                    if subscriber in self._subscribers:
+                        self._subscribers.discard(subscriber)
+                        self.dropped += 1
+                # Wake the stream so it notices it was dropped
+                try:
+                    subscriber.queue.get_nowait()
+                    subscriber.queue.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+                subscriber.wake()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, subscriber, heartbeat=HEARTBEAT_SECONDS):
+        # text/event-stream body for one subscriber
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive %d\n\n' % int(time.time())
+                    continue
+                if event is None or subscriber.dropped:
+                    yield DROPPED
+                    return
+                yield format_event(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def astream(self, subscriber, heartbeat=HEARTBEAT_SECONDS):
+        # Same body as stream(), waiting on the running event loop
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        subscriber.waker = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = subscriber.queue.get_nowait()
+                except queue.Empty:
+                    # A publish after this clear() sets `ready` again, since
+                    # its callback only runs once we await
+                    ready.clear()
+                    try:
+                        await asyncio.wait_for(ready.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        yield ': keep-alive %d\n\n' % int(time.time())
+                    continue
+                if event is None or subscriber.dropped:
+                    yield DROPPED
+                    return
+                yield format_event(event)
+        finally:
+            subscriber.waker = None
+            self.unsubscribe(subscriber)
+
+
+broker = Broker()
+
+
+def spot_changed(lot_id, spot_id, occupied):
+    broker.publish({'type': 'spot', 'lot_id': lot_id, 'spot_id': spot_id, 'occupied': occupied})
+
+
+def lot_changed(lot_id, **fields):
+    event = {'type': 'lot', 'lot_id': lot_id}
+    event.update(fields)
+    broker.publish(event)
@@ -0,0 +1,61 @@
+import os
+
+from flask import current_app, render_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+import cache
+
+# ---------------------- Rendered fragments ----------------------
+#
+# The admin dashboard is one card per lot: its occupancy, slot grid and
+# edit form. A card only changes when its lot's row does, and every change
+# to a lot (booking, release, edit, slot removal) bumps parking_lots.version
+# through the trigger from migration 6. Cards are therefore cached as
+# rendered HTML under (template, lot id, version). A page render reuses the
+# cards of unchanged lots and only reads bookings for, and re-renders, the
+# lots whose version moved. The version is read from the database with the
+# lot, so a change made by another worker misses here too.
+#
+# Compiled templates are kept in a Jinja bytecode cache on disk, so a new
+# worker loads them instead of compiling every template again.
+# TEMPLATE_CACHE_DIR picks the directory; None uses Jinja's per-user temp
+# directory and False turns the cache off.
+
+DEFAULTS = {
+    'FRAGMENT_CACHE': True,
+    'TEMPLATE_CACHE_DIR': None,
+}
+
+# Entries for old versions are never read again; the LRU drops them
+fragment_cache = cache.TTLCache(maxsize=8192, ttl=3600)
+
+
+def cached_lots(template, lots):
+    # {lot_id: html} for the lots whose current version has a cached fragment
+    if not current_app.config['FRAGMENT_CACHE']:
+        return {}
+    found = {}
+    for lot in lots:
+        html = fragment_cache.get((template, lot['id'], lot['version']))
+        if html is not None:
+            found[lot['id']] = html
+    return found
+
+
+def render_lot(template, lot_id, version, **context):
+    # Render one lot's fragment and cache it under the lot's version
+    html = Markup(render_template(template, **context))
+    if current_app.config['FRAGMENT_CACHE']:
+        fragment_cache.set((template, lot_id, version), html)
+    return html
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory is not False:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory or None)
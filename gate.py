@@ -0,0 +1,248 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import booking_engine
+import changes
+import db
+import tariffs
+
+# ---------------------- Gate events ----------------------
+#
+# Entry and exit events from the ANPR gate cameras (POST /api/gate/events)
+# are not written by the request threads one transaction each. They go on
+# a queue, and one writer thread per process drains it. The writer takes
+# up to GATE_MAX_BATCH events, waiting at most GATE_MAX_WAIT seconds after
+# the first one for more to arrive. It applies them all in one BEGIN
+# IMMEDIATE transaction and commits once. Each event runs under its own
+# savepoint, so one that fails (a full lot, or an exit for a car that
+# isn't parked) is rolled back alone. The rest of the batch still commits.
+#
+# Every event gets a Future that resolves to its booking, or to the error,
+# once the batch has committed. At most GATE_MAX_PENDING events wait in a
+# process. A request that would go over that is turned away whole with Busy
+# (503 from the API), so a burst can't hold request threads without limit.
+#
+# An entry for a plate that is already parked in the lot is a repeated
+# camera read: it returns the existing booking. Gate bookings belong to
+# the event's user_id, or to the GATE_USER_ID account when it has none.
+
+DEFAULTS = {
+    'GATE_TOKEN': None,  # "Authorization: Bearer <GATE_TOKEN>"; the endpoint is off while unset
+    'GATE_USER_ID': None,
+    'GATE_MAX_BATCH': 256,
+    'GATE_MAX_WAIT': 0.005,  # seconds
+    'GATE_MAX_PENDING': 10000,
+    'GATE_RESULT_TIMEOUT': 10.0,  # seconds a request waits for its events
+}
+KINDS = ('entry', 'exit')
+MAX_EVENTS_PER_REQUEST = 1000
+
+
+class Busy(Exception):
+    pass
+
+
+class GateEvent:
+    __slots__ = ('kind', 'lot_id', 'vehicle_no', 'user_id')
+
+    def __init__(self, kind, lot_id, vehicle_no, user_id):
+        self.kind = kind
+        self.lot_id = lot_id
+        self.vehicle_no = vehicle_no
+        self.user_id = user_id
+
+
+def parse_event(raw, default_user_id=None):
+    # A GateEvent from a decoded JSON object; raises ValueError
+    if not isinstance(raw, dict):
+        raise ValueError('an event must be a JSON object')
+    kind = raw.get('type')
+    if kind not in KINDS:
+        raise ValueError('type must be one of %s' % ', '.join(KINDS))
+    vehicle_no = raw.get('vehicle_no')
+    if not isinstance(vehicle_no, str) or not vehicle_no.strip():
+        raise ValueError('vehicle_no is required')
+    try:
+        lot_id = int(raw.get('lot_id'))
+        user_id = raw.get('user_id', default_user_id)
+        user_id = int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('lot_id and user_id must be integers')
+    if kind == 'entry' and user_id is None:
+        raise ValueError('user_id is required for an entry (no GATE_USER_ID is configured)')
+    return GateEvent(kind, lot_id, vehicle_no.strip(), user_id)
+
+
+def apply_event(conn, event, now):
+    # Inside the batch transaction. Returns (result, spot change or None).
+    if event.kind == 'entry':
+        parked = booking_engine.active_booking(conn, event.lot_id, event.vehicle_no)
+        if parked is not None:
+            return {'booking_id': parked['id'], 'spot_id': parked['spot_id'], 'repeated': True}, None
+        booking_id, spot_id = booking_engine.reserve(conn, event.lot_id, event.user_id, event.vehicle_no)
+        return {'booking_id': booking_id, 'spot_id': spot_id}, (event.lot_id, spot_id, True)
+    released = booking_engine.release_vehicle(conn, event.lot_id, event.vehicle_no, now)
+    if released is None:
+        raise booking_engine.BookingError('%s is not parked in lot %d.' % (event.vehicle_no, event.lot_id))
+    booking_id, spot_id, cost = released
+    return {'booking_id': booking_id, 'spot_id': spot_id, 'cost': cost}, (event.lot_id, spot_id, False)
+
+
+class GateWriter(threading.Thread):
+    # See start(); the benchmark runs its own
+
+    def __init__(self, path, archive_path=None, max_batch=256, max_wait=0.005, max_pending=10000):
+        super().__init__(name='gate-writer', daemon=True)
+        self.path = path
+        self.archive_path = archive_path
+        self.pid = os.getpid()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stopping = False
+        # Counters for /admin/metrics
+        self.events = 0
+        self.batches = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def connect(self):
+        return db.connect(self.path, archive_path=self.archive_path)
+
+    def submit(self, events):
+        # A Future per event, in order, or Busy with nothing queued
+        with self._lock:
+            if self._stopping or self._pending + len(events) > self.max_pending:
+                self.rejected += len(events)
+                raise Busy()
+            self._pending += len(events)
+        futures = []
+        for event in events:
+            future = Future()
+            self._queue.put((event, future))
+            futures.append(future)
+        return futures
+
+    def pending(self):
+        return self._pending
+
+    def run(self):
+        conn = self.connect()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._queue.put(None)  # finish this batch, then stop
+                        break
+                    batch.append(item)
+                self.write(conn, batch)
+        finally:
+            conn.close()
+
+    def write(self, conn, batch):
+        def work(conn):
+            now = tariffs.utcnow().replace(microsecond=0)
+            outcomes = []
+            for event, _ in batch:
+                conn.execute('SAVEPOINT gate_event')
+                try:
+                    outcomes.append(apply_event(conn, event, now))
+                except booking_engine.BookingError as exc:
+                    conn.execute('ROLLBACK TO gate_event')
+                    outcomes.append(exc)
+                conn.execute('RELEASE gate_event')
+            return outcomes
+
+        try:
+            outcomes = booking_engine.with_retries(conn, work, booking_engine.MAX_RETRIES)
+        except Exception as exc:
+            outcomes = [exc] * len(batch)
+            self.failed += len(batch)
+        for (_, future), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+                continue
+            result, change = outcome
+            if change is not None:
+                changes.apply_spot(*change)
+            future.set_result(result)
+        with self._lock:
+            self._pending -= len(batch)
+        self.events += len(batch)
+        self.batches += 1
+
+    def stop(self):
+        # Events already queued are still written
+        with self._lock:
+            self._stopping = True
+        self._queue.put(None)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start(app):
+    # One writer per process, started by the first gate request; a forked
+    # child starts its own
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            config = app.config
+            _writer = GateWriter(
+                config['DATABASE'], config['ARCHIVE_DATABASE'],
+                config['GATE_MAX_BATCH'], config['GATE_MAX_WAIT'], config['GATE_MAX_PENDING'],
+            )
+            _writer.start()
+    return _writer
+
+
+def stats():
+    # This process's writer counters; zeros before the first gate request
+    writer = _writer if _writer is not None and _writer.pid == os.getpid() else None
+    if writer is None:
+        return {'events': 0, 'batches': 0, 'failed': 0, 'rejected': 0, 'pending': 0}
+    return {
+        'events': writer.events,
+        'batches': writer.batches,
+        'failed': writer.failed,
+        'rejected': writer.rejected,
+        'pending': writer.pending(),
+    }
+
+
+def submit(app, raw_events):
+    # A Future per raw event, in order. Events that don't parse get one that
+    # already holds their ValueError; the rest are queued together.
+    futures = []
+    parsed = []
+    for raw in raw_events:
+        try:
+            parsed.append(parse_event(raw, app.config['GATE_USER_ID']))
+            futures.append(None)
+        except ValueError as exc:
+            future = Future()
+            future.set_exception(exc)
+            futures.append(future)
+    queued = iter(start(app).submit(parsed) if parsed else [])
+    return [future if future is not None else next(queued) for future in futures]
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
@@ -0,0 +1,126 @@
+import heapq
+import math
+import re
+
+# ---------------------- Lot search ----------------------
+#
+# One search path for the user search, the admin dashboard filter and the
+# admin search page. A numeric query matches a lot id or pin code exactly.
+# Text queries go through the parking_lots_fts index (name, address,
+# pin code). Every word is matched as a prefix and results come back best
+# match first. The index is kept in sync with parking_lots by triggers
+# (see migrations.m003_lot_search_index).
+
+
+def fts_query(text):
+    # "anna nag" -> "anna"* AND "nag"*; quoting keeps FTS5 operators and
+    # punctuation in user input from being parsed as query syntax.
+    words = re.findall(r'\w+', text)
+    return ' AND '.join('"%s"*' % word for word in words)
+
+
+def _search_sql(query, ids_only):
+    # (sql, params) for a search, or None when the query can match nothing
+    query = (query or '').strip()
+    columns = 'id' if ids_only else '*'
+    if not query:
+        return 'SELECT %s FROM parking_lots ORDER BY id  -- full-scan-ok: empty search lists every lot\n' % columns, []
+    if query.isdigit():
+        return 'SELECT %s FROM parking_lots WHERE id = ? OR pin_code = ?' % columns, [int(query), query]
+    match = fts_query(query)
+    if not match:
+        return None
+    if ids_only:
+        return 'SELECT rowid AS id FROM parking_lots_fts WHERE parking_lots_fts MATCH ? ORDER BY rank', [match]
+    return '''
+        SELECT p.*
+        FROM parking_lots_fts f
+        JOIN parking_lots p ON p.id = f.rowid
+        WHERE parking_lots_fts MATCH ?
+        ORDER BY f.rank
+    ''', [match]
+
+
+def _run(conn, search, limit):
+    if search is None:
+        return []
+    sql, params = search
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params = params + [limit]
+    return conn.execute(sql, params).fetchall()
+
+
+def search_lots(conn, query, limit=None):
+    return _run(conn, _search_sql(query, ids_only=False), limit)
+
+
+def search_lot_ids(conn, query, limit=None):
+    # Matching lot ids only, best match first; callers fetch the records
+    # through cache.get_lots().
+    return [row[0] for row in _run(conn, _search_sql(query, ids_only=True), limit)]
+
+
+# ---------------------- Nearest lots ----------------------
+#
+# Lots with coordinates are points in the parking_lots_geo R*Tree. A search
+# asks the tree for the lots in a box around the driver, keeps those with
+# a free spot, and ranks them by great-circle distance. Only lots inside
+# the circle the box was drawn around are certain to beat everything
+# outside the box, so when fewer than k of those are found the box is
+# doubled and the search repeated, up to NEAREST_MAX_KM. Boxes are not
+# split at the antimeridian.
+
+EARTH_RADIUS_KM = 6371.0
+NEAREST_START_KM = 2.0
+NEAREST_MAX_KM = 50.0
+NEAREST_RESULTS = 10
+MAX_NEAREST = 50  # largest k the API serves
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # Haversine
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, km):
+    # (min_lat, max_lat, min_lon, max_lon) enclosing the circle of radius km
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    scale = math.cos(math.radians(min(89.0, abs(lat) + dlat)))
+    dlon = min(180.0, math.degrees(km / (EARTH_RADIUS_KM * scale)))
+    return max(-90.0, lat - dlat), min(90.0, lat + dlat), lon - dlon, lon + dlon
+
+
+def point(lat, lon):
+    # (lat, lon) as floats when both parse and are in range, else None
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def nearest_lots(conn, lat, lon, k=NEAREST_RESULTS, max_km=NEAREST_MAX_KM):
+    # Up to k lots with a free spot, nearest first, as (lot id, km) pairs
+    radius = min(NEAREST_START_KM, max_km)
+    while True:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+        rows = conn.execute('''
+            SELECT p.id, p.latitude, p.longitude
+            FROM parking_lots_geo g
+            JOIN parking_lots p ON p.id = g.id
+            WHERE g.min_lat <= ? AND g.max_lat >= ? AND g.min_lon <= ? AND g.max_lon >= ?
+              AND p.availability > 0
+        ''', (max_lat, min_lat, max_lon, min_lon)).fetchall()
+        inside = []
+        for lot_id, lot_lat, lot_lon in rows:
+            km = distance_km(lat, lon, lot_lat, lot_lon)
+            if km <= radius:
+                inside.append((km, lot_id))
+        if len(inside) >= k or radius >= max_km:
+            return [(lot_id, km) for km, lot_id in heapq.nsmallest(k, inside)]
+        radius = min(radius * 2, max_km)
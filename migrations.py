@@ -0,0 +1,468 @@
+import argparse
+import ast
+import glob
+import os
+import re
+import sqlite3
+
+import archive
+import rollups
+
+# ---------------------- Schema migrations ----------------------
+#
+# Each migration runs once, in order, inside its own transaction. The
+# schema version is kept in PRAGMA user_version. Add new migrations to the
+# end of MIGRATIONS and never edit one that has shipped.
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)}
+
+
+def _add_columns(conn, table, columns):
+    existing = _columns(conn, table)
+    for name, declaration in columns:
+        if name not in existing:
+            conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, name, declaration))
+
+
+def m001_align_schema(conn):
+    # database_setup.py used to create tables that no longer matched the
+    # queries in app.py. Create what is missing and fill in old tables.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT NOT NULL,
+            address TEXT NOT NULL,
+            pincode TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL
+        )
+    ''')
+    if 'full_name' not in _columns(conn, 'users'):
+        # Old layout (username, password): rebuild, keeping ids and passwords
+        conn.execute('''
+            CREATE TABLE users_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                full_name TEXT NOT NULL,
+                address TEXT NOT NULL,
+                pincode TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            INSERT INTO users_new (id, full_name, address, pincode, email, password)
+            SELECT id, username, '', '', username || '@localhost', password FROM users
+        ''')
+        conn.execute('DROP TABLE users')
+        conn.execute('ALTER TABLE users_new RENAME TO users')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+    ''')
+    _add_columns(conn, 'admin', [('email', 'TEXT')])
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS parking_lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prime_location_name TEXT NOT NULL,
+            price REAL NOT NULL,
+            address TEXT,
+            pin_code TEXT,
+            maximum_number_of_spots INTEGER NOT NULL
+        )
+    ''')
+    _add_columns(conn, 'parking_lots', [('availability', 'INTEGER')])
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            parking_lot_id INTEGER NOT NULL,
+            vehicle_no TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            active INTEGER DEFAULT 1,
+            spot_id INTEGER,
+            estimated_cost REAL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (parking_lot_id) REFERENCES parking_lots(id)
+        )
+    ''')
+    _add_columns(conn, 'bookings', [('spot_id', 'INTEGER'), ('estimated_cost', 'REAL')])
+
+    # Lots created before the availability column existed
+    conn.execute('''
+        UPDATE parking_lots
+        SET availability = maximum_number_of_spots - (
+            SELECT COUNT(*) FROM bookings b WHERE b.parking_lot_id = parking_lots.id AND b.active = 1
+        )
+        WHERE availability IS NULL
+    ''')
+
+
+def m002_hot_query_indexes(conn):
+    # Active bookings per lot: dashboard occupancy, free spots, booking.
+    # UNIQUE so a spot can only have one active booking at a time.
+    conn.execute('DROP INDEX IF EXISTS idx_bookings_active_lot')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_bookings_active_spot
+        ON bookings (parking_lot_id, spot_id) WHERE active = 1
+    ''')
+    # A user's booking history, newest first; covers the dashboard columns
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_history
+        ON bookings (user_id, timestamp, parking_lot_id, active, vehicle_no)
+    ''')
+    # Revenue per lot on the summary page
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_lot_cost
+        ON bookings (parking_lot_id, estimated_cost)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_parking_lots_pin_code ON parking_lots (pin_code)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_full_name ON users (full_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_admin_username ON admin (username)')
+
+
+def m003_lot_search_index(conn):
+    # External-content FTS5 index over the searchable lot columns; the
+    # triggers keep it in step with parking_lots (see lot_search.py).
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS parking_lots_fts USING fts5(
+            prime_location_name, address, pin_code,
+            content='parking_lots', content_rowid='id',
+            tokenize='unicode61', prefix='2 3'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_fts_insert AFTER INSERT ON parking_lots BEGIN
+            INSERT INTO parking_lots_fts (rowid, prime_location_name, address, pin_code)
+            VALUES (new.id, new.prime_location_name, new.address, new.pin_code);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_fts_delete AFTER DELETE ON parking_lots BEGIN
+            INSERT INTO parking_lots_fts (parking_lots_fts, rowid, prime_location_name, address, pin_code)
+            VALUES ('delete', old.id, old.prime_location_name, old.address, old.pin_code);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_fts_update
+        AFTER UPDATE OF prime_location_name, address, pin_code ON parking_lots BEGIN
+            INSERT INTO parking_lots_fts (parking_lots_fts, rowid, prime_location_name, address, pin_code)
+            VALUES ('delete', old.id, old.prime_location_name, old.address, old.pin_code);
+            INSERT INTO parking_lots_fts (rowid, prime_location_name, address, pin_code)
+            VALUES (new.id, new.prime_location_name, new.address, new.pin_code);
+        END
+    ''')
+    conn.execute("INSERT INTO parking_lots_fts (parking_lots_fts) VALUES ('rebuild')")
+
+
+def m004_summary_rollups(conn):
+    # Precomputed summary tables, maintained by booking_engine (see rollups.py)
+    _add_columns(conn, 'bookings', [('released_at', 'DATETIME')])
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_stats (
+            parking_lot_id INTEGER PRIMARY KEY,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            occupied_hours REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_daily_stats (
+            parking_lot_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            occupied_hours REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (parking_lot_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_lot_stats (
+            user_id INTEGER NOT NULL,
+            parking_lot_id INTEGER NOT NULL,
+            bookings INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, parking_lot_id)
+        ) WITHOUT ROWID
+    ''')
+    rollups.backfill(conn)
+
+
+def m005_history_keyset_index(conn):
+    # Booking history is paged by (timestamp, id); id has to follow
+    # timestamp in the index for the keyset comparison to be a range seek.
+    conn.execute('DROP INDEX IF EXISTS idx_bookings_user_history')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_history
+        ON bookings (user_id, timestamp, id, parking_lot_id, active, vehicle_no)
+    ''')
+
+
+def m006_lot_versions(conn):
+    # Per-lot change counter for API ETags. The trigger skips updates that
+    # already set the version, and recursive triggers are off, so it fires
+    # once per change.
+    _add_columns(conn, 'parking_lots', [('version', 'INTEGER NOT NULL DEFAULT 0')])
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_version AFTER UPDATE ON parking_lots
+        WHEN new.version = old.version BEGIN
+            UPDATE parking_lots SET version = old.version + 1 WHERE id = new.id;
+        END
+    ''')
+
+
+def m007_bookings_by_start(conn):
+    # Bookings export pages through a date range by (timestamp, id)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bookings_timestamp ON bookings (timestamp, id)')
+
+
+def m008_lot_tariffs(conn):
+    # Optional per-lot pricing rules on top of parking_lots.price (see tariffs.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_tariffs (
+            parking_lot_id INTEGER PRIMARY KEY,
+            peak_rate REAL,
+            peak_start INTEGER NOT NULL DEFAULT 0,
+            peak_end INTEGER NOT NULL DEFAULT 0,
+            daily_cap REAL,
+            grace_minutes INTEGER NOT NULL DEFAULT 0,
+            unit_minutes INTEGER NOT NULL DEFAULT 60,
+            utc_offset_minutes INTEGER NOT NULL DEFAULT 330,
+            FOREIGN KEY (parking_lot_id) REFERENCES parking_lots(id)
+        )
+    ''')
+
+
+def m009_overstays(conn):
+    # Overstay detection (see overstay.py): active bookings by start time,
+    # a flag for the ones found, and a lease so one process runs the job.
+    _add_columns(conn, 'bookings', [('overstay_flagged_at', 'DATETIME')])
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_active_start
+        ON bookings (timestamp, id) WHERE active = 1
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+def m010_lot_changes(conn):
+    # Log of lot and spot changes that worker processes follow to keep
+    # their in-process caches in step (see changes.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_changes (
+            seq INTEGER PRIMARY KEY,
+            origin TEXT NOT NULL,
+            lot_id INTEGER NOT NULL,
+            spot_id INTEGER,
+            occupied INTEGER,
+            fields TEXT
+        )
+    ''')
+
+
+def m011_lot_locations(conn):
+    # Coordinates for nearest-lot search (see lot_search.nearest_lots). Lots
+    # that have them are indexed as points in an R*Tree; the triggers keep
+    # it in step with parking_lots.
+    _add_columns(conn, 'parking_lots', [('latitude', 'REAL'), ('longitude', 'REAL')])
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS parking_lots_geo USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_geo_insert AFTER INSERT ON parking_lots
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO parking_lots_geo VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_geo_delete AFTER DELETE ON parking_lots BEGIN
+            DELETE FROM parking_lots_geo WHERE id = old.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS parking_lots_geo_update
+        AFTER UPDATE OF latitude, longitude ON parking_lots BEGIN
+            DELETE FROM parking_lots_geo WHERE id = old.id;
+            INSERT INTO parking_lots_geo
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+    ''')
+
+
+def m012_active_bookings_by_vehicle(conn):
+    # Gate exits find the booking by lot and plate (see gate.py)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_active_vehicle
+        ON bookings (parking_lot_id, vehicle_no) WHERE active = 1
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'align schema with app.py', m001_align_schema),
+    (2, 'indexes for hot queries', m002_hot_query_indexes),
+    (3, 'full-text lot search', m003_lot_search_index),
+    (4, 'summary rollup tables', m004_summary_rollups),
+    (5, 'keyset index for booking history', m005_history_keyset_index),
+    (6, 'per-lot version counter', m006_lot_versions),
+    (7, 'bookings by start time', m007_bookings_by_start),
+    (8, 'per-lot tariffs', m008_lot_tariffs),
+    (9, 'overstay detection', m009_overstays),
+    (10, 'cross-process change log', m010_lot_changes),
+    (11, 'lot coordinates and spatial index', m011_lot_locations),
+    (12, 'active bookings by vehicle', m012_active_bookings_by_vehicle),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, archive_path=None):
+    # Bring the database up to LATEST_VERSION; returns the versions applied.
+    # The version is re-read under the write lock, so concurrent workers
+    # starting together apply each migration only once. The booking archive
+    # is attached first: migrations that rebuild from history read it too.
+    archive.attach(conn, archive_path)
+    applied = []
+    for number, description, apply in MIGRATIONS:
+        if schema_version(conn) >= number:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) < number:
+                apply(conn)
+                conn.execute('PRAGMA user_version = %d' % number)
+                applied.append(number)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
+
+# ---------------------- Query plan check ----------------------
+#
+# Every SQL string literal in the app modules is run through
+# EXPLAIN QUERY PLAN against a freshly migrated database. A
+# "SCAN <table>" step without an index is a failure, unless the query ends
+# with the SCAN_OK_MARKER comment because it really does list a whole
+# (small) table.
+
+SCAN_OK_MARKER = '-- full-scan-ok'
+ROOT = os.path.dirname(os.path.abspath(__file__))
+NOT_APP_MODULES = {'migrations.py', 'database_setup.py'}
+
+
+def app_modules():
+    return sorted(
+        path for path in glob.glob(os.path.join(ROOT, '*.py'))
+        if os.path.basename(path) not in NOT_APP_MODULES
+    )
+
+
+def _sql_text(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    # 'SELECT %s FROM bookings WHERE ... IN (%s)' % (...): the placeholders
+    # stand in for column lists or bound values, so plan it with `*` and
+    # `?`. (A select list of `?` alone would hide the ORDER BY columns and
+    # change the plan of a query over a UNION ALL view.)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod):
+        left = _sql_text(node.left)
+        if left is not None:
+            return re.sub(r'%[sd]', '?', re.sub(r'\bSELECT(\s+)%s', r'SELECT\1*', left))
+    return None
+
+
+def iter_queries(paths):
+    # Every SQL-looking string literal, whether it is passed straight to
+    # execute() or built up first (lot_search, cache).
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        format_templates = {
+            id(node.left) for node in ast.walk(tree)
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod)
+        }
+        for node in ast.walk(tree):
+            if id(node) in format_templates:
+                continue  # planned through the enclosing BinOp
+            sql = _sql_text(node)
+            if sql and re.match(r'\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b', sql, re.I):
+                yield path, node.lineno, sql
+
+
+def full_scans(conn, sql):
+    params = [None] * sql.count('?')
+    scans = []
+    for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+        detail = row[3]
+        if (
+            detail.startswith('SCAN ')
+            and ' USING ' not in detail
+            and 'VIRTUAL TABLE' not in detail
+            and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery'))
+        ):
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(paths=None):
+    # Returns (checked, failures); failures are (path, line, sql, scans).
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    checked = 0
+    failures = []
+    for path, lineno, sql in iter_queries(paths or app_modules()):
+        checked += 1
+        if SCAN_OK_MARKER in sql:
+            continue
+        scans = full_scans(conn, sql)
+        if scans:
+            failures.append((path, lineno, sql, scans))
+    conn.close()
+    return checked, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate the parking database schema.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('--check-plans', action='store_true',
+                        help='fail if any query in the app modules does a full table scan')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, '
+                        'else next to --db with an -archive suffix)')
+    args = parser.parse_args()
+
+    if args.check_plans:
+        checked, failures = check_query_plans()
+        for path, lineno, sql, scans in sorted(failures):
+            print('%s:%d: %s' % (os.path.relpath(path, ROOT), lineno, '; '.join(scans)))
+            print('    ' + ' '.join(sql.split()))
+        print('%d queries checked, %d with full table scans' % (checked, len(failures)))
+        raise SystemExit(1 if failures else 0)
+
+    conn = sqlite3.connect(args.db)
+    applied = migrate(conn, args.archive)
+    conn.close()
+    print('Schema at version %d (applied: %s)' % (LATEST_VERSION, ', '.join(map(str, applied)) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import bisect
+import threading
+
+# ---------------------- Occupancy queries ----------------------
+
+# SQLite's default limit on bound parameters is 999 on older builds.
+MAX_IN_PARAMS = 900
+
+ACTIVE_BOOKING_COLUMNS = 'id, parking_lot_id, spot_id, user_id, vehicle_no, timestamp, estimated_cost'
+
+
+def active_bookings_by_lot(conn, lot_ids=None):
+    # Active bookings for many lots in one pass, grouped by lot id.
+    # lot_ids=None means "every lot", which is a single read of the
+    # partial index on active bookings instead of one query per lot.
+    grouped = {}
+    if lot_ids is None:
+        rows = conn.execute(
+            'SELECT %s FROM bookings WHERE active = 1 ORDER BY parking_lot_id, spot_id' % ACTIVE_BOOKING_COLUMNS
+        )
+        for row in rows:
+            grouped.setdefault(row['parking_lot_id'], []).append(row)
+        return grouped
+
+    lot_ids = list(lot_ids)
+    for lot_id in lot_ids:
+        grouped[lot_id] = []
+    for start in range(0, len(lot_ids), MAX_IN_PARAMS):
+        chunk = lot_ids[start:start + MAX_IN_PARAMS]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(
+            'SELECT %s FROM bookings WHERE active = 1 AND parking_lot_id IN (%s) ORDER BY parking_lot_id, spot_id'
+            % (ACTIVE_BOOKING_COLUMNS, placeholders),
+            chunk,
+        )
+        for row in rows:
+            grouped[row['parking_lot_id']].append(row)
+    return grouped
+
+
+# ---------------------- Slot maps ----------------------
+
+# Spots shown per page in the per-lot slot view.
+SLOT_PAGE_SIZE = 100
+
+
+def occupied_slot(booking, price):
+    return {
+        'id': booking['id'],  # Booking ID
+        'slot_id': booking['spot_id'],  # Actual slot ID
+        'occupied': True,
+        'user_id': booking['user_id'],
+        'vehicle_no': booking['vehicle_no'],
+        'timestamp': booking['timestamp'],
+        'cost': booking['estimated_cost'] if booking['estimated_cost'] is not None else price,
+    }
+
+
+def free_ranges(capacity, occupied_spots):
+    # Free spots 1..capacity as inclusive (start, end) runs. There are at
+    # most len(occupied_spots) + 1 runs however large the lot is.
+    ranges = []
+    next_free = 1
+    for spot in sorted({s for s in occupied_spots if s is not None and 1 <= s <= capacity}):
+        if spot > next_free:
+            ranges.append((next_free, spot - 1))
+        next_free = spot + 1
+    if next_free <= capacity:
+        ranges.append((next_free, capacity))
+    return ranges
+
+
+def slot_summary(capacity, bookings, price):
+    # Compact per-lot occupancy: one dict per active booking plus the free
+    # spots as ranges, instead of one dict per spot.
+    ranges = free_ranges(capacity, [b['spot_id'] for b in bookings])
+    return {
+        'occupied_slots': [occupied_slot(b, price) for b in bookings],
+        'free_ranges': ranges,
+        'free_count': sum(end - start + 1 for start, end in ranges),
+    }
+
+
+def slot_page(capacity, bookings, price, page, per_page=SLOT_PAGE_SIZE):
+    # Slots for one page of the per-lot view; `bookings` only needs to hold
+    # the active bookings whose spot falls on this page.
+    first = (page - 1) * per_page + 1
+    last = min(capacity, page * per_page)
+    by_spot = {b['spot_id']: b for b in bookings}
+    slots = []
+    for spot in range(first, last + 1):
+        booking = by_spot.get(spot)
+        if booking is not None:
+            slots.append(occupied_slot(booking, price))
+        else:
+            slots.append({'id': None, 'slot_id': spot, 'occupied': False})
+    return slots
+
+
+def page_count(capacity, per_page=SLOT_PAGE_SIZE):
+    return max(1, -(-capacity // per_page))
+
+
+# ---------------------- Free spot allocator ----------------------
+
+# Spots offered per lot in search results.
+SPOT_SAMPLE_SIZE = 20
+
+
+class SpotAllocator:
+    # Free spots of one lot kept as sorted, disjoint (start, end) runs in two
+    # parallel lists. Lookups are a bisect, and memory follows the number of
+    # runs rather than the lot's capacity.
+
+    def __init__(self, capacity, occupied_spots):
+        self.capacity = capacity
+        ranges = free_ranges(capacity, occupied_spots)
+        self._starts = [start for start, _ in ranges]
+        self._ends = [end for _, end in ranges]
+        self.free_count = sum(end - start + 1 for start, end in ranges)
+
+    def next_free(self):
+        return self._starts[0] if self._starts else None
+
+    def first_free(self, n):
+        spots = []
+        for start, end in zip(self._starts, self._ends):
+            spots.extend(range(start, min(end, start + n - len(spots) - 1) + 1))
+            if len(spots) >= n:
+                break
+        return spots
+
+    def is_free(self, spot):
+        i = bisect.bisect_right(self._starts, spot) - 1
+        return i >= 0 and spot <= self._ends[i]
+
+    def occupy(self, spot):
+        i = bisect.bisect_right(self._starts, spot) - 1
+        if i < 0 or spot > self._ends[i]:
+            return False
+        start, end = self._starts[i], self._ends[i]
+        if start == end:
+            del self._starts[i]
+            del self._ends[i]
+        elif spot == start:
+            self._starts[i] = spot + 1
+        elif spot == end:
+            self._ends[i] = spot - 1
+        else:
+            self._ends[i] = spot - 1
+            self._starts.insert(i + 1, spot + 1)
+            self._ends.insert(i + 1, end)
+        self.free_count -= 1
+        return True
+
+    def release(self, spot):
+        if spot is None or not 1 <= spot <= self.capacity or self.is_free(spot):
+            return False
+        i = bisect.bisect_left(self._starts, spot)
+        joins_left = i > 0 and self._ends[i - 1] == spot - 1
+        joins_right = i < len(self._starts) and self._starts[i] == spot + 1
+        if joins_left and joins_right:
+            self._ends[i - 1] = self._ends[i]
+            del self._starts[i]
+            del self._ends[i]
+        elif joins_left:
+            self._ends[i - 1] = spot
+        elif joins_right:
+            self._starts[i] = spot
+        else:
+            self._starts.insert(i, spot)
+            self._ends.insert(i, spot)
+        self.free_count += 1
+        return True
+
+
+class AllocatorRegistry:
+    # Per-process allocators keyed by lot id, loaded lazily from the active
+    # bookings. Routes that book or release a spot update the allocator;
+    # routes that change a lot's shape discard it so it is reloaded.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lots = {}
+
+    def load(self, conn, lots):
+        # `lots` are parking_lots rows; a cached allocator whose capacity no
+        # longer matches the row is treated as stale.
+        with self._lock:
+            missing = [
+                lot for lot in lots
+                if lot['id'] not in self._lots
+                or self._lots[lot['id']].capacity != (lot['maximum_number_of_spots'] or 0)
+            ]
+        if missing:
+            grouped = active_bookings_by_lot(conn, [lot['id'] for lot in missing])
+            fresh = {
+                lot['id']: SpotAllocator(
+                    lot['maximum_number_of_spots'] or 0,
+                    [b['spot_id'] for b in grouped[lot['id']]],
+                )
+                for lot in missing
+            }
+            with self._lock:
+                self._lots.update(fresh)
+        with self._lock:
+            return {lot['id']: self._lots[lot['id']] for lot in lots}
+
+    def occupy(self, lot_id, spot):
+        with self._lock:
+            allocator = self._lots.get(lot_id)
+            if allocator is not None:
+                allocator.occupy(spot)
+
+    def release(self, lot_id, spot):
+        with self._lock:
+            allocator = self._lots.get(lot_id)
+            if allocator is not None:
+                allocator.release(spot)
+
+    def sample(self, lot_id, n=SPOT_SAMPLE_SIZE):
+        with self._lock:
+            allocator = self._lots[lot_id]
+            return allocator.free_count, allocator.first_free(n)
+
+    def discard(self, lot_id):
+        with self._lock:
+            self._lots.pop(lot_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._lots.clear()
+
+
+allocators = AllocatorRegistry()
@@ -0,0 +1,220 @@
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+import booking_engine
+import changes
+import db
+import tariffs
+
+# ---------------------- Overstay detection ----------------------
+#
+# A background thread looks for active bookings that started more than
+# OVERSTAY_HOURS ago, reading them off the partial index on active bookings
+# by start time. Depending on OVERSTAY_ACTION it flags them
+# (bookings.overstay_flagged_at) or closes them at the current tariff.
+# Work is done in small batches, each its own short transaction, with a
+# pause in between so request traffic gets the write lock.
+#
+# The cutoff only moves forward, so each run resumes from the last
+# (timestamp, id) it saw and only reads bookings that became overstays
+# since. With several app processes, a lease row in job_leases makes sure
+# only one of them runs the job at a time.
+
+DEFAULTS = {
+    'OVERSTAY_SCHEDULER': True,
+    'OVERSTAY_HOURS': 24,
+    'OVERSTAY_ACTION': 'flag',  # or 'close'
+    'OVERSTAY_INTERVAL': 60,  # seconds between runs
+    'OVERSTAY_BATCH_SIZE': 200,
+}
+BATCH_PAUSE = 0.05  # seconds between batches of one run
+LEASE_NAME = 'overstay'
+
+
+def cutoff(hours):
+    return (tariffs.utcnow() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def find_overstays(conn, before, after=('', 0), limit=200):
+    # Active bookings that started before `before`, oldest first, after the
+    # (timestamp, id) keyset position `after`
+    return conn.execute('''
+        SELECT id, parking_lot_id, spot_id, user_id, vehicle_no, timestamp, overstay_flagged_at
+        FROM bookings
+        WHERE active = 1 AND timestamp < ? AND (timestamp, id) > (?, ?)
+        ORDER BY timestamp, id
+        LIMIT ?
+    ''', (before, after[0], after[1], limit)).fetchall()
+
+
+def flag_bookings(conn, booking_ids):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        flagged = conn.execute(
+            "UPDATE bookings SET overstay_flagged_at = datetime('now') "
+            "WHERE id IN (%s) AND active = 1 AND overstay_flagged_at IS NULL" % ', '.join('?' * len(booking_ids)),
+            booking_ids,
+        ).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return flagged
+
+
+def acquire_lease(conn, owner, ttl):
+    # True if `owner` holds the lease for the next `ttl` seconds
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+            INSERT INTO job_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE job_leases.owner = excluded.owner OR job_leases.expires_at < ?
+        ''', (LEASE_NAME, owner, now + ttl, now))
+        holder = conn.execute('SELECT owner FROM job_leases WHERE name = ?', (LEASE_NAME,)).fetchone()[0]
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return holder == owner
+
+
+class OverstayMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # another process held the lease
+        self.found = 0
+        self.flagged = 0
+        self.closed = 0
+        self.seconds_total = 0.0
+        self.last_run = {}
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record(self, run):
+        with self._lock:
+            self.runs += 1
+            self.found += run['found']
+            self.flagged += run['flagged']
+            self.closed += run['closed']
+            self.seconds_total += run['seconds']
+            self.last_run = run
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'failures': self.failures,
+                'skipped': self.skipped,
+                'found': self.found,
+                'flagged': self.flagged,
+                'closed': self.closed,
+                'seconds_total': round(self.seconds_total, 6),
+                'last_run': dict(self.last_run),
+            }
+
+
+metrics = OverstayMetrics()
+
+
+def run_once(conn, hours, action, batch_size, after=('', 0)):
+    # One pass from `after`; returns the run's counters and where it stopped
+    started = time.perf_counter()
+    run = {'started_at': time.time(), 'found': 0, 'flagged': 0, 'closed': 0, 'batches': 0}
+    before = cutoff(hours)
+    while True:
+        rows = find_overstays(conn, before, after, batch_size)
+        if not rows:
+            break
+        run['found'] += len(rows)
+        run['batches'] += 1
+        after = (rows[-1]['timestamp'], rows[-1]['id'])
+        if action == 'close':
+            for booking_id, lot_id, spot_id, cost in booking_engine.expire_bookings(conn, [r['id'] for r in rows]):
+                changes.apply_spot(lot_id, spot_id, False)
+                run['closed'] += 1
+        else:
+            pending = [r['id'] for r in rows if r['overstay_flagged_at'] is None]
+            if pending:
+                run['flagged'] += flag_bookings(conn, pending)
+        if len(rows) < batch_size:
+            break
+        time.sleep(BATCH_PAUSE)
+    run['seconds'] = time.perf_counter() - started
+    return run, after
+
+
+class OverstayScheduler(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='overstay-scheduler', daemon=True)
+        self.app = app
+        self.pid = os.getpid()
+        self.owner = '%s:%d' % (socket.gethostname(), self.pid)
+        self.stopping = threading.Event()
+        self.after = ('', 0)
+
+    def run(self):
+        config = self.app.config
+        conn = db.connect(config['DATABASE'], archive_path=config['ARCHIVE_DATABASE'])
+        try:
+            while not self.stopping.is_set():
+                self.tick(conn, config)
+                self.stopping.wait(config['OVERSTAY_INTERVAL'])
+        finally:
+            conn.close()
+
+    def tick(self, conn, config):
+        try:
+            if not acquire_lease(conn, self.owner, config['OVERSTAY_INTERVAL'] * 3):
+                # Start from the beginning if this process takes over later
+                self.after = ('', 0)
+                metrics.count('skipped')
+                return
+            run, self.after = run_once(
+                conn, config['OVERSTAY_HOURS'], config['OVERSTAY_ACTION'],
+                config['OVERSTAY_BATCH_SIZE'], self.after,
+            )
+            metrics.record(run)
+        except Exception:
+            metrics.count('failures')
+            self.app.logger.exception('overstay run failed')
+
+    def stop(self):
+        self.stopping.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start(app):
+    # One scheduler thread per process; a forked child starts its own
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler.pid != os.getpid():
+            _scheduler = OverstayScheduler(app)
+            _scheduler.start()
+    return _scheduler
+
+
+def list_overstays(conn, hours, limit=50):
+    return find_overstays(conn, cutoff(hours), limit=limit)
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.before_request
+    def _start_scheduler():
+        if app.config['OVERSTAY_SCHEDULER'] and not app.testing:
+            if _scheduler is None or _scheduler.pid != os.getpid():
+                start(app)
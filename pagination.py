@@ -0,0 +1,122 @@
+import base64
+import json
+
+# ---------------------- Keyset pagination ----------------------
+#
+# Pages are addressed by the sort key of the row at their edge, not by an
+# OFFSET, so fetching page 500 costs the same index seek as page 1. A
+# cursor is the sort key as url-safe base64 JSON. Each page query fetches
+# one extra row to learn whether there is a further page.
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    # The key tuple, or None for anything that isn't a list holding one
+    # value of each of `types` (a tuple of type tuples), so a bad or
+    # crafted cursor falls back to the first page.
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    for value, allowed in zip(key, types):
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            return None
+    return tuple(key)
+
+
+# Cursor shapes: (timestamp, id) for booking history, (id,) for users
+HISTORY_CURSOR = ((str, int), (str, int))
+USERS_CURSOR = ((int,),)
+
+
+def page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+class Page:
+    def __init__(self, rows, next_cursor, prev_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def _page(rows, size, key, going_back, has_cursor):
+    # `rows` were fetched with LIMIT size + 1 in the direction of travel
+    more = len(rows) > size
+    rows = rows[:size]
+    if going_back:
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+    has_older = more if not going_back else True
+    has_newer = has_cursor if not going_back else more
+    return Page(
+        rows,
+        encode_cursor(key(rows[-1])) if has_older else None,
+        encode_cursor(key(rows[0])) if has_newer else None,
+    )
+
+
+def booking_history(conn, user_id, after=None, before=None, size=DEFAULT_PAGE_SIZE):
+    # A user's bookings, archived ones included, newest first. `after` pages
+    # to older bookings, `before` back to newer ones; both are cursors from
+    # a previous Page.
+    after, before = decode_cursor(after, HISTORY_CURSOR), decode_cursor(before, HISTORY_CURSOR)
+    columns = '''
+        SELECT b.id, p.prime_location_name AS location, b.vehicle_no, b.timestamp, b.active, p.price
+        FROM all_bookings b
+        JOIN parking_lots p ON b.parking_lot_id = p.id
+    '''
+    if before:
+        rows = conn.execute(columns + '''
+            WHERE b.user_id = ? AND (b.timestamp, b.id) > (?, ?)
+            ORDER BY b.timestamp ASC, b.id ASC
+            LIMIT ?
+        ''', (user_id, before[0], before[1], size + 1)).fetchall()
+    elif after:
+        rows = conn.execute(columns + '''
+            WHERE b.user_id = ? AND (b.timestamp, b.id) < (?, ?)
+            ORDER BY b.timestamp DESC, b.id DESC
+            LIMIT ?
+        ''', (user_id, after[0], after[1], size + 1)).fetchall()
+    else:
+        rows = conn.execute(columns + '''
+            WHERE b.user_id = ?
+            ORDER BY b.timestamp DESC, b.id DESC
+            LIMIT ?
+        ''', (user_id, size + 1)).fetchall()
+    rows = [dict(row) for row in rows]
+    return _page(rows, size, lambda row: (row['timestamp'], row['id']), bool(before), bool(after or before))
+
+
+def users(conn, after=None, before=None, size=DEFAULT_PAGE_SIZE):
+    # Registered users in id order, with the same cursor scheme.
+    after, before = decode_cursor(after, USERS_CURSOR), decode_cursor(before, USERS_CURSOR)
+    if before:
+        rows = conn.execute(
+            'SELECT * FROM users WHERE id < ? ORDER BY id DESC LIMIT ?', (before[0], size + 1)
+        ).fetchall()
+    elif after:
+        rows = conn.execute(
+            'SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?', (after[0], size + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT * FROM users ORDER BY id LIMIT ?  -- full-scan-ok: rowid order, stops at LIMIT', (size + 1,)
+        ).fetchall()
+    return _page(list(rows), size, lambda row: (row['id'],), bool(before), bool(after or before))
@@ -0,0 +1,203 @@
+import argparse
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+import db
+import migrations
+
+# ---------------------- Password hashing ----------------------
+#
+# Passwords are stored as "scrypt$n$r$p$salt$key", so every row keeps the
+# work factor it was hashed with and PASSWORD_SCRYPT can be raised (or
+# lowered) without invalidating existing logins. Rows still holding a
+# plaintext password from before hashing, and rows hashed with other
+# parameters, are rehashed with the current ones on their next successful
+# login.
+#
+# Verification is deliberately slow, so it runs on a small thread pool:
+# at most PASSWORD_WORKERS hashes are computed at once (hashlib releases
+# the GIL while it works) and at most PASSWORD_MAX_PENDING logins wait for
+# a worker. A login beyond that is turned away with Busy straight away
+# rather than holding one more request thread, so booking requests keep
+# their CPU and their threads during a login storm.
+
+SCHEME = 'scrypt'
+DEFAULTS = {
+    'PASSWORD_SCRYPT': (2 ** 14, 8, 1),  # n, r, p for new hashes
+    'PASSWORD_WORKERS': 2,
+    'PASSWORD_MAX_PENDING': 32,
+}
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class Busy(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _kdf(password, salt, n, r, p):
+    # scrypt needs 128 * n * r * p bytes; leave headroom over that
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r * p + 1024 * 1024, dklen=KEY_BYTES,
+    )
+
+
+def hash_password(password, params=DEFAULTS['PASSWORD_SCRYPT']):
+    n, r, p = params
+    salt = os.urandom(SALT_BYTES)
+    return '%s$%d$%d$%d$%s$%s' % (SCHEME, n, r, p, _b64(salt), _b64(_kdf(password, salt, n, r, p)))
+
+
+def parse(stored):
+    # (n, r, p, salt, key), or None for a legacy plaintext value
+    parts = (stored or '').split('$')
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        return int(parts[1]), int(parts[2]), int(parts[3]), base64.b64decode(parts[4]), base64.b64decode(parts[5])
+    except ValueError:
+        return None
+
+
+def verify_password(password, stored):
+    parsed = parse(stored)
+    if parsed is None:
+        return stored is not None and hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    n, r, p, salt, key = parsed
+    return hmac.compare_digest(_kdf(password, salt, n, r, p), key)
+
+
+def needs_rehash(stored, params):
+    parsed = parse(stored)
+    return parsed is None or parsed[:3] != tuple(params)
+
+
+@functools.lru_cache(maxsize=8)
+def _dummy_hash(params):
+    # Checked when no account matches, so an unknown name costs as much as
+    # a wrong password and the response time doesn't reveal which it was
+    return hash_password('', params)
+
+
+# ---------------------- Verifier pool ----------------------
+
+class VerifierPool:
+    # One per process: the executor's threads do not survive a fork.
+
+    def __init__(self, workers, max_pending):
+        self.pid = os.getpid()
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Busy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_pool_lock = threading.Lock()
+
+
+def _get_pool(app):
+    with _pool_lock:
+        pool = app.extensions.get('password_pool')
+        if pool is None or pool.pid != os.getpid():
+            pool = VerifierPool(app.config['PASSWORD_WORKERS'], app.config['PASSWORD_MAX_PENDING'])
+            app.extensions['password_pool'] = pool
+        return pool
+
+
+def _params():
+    return tuple(current_app.config['PASSWORD_SCRYPT'])
+
+
+def make_hash(password):
+    # Hash with the app's current parameters, on the verifier pool
+    return _get_pool(current_app).run(hash_password, password, _params())
+
+
+def authenticate(conn, rows, password, rehash_sql):
+    # `rows` are the accounts matching the login name, each with `id` and
+    # `password`. Returns the matching row or None, and raises Busy when the
+    # pool is saturated. `rehash_sql` stores a fresh hash: (password, id).
+    pool = _get_pool(current_app)
+    params = _params()
+    if not rows:
+        pool.run(verify_password, password, _dummy_hash(params))
+        return None
+    for row in rows:
+        if not pool.run(verify_password, password, row['password']):
+            continue
+        if needs_rehash(row['password'], params):
+            try:
+                conn.execute(rehash_sql, (pool.run(hash_password, password, params), row['id']))
+                conn.commit()
+            except sqlite3.OperationalError:
+                # The login still counts; the row is rehashed next time
+                conn.rollback()
+        return row
+    return None
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+
+# ---------------------- CLI ----------------------
+
+def upgrade(conn, params=DEFAULTS['PASSWORD_SCRYPT']):
+    # Hash every stored plaintext password now rather than on next login
+    upgraded = 0
+    for select_sql, update_sql in (
+        ('SELECT id, password FROM users  -- full-scan-ok', 'UPDATE users SET password = ? WHERE id = ?'),
+        ('SELECT id, password FROM admin  -- full-scan-ok', 'UPDATE admin SET password = ? WHERE id = ?'),
+    ):
+        plain = [(row[0], row[1]) for row in conn.execute(select_sql) if parse(row[1]) is None]
+        for row_id, password in plain:
+            conn.execute(update_sql, (hash_password(password, params), row_id))
+        conn.commit()
+        upgraded += len(plain)
+    return upgraded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hash the plaintext passwords still stored in the database.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('--log-n', type=int, default=DEFAULTS['PASSWORD_SCRYPT'][0].bit_length() - 1,
+                        help='scrypt work factor as log2(n)')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, '
+                        'else next to --db with an -archive suffix)')
+    args = parser.parse_args()
+
+    conn = db.connect(args.db, archive_path=args.archive)
+    migrations.migrate(conn)
+    params = (2 ** args.log_n,) + DEFAULTS['PASSWORD_SCRYPT'][1:]
+    print('%d passwords hashed' % upgrade(conn, params))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
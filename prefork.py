@@ -0,0 +1,152 @@
+import argparse
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import cache
+import changes
+import db
+import lot_search
+import occupancy
+from app import app
+
+# ---------------------- Prefork launcher ----------------------
+#
+#   PARKING_SECRET_KEY=... PARKING_DATABASE=/srv/parking/users.db \
+#   python prefork.py [--workers 16] [--bind 0.0.0.0:8000] [--server wsgi|asgi]
+#
+# Runs N worker processes on one listening socket, so the app is not held
+# to one core by the GIL. The master imports the app and runs the
+# preflight: migrations, every template compiled, the lot cache and spot
+# allocators loaded. Then it closes its database connections and forks.
+# Workers inherit that warm state, open their own connection pool and
+# serve with werkzeug's threaded server (or uvicorn, with --server asgi).
+# A worker that exits is replaced; SIGTERM or SIGINT stops them all.
+#
+# Workers share the SQLite file (WAL, writers take BEGIN IMMEDIATE) and
+# the secret key, so a session cookie is valid on any of them. Their
+# in-process caches are kept in step through changes.py, and the overstay
+# job holds a lease so only one worker runs it. /admin/metrics counters
+# are per worker.
+
+RESPAWN_DELAY = 1.0  # seconds, so a worker that can't start doesn't spin
+STOP_TIMEOUT = 10.0
+
+
+def preflight(app):
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        conn = db.get_db()  # opens the pool and applies migrations
+        lots = lot_search.search_lots(conn, '')
+        cache.get_lots(conn, [lot['id'] for lot in lots[:cache.lot_cache.maxsize]])
+        occupancy.allocators.load(conn, lots)
+        changes.reset(conn)
+    db.close_pool(app)
+    print('preflight: %d templates, %d lots in %.2fs' % (
+        len(app.jinja_env.list_templates()), len(lots), time.perf_counter() - started), flush=True)
+
+
+def serve(sock, server):
+    # In a worker: take over the inherited socket until stopped
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()
+    db.warm(app)
+    if server == 'asgi':
+        import uvicorn
+        import asgi
+        config = uvicorn.Config(asgi.application, fd=sock.fileno(), log_level='warning', timeout_graceful_shutdown=5)
+        uvicorn.Server(config).run()
+    else:
+        from werkzeug.serving import make_server
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def spawn(sock, server):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            serve(sock, server)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def listen(bind, backlog):
+    host, _, port = bind.rpartition(':')
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host.strip('[]') or '0.0.0.0', int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the app in several worker processes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--bind', default=os.environ.get('PARKING_BIND', '127.0.0.1:8000'))
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--backlog', type=int, default=2048)
+    args = parser.parse_args()
+
+    if not os.environ.get('PARKING_SECRET_KEY'):
+        sys.exit('Set PARKING_SECRET_KEY: every worker must sign sessions with the same secret.')
+    if not os.path.exists(app.config['DATABASE']):
+        sys.exit('%s does not exist; run database_setup.py first.' % app.config['DATABASE'])
+
+    preflight(app)
+    sock = listen(args.bind, args.backlog)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    workers = {spawn(sock, args.server) for _ in range(args.workers)}
+    print('serving %s on %s with %d workers' % (app.config['DATABASE'], args.bind, args.workers), flush=True)
+    while not stopping:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+        if pid in workers:
+            workers.discard(pid)
+            print('worker %d exited (status %d), restarting' % (pid, status), file=sys.stderr, flush=True)
+            time.sleep(RESPAWN_DELAY)
+            if not stopping:
+                workers.add(spawn(sock, args.server))
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+        workers.discard(pid)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
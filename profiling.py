@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import deque
+
+from flask import g, request, template_rendered, before_render_template
+
+# ---------------------- Request profiling ----------------------
+#
+# Opt-in (PROFILING = True). The pooled connection handed out by
+# db.get_db() is wrapped in a proxy that times every execute and fetch, so
+# each request records its SQL statement count, time spent in SQLite and
+# time spent rendering templates. Statements slower than
+# PROFILING_SLOW_QUERY_MS are logged with their parameters redacted to
+# their types. The last PROFILING_WINDOW requests per endpoint are kept
+# for the percentiles served at /admin/metrics.
+
+DEFAULTS = {
+    'PROFILING': False,
+    'PROFILING_SLOW_QUERY_MS': 100,
+    'PROFILING_WINDOW': 1000,
+}
+
+
+def redact(params):
+    # Types only: never log booking, user or password values
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class TracedCursor:
+    def __init__(self, cursor, trace):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_trace', trace)
+
+    def _timed(self, sql, params, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._trace.statement(sql, params, time.perf_counter() - started)
+
+    def execute(self, sql, params=()):
+        self._timed(sql, params, self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._timed(sql, None, self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def executescript(self, script):
+        self._timed(script, None, self._cursor.executescript, script)
+        return self
+
+    def _fetch(self, call, *args):
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._trace.fetch(time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._fetch(next, self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    # Stands in for the sqlite3 connection for one request; `wrapped` is the
+    # pooled connection db.py hands back on teardown
+    def __init__(self, conn, trace):
+        self.wrapped = conn
+        self._trace = trace
+
+    def cursor(self):
+        return TracedCursor(self.wrapped.cursor(), self._trace)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self.wrapped.commit()
+        finally:
+            self._trace.fetch(time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+class RequestTrace:
+    def __init__(self, logger, slow_seconds):
+        self.logger = logger
+        self.slow_seconds = slow_seconds
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.slow = 0
+
+    def statement(self, sql, params, seconds):
+        self.statements += 1
+        self.db_seconds += seconds
+        if seconds >= self.slow_seconds:
+            self.slow += 1
+            self.logger.warning(
+                'slow query %.1fms on %s: %s params=%s',
+                seconds * 1000, request.endpoint, ' '.join(sql.split()), redact(params),
+            )
+
+    def fetch(self, seconds):
+        self.db_seconds += seconds
+
+
+def quantile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RequestStats:
+    # Per-endpoint sliding windows of (duration, db, statements, render)
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+        self.slow_queries = 0
+
+    def record(self, endpoint, trace):
+        sample = (time.perf_counter() - trace.started, trace.db_seconds, trace.statements, trace.render_seconds)
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(sample)
+            totals = self._totals.setdefault(endpoint, [0, 0.0, 0.0, 0, 0.0])
+            totals[0] += 1
+            for i, value in enumerate(sample):
+                totals[i + 1] += value
+            self.slow_queries += trace.slow
+
+    def snapshot(self):
+        with self._lock:
+            return (
+                {endpoint: list(samples) for endpoint, samples in self._samples.items()},
+                {endpoint: list(totals) for endpoint, totals in self._totals.items()},
+                self.slow_queries,
+            )
+
+
+SUMMARIES = (
+    ('parking_request_duration_seconds', 'Request wall time'),
+    ('parking_request_db_seconds', 'Time spent in SQLite per request'),
+    ('parking_request_sql_statements', 'SQL statements per request'),
+    ('parking_request_render_seconds', 'Template render time per request'),
+)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def prometheus_lines(stats):
+    # Summaries over each endpoint's window; _sum and _count are lifetime
+    samples, totals, slow = stats.snapshot()
+    lines = []
+    for i, (name, help_text) in enumerate(SUMMARIES):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s summary' % name)
+        for endpoint in sorted(samples):
+            ordered = sorted(sample[i] for sample in samples[endpoint])
+            for q in QUANTILES:
+                lines.append('%s{endpoint="%s",quantile="%s"} %s' % (name, endpoint, q, quantile(ordered, q)))
+            lines.append('%s_sum{endpoint="%s"} %s' % (name, endpoint, totals[endpoint][i + 1]))
+            lines.append('%s_count{endpoint="%s"} %d' % (name, endpoint, totals[endpoint][0]))
+    lines.append('# HELP parking_slow_queries_total Statements over the slow query threshold')
+    lines.append('# TYPE parking_slow_queries_total counter')
+    lines.append('parking_slow_queries_total %d' % slow)
+    return lines
+
+
+def metric(name, help_text, value, kind='counter'):
+    return ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind), '%s %s' % (name, value)]
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    stats = RequestStats(app.config['PROFILING_WINDOW'])
+    app.extensions['request_stats'] = stats
+
+    def trace_connection(conn):
+        trace = g.get('trace')
+        return conn if trace is None else TracedConnection(conn, trace)
+
+    app.extensions['db_tracer'] = trace_connection
+
+    @app.before_request
+    def _start_trace():
+        if app.config['PROFILING']:
+            g.trace = RequestTrace(app.logger, app.config['PROFILING_SLOW_QUERY_MS'] / 1000)
+
+    @app.teardown_request
+    def _finish_trace(exc):
+        trace = g.pop('trace', None)
+        if trace is not None:
+            stats.record(request.endpoint or 'unmatched', trace)
+
+    def _render_started(sender, template, context, **extra):
+        trace = g.get('trace')
+        if trace is not None:
+            trace.render_started = time.perf_counter()
+
+    def _render_finished(sender, template, context, **extra):
+        trace = g.get('trace')
+        if trace is not None and trace.render_started is not None:
+            trace.render_seconds += time.perf_counter() - trace.render_started
+            trace.render_started = None
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
@@ -0,0 +1,158 @@
+import argparse
+import sqlite3
+
+import archive
+
+# ---------------------- Revenue and occupancy rollups ----------------------
+#
+# Precomputed totals for the summary pages, so they never aggregate the
+# bookings table on a page view:
+#   lot_stats        lifetime revenue, bookings and occupied hours per lot
+#   lot_daily_stats  the same per lot and day
+#   user_lot_stats   bookings and spend per user and lot
+# booking_engine updates them in the same transaction as the booking or
+# release. Bookings count on the day they start; revenue and hours count on
+# the day the spot is released. backfill() rebuilds everything from bookings.
+
+
+def record_booking(conn, lot_id, user_id, day):
+    conn.execute('''
+        INSERT INTO lot_stats (parking_lot_id, bookings) VALUES (?, 1)
+        ON CONFLICT (parking_lot_id) DO UPDATE SET bookings = bookings + 1
+    ''', (lot_id,))
+    conn.execute('''
+        INSERT INTO lot_daily_stats (parking_lot_id, day, bookings) VALUES (?, ?, 1)
+        ON CONFLICT (parking_lot_id, day) DO UPDATE SET bookings = bookings + 1
+    ''', (lot_id, day))
+    conn.execute('''
+        INSERT INTO user_lot_stats (user_id, parking_lot_id, bookings) VALUES (?, ?, 1)
+        ON CONFLICT (user_id, parking_lot_id) DO UPDATE SET bookings = bookings + 1
+    ''', (user_id, lot_id))
+
+
+def record_release(conn, lot_id, user_id, day, cost, hours):
+    conn.execute('''
+        INSERT INTO lot_stats (parking_lot_id, revenue, occupied_hours) VALUES (?, ?, ?)
+        ON CONFLICT (parking_lot_id) DO UPDATE
+        SET revenue = revenue + excluded.revenue, occupied_hours = occupied_hours + excluded.occupied_hours
+    ''', (lot_id, cost, hours))
+    conn.execute('''
+        INSERT INTO lot_daily_stats (parking_lot_id, day, revenue, occupied_hours) VALUES (?, ?, ?, ?)
+        ON CONFLICT (parking_lot_id, day) DO UPDATE
+        SET revenue = revenue + excluded.revenue, occupied_hours = occupied_hours + excluded.occupied_hours
+    ''', (lot_id, day, cost, hours))
+    conn.execute('''
+        INSERT INTO user_lot_stats (user_id, parking_lot_id, revenue) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, parking_lot_id) DO UPDATE SET revenue = revenue + excluded.revenue
+    ''', (user_id, lot_id, cost))
+
+
+def record_history(conn, bookings):
+    # Batched record_booking + record_release for imported closed bookings,
+    # given as (lot_id, user_id, timestamp, released_at, cost, hours) with
+    # 'YYYY-MM-DD HH:MM:SS' timestamps. Totals are summed in Python first,
+    # so each rollup row is upserted once per batch.
+    lots = {}
+    days = {}
+    users = {}
+    for lot_id, user_id, started, released_at, cost, hours in bookings:
+        lot = lots.setdefault(lot_id, [0, 0.0, 0.0])
+        lot[0] += 1
+        lot[1] += cost
+        lot[2] += hours
+        days.setdefault((lot_id, started[:10]), [0, 0.0, 0.0])[0] += 1
+        release_day = days.setdefault((lot_id, (released_at or started)[:10]), [0, 0.0, 0.0])
+        release_day[1] += cost
+        release_day[2] += hours
+        user = users.setdefault((user_id, lot_id), [0, 0.0])
+        user[0] += 1
+        user[1] += cost
+    conn.executemany('''
+        INSERT INTO lot_stats (parking_lot_id, bookings, revenue, occupied_hours) VALUES (?, ?, ?, ?)
+        ON CONFLICT (parking_lot_id) DO UPDATE
+        SET bookings = bookings + excluded.bookings, revenue = revenue + excluded.revenue,
+            occupied_hours = occupied_hours + excluded.occupied_hours
+    ''', [(lot_id,) + tuple(totals) for lot_id, totals in lots.items()])
+    conn.executemany('''
+        INSERT INTO lot_daily_stats (parking_lot_id, day, bookings, revenue, occupied_hours) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (parking_lot_id, day) DO UPDATE
+        SET bookings = bookings + excluded.bookings, revenue = revenue + excluded.revenue,
+            occupied_hours = occupied_hours + excluded.occupied_hours
+    ''', [key + tuple(totals) for key, totals in days.items()])
+    conn.executemany('''
+        INSERT INTO user_lot_stats (user_id, parking_lot_id, bookings, revenue) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, parking_lot_id) DO UPDATE
+        SET bookings = bookings + excluded.bookings, revenue = revenue + excluded.revenue
+    ''', [key + tuple(totals) for key, totals in users.items()])
+
+
+def backfill(conn):
+    # Recompute every rollup from bookings, archived ones included. Runs
+    # inside the caller's transaction. For bookings closed before
+    # released_at existed, the occupied hours are estimated from the billed
+    # cost and the lot price.
+    conn.execute('DELETE FROM lot_stats')
+    conn.execute('DELETE FROM lot_daily_stats')
+    conn.execute('DELETE FROM user_lot_stats')
+    conn.execute('''
+        INSERT INTO lot_daily_stats (parking_lot_id, day, bookings, revenue, occupied_hours)
+        SELECT parking_lot_id, day, SUM(bookings), SUM(revenue), SUM(occupied_hours)
+        FROM (
+            SELECT b.parking_lot_id, date(b.timestamp) AS day, 1 AS bookings, 0 AS revenue, 0 AS occupied_hours
+            FROM all_bookings b
+            UNION ALL
+            SELECT b.parking_lot_id, date(COALESCE(b.released_at, b.timestamp)), 0,
+                   IFNULL(b.estimated_cost, 0),
+                   CASE
+                       WHEN b.released_at IS NOT NULL THEN (julianday(b.released_at) - julianday(b.timestamp)) * 24
+                       WHEN p.price > 0 THEN IFNULL(b.estimated_cost, 0) / p.price
+                       ELSE 0
+                   END
+            FROM all_bookings b
+            LEFT JOIN parking_lots p ON p.id = b.parking_lot_id
+            WHERE b.active = 0
+        )
+        GROUP BY parking_lot_id, day
+        -- full-scan-ok: backfill reads all history once
+    ''')
+    conn.execute('''
+        INSERT INTO lot_stats (parking_lot_id, bookings, revenue, occupied_hours)
+        SELECT parking_lot_id, SUM(bookings), SUM(revenue), SUM(occupied_hours)
+        FROM lot_daily_stats
+        GROUP BY parking_lot_id
+        -- full-scan-ok: backfill reads all history once
+    ''')
+    conn.execute('''
+        INSERT INTO user_lot_stats (user_id, parking_lot_id, bookings, revenue)
+        SELECT user_id, parking_lot_id, COUNT(*), IFNULL(SUM(estimated_cost), 0)
+        FROM all_bookings
+        GROUP BY user_id, parking_lot_id
+        -- full-scan-ok: backfill reads all history once
+    ''')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the summary rollup tables from bookings.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, '
+                        'else next to --db with an -archive suffix)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    archive.attach(conn, args.archive)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        backfill(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    lots, days = conn.execute(
+        'SELECT COUNT(DISTINCT parking_lot_id), COUNT(*) FROM lot_daily_stats  -- full-scan-ok: CLI report'
+    ).fetchone()
+    conn.close()
+    print('Rollups rebuilt: %d lots, %d lot-days' % (lots, days))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import functools
+import math
+import sys
+from datetime import datetime, timezone
+
+import db
+
+# ---------------------- Tariffs ----------------------
+#
+# A stay is billed in whole units (an hour by default, at least one unit).
+# Each unit costs the hourly rate in force, in the lot's local time, at
+# the moment the unit starts. The lot price is the off-peak rate; a tariff
+# row can add one peak window with its own rate, a cap per 24 hours from
+# entry, and a grace period under which a stay is free. A lot without a
+# tariff row is billed like before: max(1, ceil(hours)) * price.
+#
+# A tariff is compiled once into a small table `cum`, (units per day + 1)
+# rows by (unit length in minutes) columns:
+#   cum[j][p] = cost of the first j unit starts at minutes p, p + U, ...
+# so the cost of every unit starting in [a, b) of a day, for a stay whose
+# units start at phase p, is two lookups. A stay's cost is then O(1)
+# however long it is, and the same table drives the numpy batch re-pricing.
+
+MINUTES_PER_DAY = 24 * 60
+# All lots are in India (IST, no daylight saving)
+DEFAULT_UTC_OFFSET = 330
+
+TARIFF_COLUMNS = 'peak_rate, peak_start, peak_end, daily_cap, grace_minutes, unit_minutes, utc_offset_minutes'
+
+
+class TariffError(ValueError):
+    pass
+
+
+class Tariff:
+    def __init__(self, price, peak_rate=None, peak_start=0, peak_end=0, daily_cap=None,
+                 grace_minutes=0, unit_minutes=60, utc_offset_minutes=DEFAULT_UTC_OFFSET):
+        if unit_minutes <= 0 or MINUTES_PER_DAY % unit_minutes:
+            raise TariffError('unit_minutes must divide a day evenly')
+        if not (0 <= peak_start < MINUTES_PER_DAY and 0 <= peak_end <= MINUTES_PER_DAY):
+            raise TariffError('peak window must be within a day')
+        self.price = price or 0
+        self.daily_cap = daily_cap
+        self.grace_seconds = grace_minutes * 60
+        self.unit = unit_minutes
+        self.units_per_day = MINUTES_PER_DAY // unit_minutes
+        self.offset = utc_offset_minutes
+
+        # Per-unit price for a unit starting at each minute of the local day;
+        # a window with start > end wraps past midnight.
+        rates = [self.price] * MINUTES_PER_DAY
+        if peak_rate is not None and peak_start != peak_end:
+            window = range(peak_start, peak_end) if peak_start < peak_end else \
+                list(range(peak_start, MINUTES_PER_DAY)) + list(range(0, peak_end))
+            for minute in window:
+                rates[minute] = peak_rate
+        per_unit = unit_minutes / 60
+        self.cum = [[0.0] * unit_minutes]
+        for j in range(self.units_per_day):
+            previous = self.cum[-1]
+            base = j * unit_minutes
+            self.cum.append([previous[p] + rates[base + p] * per_unit for p in range(unit_minutes)])
+
+    def _upto(self, phase, minute):
+        # Cost of the unit starts at `phase` (mod unit) that fall in [0, minute)
+        return self.cum[(minute - phase + self.unit - 1) // self.unit][phase]
+
+    def _span(self, start_minute, units):
+        # `units` consecutive units (fewer than a day's worth) from start_minute
+        phase = start_minute % self.unit
+        end = start_minute + units * self.unit
+        if end <= MINUTES_PER_DAY:
+            return self._upto(phase, end) - self._upto(phase, start_minute)
+        return (self._upto(phase, MINUTES_PER_DAY) - self._upto(phase, start_minute)
+                + self._upto(phase, end - MINUTES_PER_DAY))
+
+    def _capped(self, amount):
+        return amount if self.daily_cap is None else min(amount, self.daily_cap)
+
+    def cost(self, start, end):
+        # Price of a stay between two naive UTC datetimes
+        seconds = (end - start).total_seconds()
+        if self.grace_seconds and seconds <= self.grace_seconds:
+            return 0.0
+        units = max(1, math.ceil(seconds / (self.unit * 60)))
+        start_minute = int(start.replace(tzinfo=timezone.utc).timestamp() // 60 + self.offset) % MINUTES_PER_DAY
+        days, rest = divmod(units, self.units_per_day)
+        total = days * self._capped(self._span(start_minute, self.units_per_day)) if days else 0.0
+        if rest:
+            total += self._capped(self._span(start_minute, rest))
+        return round(total, 2)
+
+    def cost_many(self, start_seconds, end_seconds):
+        # Vectorised cost() over numpy arrays of UTC epoch seconds
+        import numpy as np
+
+        cum = np.asarray(self.cum)
+        unit = self.unit
+        seconds = end_seconds - start_seconds
+        units = np.maximum(1, -(-seconds // (unit * 60)))
+        start_minute = (start_seconds // 60 + self.offset) % MINUTES_PER_DAY
+        phase = start_minute % unit
+
+        def upto(minute):
+            return cum[(minute - phase + unit - 1) // unit, phase]
+
+        def span(count):
+            end = start_minute + count * unit
+            wrapped = end > MINUTES_PER_DAY
+            head = upto(np.minimum(end, MINUTES_PER_DAY)) - upto(start_minute)
+            return head + np.where(wrapped, upto(np.where(wrapped, end - MINUTES_PER_DAY, 0)), 0.0)
+
+        days, rest = np.divmod(units, self.units_per_day)
+        full, part = span(self.units_per_day), span(rest)
+        if self.daily_cap is not None:
+            full = np.minimum(full, self.daily_cap)
+            part = np.minimum(part, self.daily_cap)
+        total = days * full + part
+        if self.grace_seconds:
+            total = np.where(seconds <= self.grace_seconds, 0.0, total)
+        return np.round(total, 2)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compiled(price, *settings):
+    return Tariff(price, *settings)
+
+
+def for_lot(row):
+    # Compiled tariff for a parking_lots row LEFT JOINed with lot_tariffs.
+    # Compiled tables are shared between lots with the same settings.
+    if row['unit_minutes'] is None:
+        return _compiled(row['price'])
+    return _compiled(row['price'], *(row[name] for name in TARIFF_COLUMNS.split(', ')))
+
+
+def load(conn, lot_id):
+    row = conn.execute(
+        'SELECT p.price, %s FROM parking_lots p LEFT JOIN lot_tariffs t ON t.parking_lot_id = p.id WHERE p.id = ?'
+        % ', '.join('t.' + name for name in TARIFF_COLUMNS.split(', ')),
+        (lot_id,),
+    ).fetchone()
+    return None if row is None else for_lot(row)
+
+
+def save(conn, lot_id, peak_rate=None, peak_start=0, peak_end=0, daily_cap=None,
+         grace_minutes=0, unit_minutes=60, utc_offset_minutes=DEFAULT_UTC_OFFSET):
+    # Validates by compiling first; the caller commits
+    Tariff(0, peak_rate, peak_start, peak_end, daily_cap, grace_minutes, unit_minutes, utc_offset_minutes)
+    conn.execute('''
+        INSERT INTO lot_tariffs (
+            parking_lot_id, peak_rate, peak_start, peak_end, daily_cap, grace_minutes, unit_minutes, utc_offset_minutes
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (parking_lot_id) DO UPDATE SET
+            peak_rate = excluded.peak_rate, peak_start = excluded.peak_start, peak_end = excluded.peak_end,
+            daily_cap = excluded.daily_cap, grace_minutes = excluded.grace_minutes,
+            unit_minutes = excluded.unit_minutes, utc_offset_minutes = excluded.utc_offset_minutes
+    ''', (lot_id, peak_rate, peak_start, peak_end, daily_cap, grace_minutes, unit_minutes,
+                           utc_offset_minutes))
+
+
+def utcnow():
+    # Naive UTC, comparable with SQLite's datetime('now') values
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------------- Batch re-pricing ----------------------
+
+REPRICE_BATCH = 100000
+
+
+def reprice(conn, start, end, batch_size=REPRICE_BATCH):
+    # Re-price closed bookings that started in [start, end) with the current
+    # tariffs. Yields (booking ids, billed, repriced) numpy arrays per lot and
+    # batch. Bookings closed before released_at was recorded are skipped.
+    import numpy as np
+
+    tariffs = {}
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples; they go straight into arrays
+    after = (start, 0)
+    while True:
+        rows = cursor.execute('''
+            SELECT id, parking_lot_id, timestamp, IFNULL(estimated_cost, 0),
+                   CAST(strftime('%s', timestamp) AS INTEGER), CAST(strftime('%s', released_at) AS INTEGER)
+            FROM all_bookings
+            WHERE (timestamp, id) > (?, ?) AND timestamp < ? AND active = 0
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''', (after[0], after[1], end, batch_size)).fetchall()
+        if not rows:
+            return
+        after = (rows[-1][2], rows[-1][0])
+        rows = [row for row in rows if row[5] is not None]
+        if not rows:
+            continue
+        ids, lots, _, billed, started, released = (np.array(column) for column in zip(*rows))
+        # Group the batch by lot with one sort, then price each group at once
+        order = np.argsort(lots, kind='stable')
+        ids, lots, billed, started, released = ids[order], lots[order], billed[order], started[order], released[order]
+        lot_ids, firsts = np.unique(lots, return_index=True)
+        for lot_id, first, last in zip(lot_ids.tolist(), firsts, list(firsts[1:]) + [len(lots)]):
+            if lot_id not in tariffs:
+                tariffs[lot_id] = load(conn, lot_id)
+            if tariffs[lot_id] is None:
+                continue  # the lot has been deleted
+            yield (ids[first:last], billed[first:last].astype(float),
+                   tariffs[lot_id].cost_many(started[first:last], released[first:last]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-price a month of closed bookings with the current tariffs.')
+    parser.add_argument('--db', default='database/users.db')
+    parser.add_argument('month', help='YYYY-MM')
+    parser.add_argument('--show', action='store_true', help='print every booking whose price differs')
+    parser.add_argument('--archive', help='archive file (default: $PARKING_ARCHIVE_DATABASE, '
+                        'else next to --db with an -archive suffix)')
+    args = parser.parse_args()
+
+    import numpy as np
+
+    first = datetime.strptime(args.month, '%Y-%m')
+    following = first.replace(year=first.year + first.month // 12, month=first.month % 12 + 1)
+    conn = db.connect(args.db, archive_path=args.archive)
+    count = differ = 0
+    billed_total = repriced_total = 0.0
+    for ids, billed, repriced in reprice(conn, str(first), str(following)):
+        count += len(ids)
+        billed_total += billed.sum()
+        repriced_total += repriced.sum()
+        changed = np.abs(billed - repriced) >= 0.005
+        differ += int(changed.sum())
+        if args.show:
+            for booking_id, old, new in zip(ids[changed], billed[changed], repriced[changed]):
+                print('%d,%.2f,%.2f' % (booking_id, old, new))
+    conn.close()
+    print('%d bookings, %d priced differently, billed %.2f, repriced %.2f'
+          % (count, differ, billed_total, repriced_total), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()